@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Benchmark HTML Preprocessing Engines
+
+Reports per-page latency and peak memory of each process_html engine over a
+set of HTML files. That the engines reproduce the golden output is checked by
+tests/test_html_preprocess.py.
+
+Usage:
+    python scripts/bench_html_preprocess.py [--iterations N] [page.html ...]
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import time
+
+# Add src to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from CrawlToW3C.html_preprocess import ENGINES, process_html
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(__file__), '..', 'examples')
+EXAMPLE_PAGE = os.path.join(EXAMPLES_DIR, 'example.html')
+
+
+def _bench_engine(engine, pages, iterations, results):
+    # Runs in a fresh process so max RSS reflects this engine only
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = []
+    for _ in range(iterations):
+        for html in pages:
+            start = time.perf_counter()
+            process_html(html, engine=engine)
+            timings.append(time.perf_counter() - start)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((engine, timings, peak_kb - baseline_kb))
+
+
+def bench(pages, iterations):
+    ctx = multiprocessing.get_context('spawn')
+    for engine in ENGINES:
+        results = ctx.Queue()
+        process = ctx.Process(target=_bench_engine, args=(engine, pages, iterations, results))
+        process.start()
+        engine, timings, peak_kb = results.get()
+        process.join()
+
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) >= 20 else timings[-1]
+        print(f"{engine:>5}: mean {statistics.mean(timings) * 1000:8.3f} ms/page  "
+              f"p50 {statistics.median(timings) * 1000:8.3f} ms  "
+              f"p95 {p95 * 1000:8.3f} ms  "
+              f"peak RSS +{peak_kb / 1024:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark process_html engines")
+    parser.add_argument('pages', nargs='*', default=[EXAMPLE_PAGE], help="HTML files to benchmark")
+    parser.add_argument('--iterations', type=int, default=200, help="Passes over the pages per engine")
+    args = parser.parse_args()
+
+    pages = []
+    for path in args.pages:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            pages.append(f.read())
+    print(f"Benchmarking {len(pages)} pages x {args.iterations} iterations")
+    bench(pages, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
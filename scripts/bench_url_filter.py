@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark the URL Filter
+
+Runs should_archive over synthetic URLs with the default rules and with large
+generated rule sets (deny-listed hosts, path patterns and per-site rules), to
+check the filter stays cheap as the rules grow.
+
+Usage:
+    python scripts/bench_url_filter.py [--urls N] [--rules N]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+# Add src to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from CrawlToW3C import url_filter
+from CrawlToW3C.seen_store import MemorySeenStore
+from CrawlToW3C.url_rules import compile_rules
+
+WORDS = ["news", "art", "collection", "about", "blog", "events", "shop", "login", "archive", "people",
+         "works", "page", "tag", "search", "admin", "visit", "print", "media", "research", "index.html"]
+QUERIES = ["", "", "", "page=2", "id=17&utm_source=feed", "q=picasso", "sort=date", "s=", "lang=en"]
+
+
+def synthetic_urls(count, hosts, seed=0):
+    rng = random.Random(seed)
+    urls = []
+    for _ in range(count):
+        host = rng.choice(hosts)
+        path = "/".join(rng.choice(WORDS) for _ in range(rng.randint(0, 4)))
+        query = rng.choice(QUERIES)
+        url = f"{rng.choice(('https', 'http'))}://{host}/{path}"
+        urls.append(f"{url}?{query}" if query else url)
+    return urls
+
+
+def generated_rules(count):
+    """Rule set with `count` deny-listed hosts, `count` // 10 path patterns and `count` per-site rules."""
+    return {
+        "denyHosts": [f"tracker{i}.example.net" for i in range(count)] + ["*.ads.example.net"],
+        "denyPaths": ["login", "signup", "admin", "cart", "checkout"]
+                     + [rf"/{WORDS[i % len(WORDS)]}/{i}\b" for i in range(count // 10)],
+        "denyQueryKeys": ["q", "s"],
+        "sites": {
+            f"site{i}.example.org": {"allowPaths": [f"^/{WORDS[i % len(WORDS)]}"], "denyPaths": ["/print$"]}
+            for i in range(count)
+        },
+    }
+
+
+def bench(label, urls):
+    url_filter.set_seen_store(MemorySeenStore())
+    start = time.perf_counter()
+    accepted = sum(1 for url in urls if url_filter.should_archive(url))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {len(urls) / elapsed:>12,.0f} URLs/s  "
+          f"{elapsed / len(urls) * 1e6:6.2f} us/URL  accepted {accepted:,}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark should_archive")
+    parser.add_argument('--urls', type=int, default=1_000_000, help="Synthetic URLs per run")
+    parser.add_argument('--rules', type=int, default=10_000, help="Size of the generated rule set")
+    args = parser.parse_args()
+
+    hosts = ([f"site{i}.example.org" for i in range(0, args.rules, max(1, args.rules // 200))]
+             + [f"tracker{i}.example.net" for i in range(50)]
+             + ["example.com", "www.example.com", "bit.ly", "cdn.ads.example.net"])
+    urls = synthetic_urls(args.urls, hosts)
+    print(f"{len(urls):,} synthetic URLs over {len(hosts)} hosts")
+
+    url_filter.rules = compile_rules()
+    bench("default rules", urls)
+
+    start = time.perf_counter()
+    url_filter.rules = compile_rules(generated_rules(args.rules))
+    print(f"compiled {args.rules:,}-host / {args.rules:,}-site rule set in {time.perf_counter() - start:.2f}s")
+    bench(f"{args.rules:,} generated rules", urls)
+
+
+if __name__ == "__main__":
+    main()
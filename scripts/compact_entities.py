@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Compact Entity Files
+
+Merges every worker-N_entities.jsonl file in the results directory into one
+canonical entity file with one record per (name, type) and the list of pages
+each entity was found on. Memory use is bounded by --run-size.
+
+Usage:
+    python scripts/compact_entities.py [--input-dir DIR] [--output FILE] [--run-size N] [--max-sources N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# Add src to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from CrawlToW3C.entity_compaction import compact_entities, find_entity_files
+
+RESULTS_DIR = "/app/src/CrawlToW3C/results"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge worker entity files into one deduplicated entity file")
+    parser.add_argument('--input-dir', default=RESULTS_DIR, help="Directory holding worker-*_entities.jsonl files")
+    parser.add_argument('--output', default=None,
+                        help="Output file (default: entities.canonical.jsonl in the input directory; .gz compresses)")
+    parser.add_argument('--run-size', type=int, default=200_000, help="Lines sorted in memory at a time")
+    parser.add_argument('--max-sources', type=int, default=1000, help="Sources listed per entity")
+    parser.add_argument('--tmp-dir', default=None, help="Directory for temporary sorted runs")
+    args = parser.parse_args()
+
+    input_paths = find_entity_files(args.input_dir)
+    if not input_paths:
+        print(f"No entity files found in {args.input_dir}")
+        sys.exit(1)
+    output = args.output or os.path.join(args.input_dir, "entities.canonical.jsonl")
+
+    print(f"Compacting {len(input_paths)} entity files: {', '.join(os.path.basename(p) for p in input_paths)}")
+    start = time.perf_counter()
+    stats = compact_entities(input_paths, output, run_size=args.run_size, max_sources=args.max_sources,
+                             tmp_dir=args.tmp_dir)
+    print(f"✓ {stats['input_lines']} entity mentions -> {stats['entities']} entities "
+          f"({stats['runs']} sorted runs) in {time.perf_counter() - start:.1f}s")
+    print(f"✓ Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Export Entities to Parquet
+
+Streams every worker-N_entities.jsonl file in the results directory into a
+single Parquet file for columnar loading and filtering downstream.
+
+Usage:
+    python scripts/export_entities_parquet.py [--input-dir DIR] [--output FILE] [--row-group-size N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# Add src to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from CrawlToW3C.entity_compaction import find_entity_files
+from CrawlToW3C.entity_writer import export_entities_to_parquet
+
+RESULTS_DIR = "/app/src/CrawlToW3C/results"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export worker entity files to Parquet")
+    parser.add_argument('--input-dir', default=RESULTS_DIR, help="Directory holding worker-*_entities.jsonl files")
+    parser.add_argument('--output', default=None, help="Output file (default: entities.parquet in the input directory)")
+    parser.add_argument('--row-group-size', type=int, default=100_000, help="Rows per Parquet row group")
+    args = parser.parse_args()
+
+    input_paths = find_entity_files(args.input_dir)
+    if not input_paths:
+        print(f"No entity files found in {args.input_dir}")
+        sys.exit(1)
+    output = args.output or os.path.join(args.input_dir, "entities.parquet")
+
+    print(f"Exporting {len(input_paths)} entity files: {', '.join(os.path.basename(p) for p in input_paths)}")
+    start = time.perf_counter()
+    stats = export_entities_to_parquet(input_paths, output, row_group_size=args.row_group_size)
+    print(f"✓ {stats['rows']} entities in {stats['row_groups']} row groups in {time.perf_counter() - start:.1f}s")
+    for entity_type, count in sorted(stats['types'].items(), key=lambda item: -item[1]):
+        print(f"  {entity_type}: {count}")
+    print(f"✓ Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,282 +1,1005 @@
+import argparse
 import os
 import json
+import signal
+import threading
 import time
-from CrawlToW3C.process_warc import get_warc_file_paths, iter_html_responses
-from CrawlToW3C.html_preprocess import process_html
-from CrawlToW3C.url_filter import should_archive, clear_seen_urls
-from CrawlToW3C.llms.openai_wrapper import get_client, generate_response
+from CrawlToW3C.process_warc import (
+    get_warc_file_paths, iter_html_responses, iter_html_responses_parallel, read_html_response_at
+)
+from CrawlToW3C.warc_index import has_fresh_index, build_index
+from CrawlToW3C.html_preprocess import process_html, preprocess_version
+from CrawlToW3C.url_filter import (
+    should_archive, clear_seen_urls, configure_url_rules, mark_seen, set_seen_store, seen_store_stats
+)
+from CrawlToW3C.seen_store import make_seen_store
+from CrawlToW3C.near_duplicate import NearDuplicateIndex
+from CrawlToW3C.chunking import split_into_chunks, merge_llm_responses
+from CrawlToW3C.packing import build_packed_prompt, split_packed_response
+from CrawlToW3C.streamed_page import StreamedPage, remaining_entities
+from CrawlToW3C.span_resolver import SpanResolver, expand_response
+from CrawlToW3C.progress_journal import ProgressJournal, ACCEPTED, LLM_DONE, ENTITIES_WRITTEN, UPLOADED, SKIPPED
+from CrawlToW3C.llms.openai_wrapper import get_client
+from CrawlToW3C.llms.dispatcher import LLMDispatcher
+from CrawlToW3C.llms.json_stream import StreamingArrayParser
+from CrawlToW3C.llms.batch import (
+    BatchPreparer, LocalBatchClient, OpenAIBatchClient, batch_request_line, find_batch, list_batches,
+    wait_for_batch, FAILED, FINISHED, INGESTED, PREPARED, SUBMITTED
+)
+from CrawlToW3C.llms.response_cache import ResponseCache, make_cache_key
 from CrawlToW3C.llms.load_system_prompt import load_system_prompt
-from CrawlToW3C.llms.token_count import count_tokens_openai
-from CrawlToW3C.entity_writer import write_entities_to_jsonl
+from CrawlToW3C.llms.token_count import MESSAGE_OVERHEAD_TOKENS
+from CrawlToW3C.entity_writer import EntitySink
+from CrawlToW3C import metrics
+from CrawlToW3C.metrics import MetricsServer, SnapshotWriter
+from CrawlToW3C.pipeline_log import FORMATS as LOG_FORMATS, configure_logging, get_logger
 from dotenv import load_dotenv
 load_dotenv()
 
 # config
-TOKEN_BUDGET = 400000  # gpt-5 allows 500k TPM, leave some headroom
-DELAY = 60
+TOKENS_PER_MINUTE = 400000  # gpt-5 allows 500k TPM, leave some headroom
+REQUESTS_PER_MINUTE = 500
+MAX_IN_FLIGHT = 8  # concurrent LLM requests
+CACHED_TOKEN_WEIGHT = 0.0  # share of a prompt-cached token counted against TOKENS_PER_MINUTE
+MIIIFY_UPLOADS_IN_FLIGHT = 8  # concurrent annotation uploads, running alongside the LLM requests
+MAX_CHUNK_TOKENS = 8000  # pages with more content tokens are split into chunks annotated separately
+PACK_TARGET_TOKENS = 4000  # small pages share one request up to this many content tokens; 0 disables packing
+PACK_MAX_PAGES = 8  # pages per packed request
+STREAM_RESPONSES = False  # stream single-request pages, uploading annotations and writing entities as they complete
+COMPACT_RESPONSES = True  # the LLM returns only text spans; XPath selectors, ids and the W3C structure are added locally
+WARC_READER_PROCESSES = 1  # 1 reads WARC files serially in WARC order; more reads them in spawned processes, ranges interleaved
+BUILD_WARC_INDEX = True  # CDXJ index beside each WARC, lets one large WARC be split across reader processes
+ARCHIVE_DIR = "/app/collections/one/archive"  # the crawl's WARC files
+COLLECTION_ID = "urn:uuid:collection-001"
+CRAWL_CONFIG_PATH = "crawl-config.yaml"  # archiveFilter section holds the URL rules
+MODEL = "gpt-5"
+RESPONSE_CACHE_PATH = "src/CrawlToW3C/results/llm_cache.sqlite"
+RESPONSE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+NEAR_DUPLICATE_THRESHOLD = 0.95  # SimHash similarity at which a page is skipped as a copy of an earlier one
+JOURNAL_PATH = "src/CrawlToW3C/results/progress_journal.jsonl"
+RESUME = True  # skip records completed by an earlier run; False starts the journal afresh
+SEEN_STORE = "memory"  # URL dedupe: "memory" (exact), "bloom" (fixed memory) or "sqlite" (persists across runs)
+SEEN_STORE_PATH = "src/CrawlToW3C/results/seen_urls.sqlite"
+BLOOM_CAPACITY = 1_000_000  # expected distinct URLs for the bloom store
+BLOOM_ERROR_RATE = 0.001  # fraction of new URLs the bloom store wrongly drops as seen
+ENTITY_COMPRESSION = None  # None (plain JSONL), "gzip" or "zstd"
+ENTITY_FLUSH_INTERVAL = 5.0  # seconds entities may stay buffered before they are written
+ENTITY_FSYNC = "close"  # "never", "flush" (every write) or "close"
+BATCH_DIR = "src/CrawlToW3C/results/batches"  # --batch: one directory per Batch API batch
+BATCH_POLL_SECONDS = 60
+LOCAL_BATCH_DIR = "src/CrawlToW3C/results/local_batches"  # --local-batch output files
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")  # WARNING drops the per-URL progress lines
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json" (one object per line)
+METRICS_PORT = None  # e.g. 9108 serves /metrics (Prometheus) and /metrics.json during the run
+METRICS_SNAPSHOT_PATH = None  # e.g. "src/CrawlToW3C/results/metrics.json", rewritten every METRICS_SNAPSHOT_SECONDS
+METRICS_SNAPSHOT_SECONDS = 30
+RUN_REPORT_PATH = "src/CrawlToW3C/results/run_report.json"
+
+log = get_logger()
+
+
+def build_page_metadata(warc_metadata):
+    """Provenance metadata added to every generated AnnotationPage."""
+    return {
+        "partOf": COLLECTION_ID,
+        "created": warc_metadata.get("warc_date"),
+        "generator": {
+            "id": "urn:crawl2w3c:v1",
+            "type": "Software",
+            "name": "Crawl2W3C",
+            "homepage": "https://github.com/jptmoore/crawl2w3c"
+        },
+        "generated": warc_metadata.get("warc_date"),
+        "source": {
+            "warc_record_id": warc_metadata.get("warc_record_id"),
+            "warc_ip_address": warc_metadata.get("warc_ip_address"),
+            "warc_payload_digest": warc_metadata.get("warc_payload_digest"),
+            "http_server": warc_metadata.get("http_server"),
+            "http_last_modified": warc_metadata.get("http_last_modified")
+        }
+    }
+
+
+def build_annotation_page(generated_annotation_page, page_metadata, page_number):
+    """
+    Turn whatever the LLM returned as annotationPage into a proper AnnotationPage.
+
+    Returns None when there are no annotations.
+    """
+    if isinstance(generated_annotation_page, dict) and generated_annotation_page.get("type") == "AnnotationPage":
+        items = generated_annotation_page.get("items", [])
+        if not items:
+            return None
+        # Add an ID and metadata to the AnnotationPage if it doesn't have them
+        if "id" not in generated_annotation_page:
+            generated_annotation_page["id"] = f"urn:uuid:page-{page_number}"
+
+        # Reorder to put metadata after type and before items
+        generated_annotation_page.pop("items", [])
+        generated_annotation_page.update(page_metadata)
+        generated_annotation_page["items"] = items
+        return generated_annotation_page
+
+    if isinstance(generated_annotation_page, dict) and "items" in generated_annotation_page:
+        # Convert to proper AnnotationPage if missing type
+        items = generated_annotation_page["items"]
+    elif isinstance(generated_annotation_page, list):
+        # Wrap array of annotations in AnnotationPage
+        items = generated_annotation_page
+    else:
+        return None
+
+    if not items:
+        return None
+    return {
+        "@context": "http://www.w3.org/ns/anno.jsonld",
+        "type": "AnnotationPage",
+        "id": f"urn:uuid:page-{page_number}",
+        **page_metadata,
+        "items": items
+    }
+
+
+def resume_from_journal(journal, file_paths, uploads):
+    """
+    Skip the leading complete records of each WARC using its index, and
+    restore URL deduplication for the ones that were accepted.
+
+    Returns:
+        (start offset per file, number of records skipped)
+    """
+    start_offsets = {}
+    skipped_count = 0
+    for file_path in file_paths:
+        start_offsets[file_path], skipped = journal.resume_point(file_path, uploads)
+        for entry in skipped:
+            if journal.get(entry["record_id"]).get("accepted"):
+                mark_seen(entry["url"])
+        skipped_count += len(skipped)
+    return start_offsets, skipped_count
+
+
+def iter_page_jobs(file_paths, system_prompt, sys_prompt_gen_tokens, estimator, response_cache, near_duplicates,
+                   preprocess_totals, journal, uploads, stop, start_offsets=None):
+    """
+    Filter and preprocess WARC records in WARC order.
+
+    Yields one job per record; rejected records are not accepted so they
+    keep their place in the output order without calling the LLM. Pages with
+    a cached response skip preprocessing and the LLM call altogether, and
+    near-duplicates of an earlier page are rejected after preprocessing.
+    Pages over MAX_CHUNK_TOKENS get one user prompt per chunk. Prompt tokens saved by nested-block deduplication are added to
+    preprocess_totals.
+
+    Records the journal shows as complete are passed through as resumed;
+    reading stops early once `stop` is set.
+    """
+    if WARC_READER_PROCESSES > 1:
+        responses = iter_html_responses_parallel(
+            file_paths, workers=WARC_READER_PROCESSES, start_offsets=start_offsets
+        )
+    else:
+        responses = iter_html_responses(file_paths, start_offsets=start_offsets)
+
+    try:
+        yield from _iter_page_jobs(
+            responses, system_prompt, sys_prompt_gen_tokens, estimator, response_cache, near_duplicates,
+            preprocess_totals, journal, uploads, stop
+        )
+    finally:
+        # Stops the WARC reader processes when reading ends early
+        responses.close()
+
+
+def _iter_page_jobs(responses, system_prompt, sys_prompt_gen_tokens, estimator, response_cache, near_duplicates,
+                    preprocess_totals, journal, uploads, stop):
+    url_count = 0
+    for url, html, warc_metadata in responses:
+        if stop.is_set():
+            break
+        url_count += 1
+        record_id = warc_metadata.get("warc_record_id")
+        extra = {"page": url_count, "url": str(url)}
+        log.info("\n[%d] Examining URL: %s", url_count, url, extra=extra)
+        job = {
+            "number": url_count,
+            "url": url,
+            "warc_metadata": warc_metadata,
+            "accepted": False,
+            "user_prompts": [],
+            "prompt_tokens": [],
+            "cache_key": None,
+            "cached_response": None,
+            "duplicate_of": None,
+            "resumed": False,
+            "streamed": None,
+            "html": None,
+        }
+
+        if journal.is_complete(record_id, uploads):
+            if journal.get(record_id).get("accepted"):
+                mark_seen(str(url))
+            log.info("  ✓ Already processed by an earlier run, skipping", extra=extra)
+            job["resumed"] = True
+            yield job
+            continue
+
+        # Use heuristic filter for URL-based filtering; a record accepted before a restart stays accepted
+        journaled = journal.get(record_id)
+        if journaled is not None and journaled.get("accepted"):
+            mark_seen(str(url))
+            accepted = True
+        else:
+            accepted = should_archive(str(url)) is True
+            if accepted:
+                journal.mark(record_id, ACCEPTED, url=str(url), accepted=True)
+        if accepted:
+            job["accepted"] = True
+            job["cache_key"] = make_cache_key(
+                warc_metadata.get("warc_payload_digest"), url, system_prompt, MODEL, preprocess_version()
+            )
+            cached_response = response_cache.get(job["cache_key"])
+            if cached_response is not None:
+                log.info("  → Accepted by filter, using cached LLM response", extra=extra)
+                job["cached_response"] = cached_response
+                yield job
+                continue
+
+            preprocess_stats = {}
+            processed_html = process_html(str(html), stats=preprocess_stats)
+            saved_chars = preprocess_stats["legacy_chars"] - preprocess_stats["chars"]
+            saved_tokens = round(saved_chars / estimator.bytes_per_token)
+            preprocess_totals["tokens_saved"] += saved_tokens
+            if saved_tokens:
+                log.info("  → Deduplicated content: ~%d prompt tokens saved (%d%%)",
+                         saved_tokens, saved_chars * 100 // preprocess_stats['legacy_chars'], extra=extra)
+            duplicate_of = near_duplicates.check(processed_html, str(url))
+            if duplicate_of is not None:
+                log.info("  ✗ Near-duplicate of %s, skipping LLM call", duplicate_of, extra=extra)
+                job["accepted"] = False
+                job["duplicate_of"] = duplicate_of
+                journal.mark(record_id, SKIPPED, url=str(url), accepted=True)
+                yield job
+                continue
+
+            # Cheap estimate; only pages near the chunk cap are tokenized exactly
+            content_tokens = estimator.count_near_limit([processed_html], MAX_CHUNK_TOKENS)[0]
+            if content_tokens > MAX_CHUNK_TOKENS:
+                chunks = split_into_chunks(processed_html, MAX_CHUNK_TOKENS, estimator.estimate)
+                log.info("  → Accepted by filter, split into %d chunks for LLM annotation...", len(chunks), extra=extra)
+            else:
+                chunks = [processed_html]
+                log.info("  → Accepted by filter, queued for LLM annotation...", extra=extra)
+            job["user_prompts"] = [f"{str(url)}\n\n{chunk}" for chunk in chunks]
+            if COMPACT_RESPONSES:
+                # Compact responses are expanded against the original DOM
+                job["html"] = str(html)
+            job["prompt_tokens"] = [
+                sys_prompt_gen_tokens + estimator.estimate(prompt) + MESSAGE_OVERHEAD_TOKENS
+                for prompt in job["user_prompts"]
+            ]
+        else:
+            log.info("  ✗ Rejected by filter (URL pattern/extension)", extra=extra)
+            journal.mark(record_id, SKIPPED, url=str(url), accepted=False)
+
+        yield job
+
+
+def iter_llm_requests(jobs):
+    """One (job, chunk index) per LLM request; jobs without a request pass through as (job, None)."""
+    for job in jobs:
+        if job["accepted"] and job["cached_response"] is None:
+            for index in range(len(job["user_prompts"])):
+                yield job, index
+        else:
+            yield job, None
+
+
+# Index of a packed request: the request is a list of (job, chunk index) items
+PACKED = "packed"
+
+
+def pack_llm_requests(requests, sys_prompt_gen_tokens, target_tokens, max_pages):
+    """
+    Combine consecutive small pages into packed requests.
+
+    A page is packable when it is a single chunk of at most half of
+    `target_tokens` content tokens. Packable pages are collected until the
+    next one would take the pack over `target_tokens` or `max_pages`; jobs
+    without a request that arrive meanwhile join the pack so WARC order is
+    kept. A pack is yielded as (items, PACKED), and a pack with a single page
+    as its plain items.
+    """
+    pack = []
+    pages = 0
+    pack_tokens = 0
+
+    def flush():
+        nonlocal pack, pages, pack_tokens
+        if pages > 1:
+            yield pack, PACKED
+        else:
+            yield from pack
+        pack = []
+        pages = 0
+        pack_tokens = 0
+
+    for job, index in requests:
+        if index is None:
+            if pack:
+                pack.append((job, index))
+                # Bound the jobs held back behind a pack that is slow to fill
+                if len(pack) >= 4 * max_pages:
+                    yield from flush()
+            else:
+                yield job, index
+            continue
+        content_tokens = job["prompt_tokens"][index] - sys_prompt_gen_tokens - MESSAGE_OVERHEAD_TOKENS
+        if len(job["user_prompts"]) > 1 or content_tokens > target_tokens // 2:
+            yield from flush()
+            yield job, index
+            continue
+        if pages and (pack_tokens + content_tokens > target_tokens or pages >= max_pages):
+            yield from flush()
+        pack.append((job, index))
+        pages += 1
+        pack_tokens += content_tokens
+    yield from flush()
+
+
+def iter_page_results(dispatcher, annotate, requests):
+    """
+    Run the LLM requests (from iter_llm_requests, optionally packed) and
+    yield (job, responses, error) per page, in WARC order, with the responses
+    for its chunks in chunk order.
+    """
+    responses = []
+    for (job, index), response, error in dispatcher.imap(annotate, requests):
+        if index is PACKED:
+            # `job` is the pack; `response` maps each page's job number to its response
+            for packed_job, packed_index in job:
+                if packed_index is None:
+                    yield packed_job, [packed_job["cached_response"]], None
+                elif error is not None:
+                    yield packed_job, [], error
+                else:
+                    yield packed_job, [response[packed_job["number"]]], None
+            continue
+        if index is None:
+            yield job, [response], error
+            continue
+        if error is not None:
+            # Keep the chunks that did succeed
+            if len(job["user_prompts"]) > 1:
+                log.warning("  ⚠ Error generating annotations for chunk %d of %s: %s", index + 1, job["url"], error,
+                            extra=dict(page_extra(job), chunk=index + 1))
+        else:
+            responses.append(response)
+        if index == len(job["user_prompts"]) - 1:
+            yield job, responses, error if not responses else None
+            responses = []
+
+
+def page_extra(job):
+    """Structured log fields for a page."""
+    return {"page": job["number"], "url": str(job["url"])}
+
+
+def report_streamed_partial(job):
+    """Say what was kept from a streamed response that failed before it was complete."""
+    streamed = job["streamed"]
+    if streamed is not None and streamed.parts:
+        log.info("  ✓ Kept %d annotations and %d entities completed before the response was cut off",
+                 streamed.annotations, streamed.entities, extra=page_extra(job))
+
+
+def journal_streamed_entities(journal, job):
+    """
+    Journal the entities a failed streamed response wrote, once they are
+    flushed, so annotating the page again does not write them twice.
+    """
+    streamed = job["streamed"]
+    if streamed is None or not streamed.entities:
+        return
+    record_id = job["warc_metadata"].get("warc_record_id")
+    streamed.when_entities_flushed(
+        lambda keys: journal.mark(record_id, ACCEPTED, url=str(job["url"]), accepted=True, written_entities=keys)
+    )
+
+
+def parse_llm_responses(responses):
+    """
+    Parse the response (or chunk responses) for one page.
+
+    Returns:
+        (llm_response, response_text) where response_text is what gets cached
+    """
+    if len(responses) == 1:
+        return json.loads(responses[0]), responses[0]
+    parsed = []
+    for response in responses:
+        try:
+            parsed.append(json.loads(response))
+        except json.JSONDecodeError as e:
+            log.warning("  ⚠ Could not parse chunk response: %s", e)
+    if not parsed:
+        raise json.JSONDecodeError("No chunk response could be parsed", "", 0)
+    merged = merge_llm_responses(parsed)
+    return merged, json.dumps(merged, ensure_ascii=False)
+
+
+def batch_manifest_entry(job):
+    """What ingesting a page's batch results needs to know about the page."""
+    return {
+        "number": job["number"],
+        "url": str(job["url"]),
+        "warc_metadata": job["warc_metadata"],
+        "cache_key": job["cache_key"],
+        "chunks": len(job["user_prompts"]),
+    }
+
+
+def job_from_manifest(entry):
+    return {
+        "number": entry["number"],
+        "url": entry["url"],
+        "warc_metadata": entry["warc_metadata"],
+        "accepted": True,
+        "user_prompts": [None] * entry["chunks"],  # the prompts themselves are in the batch input file
+        "prompt_tokens": [],
+        "cache_key": entry["cache_key"],
+        "cached_response": None,
+        "duplicate_of": None,
+        "resumed": False,
+        "streamed": None,
+        "html": None,
+    }
+
+
+def run_batches(batch_client, batches, journal, uploads, usage, stop, expand=None):
+    """
+    Submit the prepared batches, then wait for each in turn and yield
+    (job, responses, error) for its pages as iter_page_results does.
+    `expand(job, responses)` optionally rewrites the responses of each page.
+    """
+    for batch in batches:
+        if stop.is_set():
+            return
+        if batch.status == PREPARED:
+            batch_id = batch_client.submit(batch.input_path, metadata={"description": "crawl2w3c annotations"})
+            batch.save_state(status=SUBMITTED, batch_id=batch_id, submitted=time.time())
+            log.info("Submitted batch %s (%d requests)", batch_id, batch.state['requests'])
+
+    for batch in batches:
+        if batch.status != SUBMITTED:
+            continue
+        log.info("Waiting for batch %s...", batch.batch_id)
+        info = wait_for_batch(batch_client, batch, poll_seconds=BATCH_POLL_SECONDS, stop=stop)
+        if info is None:
+            log.warning("Stopped waiting for batch %s; run again with --batch to resume it", batch.batch_id)
+            return
+        results = batch.read_results()
+        for entry in batch.iter_manifest():
+            job = job_from_manifest(entry)
+            if journal.is_complete(job["warc_metadata"].get("warc_record_id"), uploads):
+                # Ingested before an interruption
+                continue
+            responses = []
+            error = None
+            for index in range(entry["chunks"]):
+                content, chunk_usage, chunk_error = results.get(
+                    f"{entry['number']}:{index}", (None, None, f"no result (batch {info['status']})")
+                )
+                if content is None:
+                    error = chunk_error
+                    if entry["chunks"] > 1:
+                        log.warning("  ⚠ Error generating annotations for chunk %d of %s: %s", index + 1, job["url"],
+                                    error, extra=dict(page_extra(job), chunk=index + 1))
+                    continue
+                responses.append(content)
+                if chunk_usage is not None:
+                    usage.record(chunk_usage)
+            if expand is not None and responses:
+                responses = expand(job, responses)
+            yield job, responses, error if not responses else None
+        # Pages without a result are not journaled as done, so the next run batches them again
+        finished = INGESTED if info["status"] == "completed" else FAILED
+        batch.save_state(status=finished, batch_status=info["status"], ingested=time.time())
+        if finished == FAILED:
+            log.warning("⚠ Batch %s %s: %d of %d requests done; the rest are batched again on the next run",
+                        batch.batch_id, info["status"], info["completed"], info["total"])
+
+
+def iter_batch_page_results(batch_client, jobs, system_prompt, journal, uploads, usage, stop,
+                            batch_ids=None, drain=None, expand=None):
+    """
+    Batch API counterpart of iter_page_results.
+
+    Unfinished batches from earlier runs (or just those in `batch_ids`) are
+    finished first. Then every page that needs the LLM is written into new
+    batches, which are submitted and ingested once done. Pages that need no
+    request (rejected, cached, resumed) are yielded while the batches are
+    prepared, so annotated pages follow batch by batch rather than in WARC
+    order.
+
+    Args:
+        drain: Called after earlier batches are ingested and before pages are
+            read, to finish their entity writes and uploads so the journal
+            shows them complete
+        expand: Passed on to run_batches
+    """
+    if batch_ids:
+        batches = []
+        for batch_id in batch_ids:
+            batch = find_batch(BATCH_DIR, batch_id)
+            if batch is None:
+                log.warning("⚠ Batch %s not found in %s", batch_id, BATCH_DIR)
+            elif batch.status in FINISHED:
+                log.info("Batch %s was already ingested (%s)", batch_id, batch.state.get("batch_status"))
+            else:
+                batches.append(batch)
+    else:
+        batches = [batch for batch in list_batches(BATCH_DIR) if batch.status not in FINISHED]
+    if batches:
+        log.info("Resuming %d unfinished batches", len(batches))
+        yield from run_batches(batch_client, batches, journal, uploads, usage, stop, expand)
+        if drain is not None:
+            drain()
+    if batch_ids or stop.is_set():
+        return
+
+    preparer = BatchPreparer(BATCH_DIR)
+    for job in jobs:
+        if job["accepted"] and job["cached_response"] is None:
+            request_lines = [
+                batch_request_line(f"{job['number']}:{index}", system_prompt, prompt, model=MODEL)
+                for index, prompt in enumerate(job["user_prompts"])
+            ]
+            preparer.add(batch_manifest_entry(job), request_lines)
+        else:
+            yield job, [job["cached_response"]], None
+    batches = preparer.close()
+    if batches:
+        log.info("Prepared %d batches (%d requests) in %s",
+                 len(batches), sum(batch.state['requests'] for batch in batches), BATCH_DIR)
+    yield from run_batches(batch_client, batches, journal, uploads, usage, stop, expand)
+
 
 def main():
+    parser = argparse.ArgumentParser(description="Crawl2W3C annotation pipeline")
+    parser.add_argument("--batch", action="store_true",
+                        help="Annotate through the OpenAI Batch API (cheaper, results within 24h) instead of live requests")
+    parser.add_argument("--batch-id", nargs="+", default=None, metavar="ID",
+                        help="Only finish these earlier batches (implies --batch)")
+    parser.add_argument("--local-batch", action="store_true",
+                        help="Run batches in-process with the live client instead of the Batch API (implies --batch)")
+    parser.add_argument("--log-level", default=LOG_LEVEL, metavar="LEVEL",
+                        help="Logging level; WARNING drops the per-URL progress lines (default: $LOG_LEVEL or INFO)")
+    parser.add_argument("--log-format", default=LOG_FORMAT, choices=LOG_FORMATS,
+                        help="Log line format (default: $LOG_FORMAT or text)")
+    args = parser.parse_args()
+    batch_mode = args.batch or args.local_batch or bool(args.batch_id)
+
+    configure_logging(args.log_level, args.log_format)
+    run_started = time.monotonic()
     print("Starting Crawl2W3C pipeline...")
-    
-    # Clear seen URLs from any previous runs
-    clear_seen_urls()
-    print("Cleared URL cache")
-    
+
+    # Clear seen URLs from any previous runs; a resumed run restores them from the journal.
+    # A persistent store keeps earlier runs' URLs unless the run starts afresh.
+    set_seen_store(make_seen_store(
+        SEEN_STORE, path=SEEN_STORE_PATH, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE
+    ))
+    if SEEN_STORE != "sqlite" or not RESUME:
+        clear_seen_urls()
+        print("Cleared URL cache")
+    configure_url_rules(CRAWL_CONFIG_PATH)
+
+    # Stop reading new records on SIGTERM; pages already in flight are finished and journaled
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        if not stop.is_set():
+            print("\nSIGTERM received: finishing in-flight pages before stopping...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+
     # Check if the archive directory exists before processing
-    archive_dir = "/app/collections/one/archive"
-    if not os.path.exists(archive_dir):
-        print(f"ERROR: Archive directory '{archive_dir}' does not exist. Did the crawl step succeed?")
+    if not os.path.exists(ARCHIVE_DIR):
+        print(f"ERROR: Archive directory '{ARCHIVE_DIR}' does not exist. Did the crawl step succeed?")
         return
-    
+
+    metrics_server = MetricsServer(METRICS_PORT) if METRICS_PORT else None
+    if metrics_server is not None:
+        print(f"Serving metrics on port {metrics_server.port} (/metrics, /metrics.json)")
+    snapshot_writer = (
+        SnapshotWriter(METRICS_SNAPSHOT_PATH, interval=METRICS_SNAPSHOT_SECONDS) if METRICS_SNAPSHOT_PATH else None
+    )
+
     print("Initializing LLM client...")
     llm = get_client()
-    
+    dispatcher = LLMDispatcher(
+        llm,
+        max_in_flight=MAX_IN_FLIGHT,
+        tokens_per_minute=TOKENS_PER_MINUTE,
+        requests_per_minute=REQUESTS_PER_MINUTE,
+        model=MODEL,
+        cached_token_weight=CACHED_TOKEN_WEIGHT
+    )
+    response_cache = ResponseCache(RESPONSE_CACHE_PATH, max_bytes=RESPONSE_CACHE_MAX_BYTES)
+    near_duplicates = NearDuplicateIndex(threshold=NEAR_DUPLICATE_THRESHOLD)
+
     print("Loading WARC files...")
     file_paths = get_warc_file_paths()
     print(f"Found {len(file_paths)} WARC files: {file_paths}")
-    
+    if BUILD_WARC_INDEX:
+        for file_path in file_paths:
+            if not has_fresh_index(file_path):
+                print(f"Indexing {os.path.basename(file_path)}...")
+                build_index(file_path)
+
     print("Loading system prompts...")
-    system_prompt_gen = load_system_prompt("src/CrawlToW3C/llms/system_prompts.yml", "gpt5_generation")
-    sys_prompt_gen_tokens = count_tokens_openai(system_prompt_gen)
+    system_prompt_gen = load_system_prompt(
+        "src/CrawlToW3C/llms/system_prompts.yml", "gpt5_generation_compact" if COMPACT_RESPONSES else "gpt5_generation"
+    )
+    sys_prompt_gen_tokens = dispatcher.count_system_prompt(system_prompt_gen)
+    # Same prefix as the single-page prompt, with the multi-page output format appended
+    system_prompt_packed = system_prompt_gen + load_system_prompt(
+        "src/CrawlToW3C/llms/system_prompts.yml", "gpt5_generation_packing"
+    )
     print(f"System prompt loaded ({sys_prompt_gen_tokens} tokens)")
 
+    journal = ProgressJournal(JOURNAL_PATH, resume=RESUME)
+
     # Initialize Miiify client for incremental uploads
     print("Initializing Miiify client...")
     miiify_client = None
     container_slug = None
-    annotations_uploaded = 0
-    annotations_skipped = 0
-    
+    uploader = None
+
     try:
-        from CrawlToW3C.miiify_client import MiiifyClient, create_container_slug, extract_slug_from_annotation_id
-        
+        from CrawlToW3C.miiify_client import AnnotationUploader, MiiifyClient, create_container_slug
+
         # Give Miiify server a moment to be ready
         time.sleep(5)
-        
+
         # Get optional Host header from environment (should include port for non-standard ports)
         miiify_host = os.getenv('MIIIFY_HOST', 'localhost')
         miiify_port = os.getenv('MIIIFY_PORT', '10000')
         # Build Host header with port for non-standard ports
         host_header = f"{miiify_host}:{miiify_port}"
         print(f"Using Host header: {host_header}")
-        miiify_client = MiiifyClient(base_url="http://miiify:10000", host=host_header)
-        
+        miiify_client = MiiifyClient(base_url="http://miiify:10000", host=host_header,
+                                     pool_maxsize=MIIIFY_UPLOADS_IN_FLIGHT)
+
         # Create container once at the start
         warc_files_str = None
         if file_paths:
             warc_filename = os.path.basename(file_paths[0])
             warc_files_str = warc_filename
-        
-        collection_id = "urn:uuid:collection-001"
-        container_slug = create_container_slug(collection_id, warc_files_str)
-        
+
+        container_slug = create_container_slug(COLLECTION_ID, warc_files_str)
+
         container_metadata = {
             "@context": "http://iiif.io/api/presentation/3/context.json",
             "type": "AnnotationCollection",
             "label": f"Crawl2W3C Annotation Collection - {warc_files_str or 'Unknown WARC'}"
         }
-        
-        miiify_client.create_container(container_slug, container_metadata)
-        print(f"Created Miiify container: {container_slug}")
-        
+
+        if journal.records:
+            # The journal marks the annotations uploaded before a restart as done,
+            # so recreating the container would lose them for good
+            miiify_client.open_container(container_slug, container_metadata)
+            print(f"Resuming in Miiify container: {container_slug}")
+        else:
+            miiify_client.create_container(container_slug, container_metadata)
+            print(f"Created Miiify container: {container_slug}")
+        uploader = AnnotationUploader(miiify_client, container_slug, max_in_flight=MIIIFY_UPLOADS_IN_FLIGHT)
+
     except ImportError:
         print("Miiify client not available - annotations will be lost")
     except Exception as e:
         print(f"Warning: Could not initialize Miiify client: {e}")
         miiify_client = None
 
+    uploads = uploader is not None
+    start_offsets, resumed_count = resume_from_journal(journal, file_paths, uploads)
+    if resumed_count:
+        print(f"Resuming: {resumed_count} records completed by an earlier run are skipped unread")
+
+    entity_sink = EntitySink(
+        compression=ENTITY_COMPRESSION, flush_interval=ENTITY_FLUSH_INTERVAL, fsync=ENTITY_FSYNC
+    )
+
+    def entities_flushed(record_id, url, finish):
+        def on_flushed():
+            journal.mark(record_id, ENTITIES_WRITTEN, url=str(url), accepted=True)
+            finish()
+        return on_flushed
+
+    def uploads_done(finish):
+        def on_complete(errors):
+            finish(ok=not errors)
+        return on_complete
+
     annotation_pages_count = 0
-    token_count = 0
     entities_extracted_count = 0
 
+    pack_totals = {"requests": 0, "pages": 0, "fallbacks": 0}
+    pack_lock = threading.Lock()
+    span_totals = {"spans": 0, "located": 0}
+    span_lock = threading.Lock()
+
+    def expand_compact(content, resolver):
+        stats = {}
+        content = expand_response(content, resolver, stats=stats)
+        with span_lock:
+            for key, value in stats.items():
+                span_totals[key] += value
+        return content
+
+    def page_resolver(job):
+        return SpanResolver(str(job["url"]), job["html"])
+
+    warc_paths = {os.path.basename(file_path): file_path for file_path in file_paths}
+
+    def expand_batch_responses(job, responses):
+        # Batch jobs don't carry the page, so it is read back from its WARC if a span needs locating
+        def read_html():
+            warc_metadata = job["warc_metadata"]
+            warc_path = warc_paths.get(warc_metadata.get("warc_filename"))
+            if warc_path is None or warc_metadata.get("warc_offset") is None:
+                return None
+            response = read_html_response_at(warc_path, warc_metadata["warc_offset"])
+            return response[1] if response is not None else None
+
+        resolver = SpanResolver(str(job["url"]), read_html)
+        return [expand_compact(content, resolver) for content in responses]
+
+    def annotate_pack(pack):
+        pages = [job for job, index in pack if index is not None]
+        page_ids = [f"p{i + 1}" for i in range(len(pages))]
+        prompt = build_packed_prompt([(page_id, job["user_prompts"][0]) for page_id, job in zip(page_ids, pages)])
+        routed = split_packed_response(dispatcher.complete(system_prompt_packed, prompt), page_ids)
+        missing = [page_id for page_id in page_ids if page_id not in routed]
+        with pack_lock:
+            pack_totals["requests"] += 1
+            pack_totals["pages"] += len(pages)
+            pack_totals["fallbacks"] += len(missing)
+        results = {}
+        for page_id, job in zip(page_ids, pages):
+            if page_id in missing:
+                # Left out of the packed response: annotate the page on its own
+                routed[page_id] = dispatcher.complete(system_prompt_gen, job["user_prompts"][0], job["prompt_tokens"][0])
+            results[job["number"]] = expand_compact(routed[page_id], page_resolver(job))
+        return results
+
+    def annotate(request):
+        job, index = request
+        if index is None:
+            return job["cached_response"]
+        if index is PACKED:
+            return annotate_pack(job)
+        on_text = None
+        resolver = page_resolver(job)
+        if STREAM_RESPONSES and len(job["user_prompts"]) == 1:
+            # Upload annotations and write entities as they complete in the stream
+            record_id = job["warc_metadata"].get("warc_record_id")
+            streamed = StreamedPage(
+                job["url"], job["warc_metadata"], uploader,
+                None if journal.reached(record_id, ENTITIES_WRITTEN) else entity_sink,
+                written_entities=(journal.get(record_id) or {}).get("written_entities", ())
+            )
+            job["streamed"] = streamed
+            on_text = StreamingArrayParser({
+                ("annotationPage", "items"): streamed.on_annotation,
+                ("spans",): lambda span: streamed.on_annotation(resolver.annotation(span)),
+                ("entities",): streamed.on_entity,
+            }).feed
+        content = dispatcher.complete(
+            system_prompt_gen, job["user_prompts"][index], job["prompt_tokens"][index], on_text=on_text
+        )
+        return expand_compact(content, resolver)
+
+    def drain_outputs():
+        entity_sink.flush()
+        if uploader:
+            uploader.join()
+
     print("="*60)
-    print("Starting to process URLs from WARC files...")
+    if batch_mode:
+        print(f"Starting to process URLs from WARC files (Batch API{', local' if args.local_batch else ''})...")
+    else:
+        print(f"Starting to process URLs from WARC files ({MAX_IN_FLIGHT} LLM requests in flight)...")
     print("="*60)
     url_count = 0
-    for url, html, warc_metadata in iter_html_responses(file_paths):
-        url_count += 1
-        print(f"\n[{url_count}] Examining URL: {url}")
-        
-        generated_annotation = None
-        processed_html = None
-
-        # Use heuristic filter for URL-based filtering
-        heuristic_decision = should_archive(str(url))
-
-        if heuristic_decision is True:
-            print(f"  → Accepted by filter, processing content...")
-            original_html = str(html)
-            processed_html = process_html(original_html)
-            processed_html = f"{str(url)}\n\n{processed_html}"
-            processed_html_tokens = count_tokens_openai(processed_html)
-
-            # Generate annotations - LLM will decide what's worth annotating
-            gen_prompt_tokens = sys_prompt_gen_tokens + processed_html_tokens
-
-            if token_count + gen_prompt_tokens > TOKEN_BUDGET:
-                print(f"  ⚠ Token budget reached, sleeping for {DELAY} seconds...")
-                time.sleep(DELAY)
-                token_count = 0
-
-            print(f"  → Calling LLM to generate annotations...")
-            generated_annotation = generate_response(
-                llm=llm,
-                system_prompt=system_prompt_gen,
-                user_prompt=processed_html
-            )
+    preprocess_totals = {"tokens_saved": 0}
+    jobs = iter_page_jobs(
+        file_paths, system_prompt_gen, sys_prompt_gen_tokens, dispatcher.estimator, response_cache, near_duplicates,
+        preprocess_totals, journal, uploads, stop, start_offsets
+    )
+    if batch_mode:
+        batch_client = LocalBatchClient(llm, LOCAL_BATCH_DIR) if args.local_batch else OpenAIBatchClient(llm)
+        page_results = iter_batch_page_results(
+            batch_client, jobs, system_prompt_gen, journal, uploads, dispatcher.usage, stop,
+            batch_ids=args.batch_id, drain=drain_outputs, expand=expand_batch_responses
+        )
+    else:
+        requests = iter_llm_requests(jobs)
+        if PACK_TARGET_TOKENS:
+            requests = pack_llm_requests(requests, sys_prompt_gen_tokens, PACK_TARGET_TOKENS, PACK_MAX_PAGES)
+        page_results = iter_page_results(dispatcher, annotate, requests)
+    try:
+        for job, responses, error in page_results:
+            # Batch results arrive after the pages read while the batches were prepared
+            url_count = max(url_count, job["number"])
+            if job["resumed"]:
+                resumed_count += 1
+            if not job["accepted"]:
+                continue
+
+            url = job["url"]
+            warc_metadata = job["warc_metadata"]
+            record_id = warc_metadata.get("warc_record_id")
+            extra = page_extra(job)
+            log.info("\n[%d] LLM response for: %s", job["number"], url, extra=extra)
+            streamed = job["streamed"]
+            if error is not None:
+                log.warning("  ⚠ Error generating annotations: %s", error, extra=extra)
+                report_streamed_partial(job)
+                journal_streamed_entities(journal, job)
+                continue
 
             # Parse the response - now contains both annotationPage and entities
-            llm_response = json.loads(generated_annotation)
+            try:
+                llm_response, generated_annotation = parse_llm_responses(responses)
+            except json.JSONDecodeError as e:
+                log.warning("  ⚠ Could not parse LLM response: %s", e, extra=extra)
+                report_streamed_partial(job)
+                journal_streamed_entities(journal, job)
+                continue
+            if job["cached_response"] is None and len(responses) == len(job["user_prompts"]):
+                response_cache.put(job["cache_key"], generated_annotation)
+                journal.mark(record_id, LLM_DONE, url=str(url), accepted=True)
             generated_annotation_page = llm_response.get("annotationPage", {})
             extracted_entities = llm_response.get("entities", [])
-            
-            # Write entities to JSONL if any were extracted
-            if extracted_entities:
-                try:
-                    entity_file = write_entities_to_jsonl(
-                        entities=extracted_entities,
-                        url=url,
-                        warc_metadata=warc_metadata
-                    )
-                    entities_extracted_count += len(extracted_entities)
-                    print(f"  ✓ Extracted {len(extracted_entities)} entities to {os.path.basename(entity_file)}")
-                except Exception as e:
-                    print(f"  ⚠ Error writing entities: {e}")
-
-            completion_tokens = count_tokens_openai(generated_annotation) if generated_annotation else 0
-            token_count += gen_prompt_tokens + completion_tokens
-
-            if token_count > TOKEN_BUDGET:
-                time.sleep(DELAY)
-                token_count = 0
-            
-            # Add metadata to the AnnotationPage
-            collection_id = "urn:uuid:collection-001"
-            page_metadata = {
-                "partOf": collection_id,
-                "created": warc_metadata.get("warc_date"),
-                "generator": {
-                    "id": "urn:crawl2w3c:v1",
-                    "type": "Software",
-                    "name": "Crawl2W3C",
-                    "homepage": "https://github.com/jptmoore/crawl2w3c"
-                },
-                "generated": warc_metadata.get("warc_date"),
-                "source": {
-                    "warc_record_id": warc_metadata.get("warc_record_id"),
-                    "warc_ip_address": warc_metadata.get("warc_ip_address"),
-                    "warc_payload_digest": warc_metadata.get("warc_payload_digest"),
-                    "http_server": warc_metadata.get("http_server"),
-                    "http_last_modified": warc_metadata.get("http_last_modified")
-                }
-            }
 
             # Add the AnnotationPage to the collection (only if it has items)
-            if isinstance(generated_annotation_page, dict) and generated_annotation_page.get("type") == "AnnotationPage":
-                items = generated_annotation_page.get("items", [])
-                # Only add if there are actual annotations
-                if items:
-                    print(f"  ✓ Generated {len(items)} annotations")
-                    annotation_pages_count += 1
-                    # Add an ID and metadata to the AnnotationPage if it doesn't have them
-                    if "id" not in generated_annotation_page:
-                        generated_annotation_page["id"] = f"urn:uuid:page-{annotation_pages_count}"
-                    
-                    # Reorder to put metadata after type and before items
-                    generated_annotation_page.pop("items", [])
-                    generated_annotation_page.update(page_metadata)
-                    generated_annotation_page["items"] = items
-                    
-                    # Upload to Miiify immediately
-                    if miiify_client and container_slug:
-                        print(f"  → Uploading {len(items)} annotations to Miiify...")
-                        for annotation in items:
-                            if 'id' in annotation:
-                                try:
-                                    annotation_slug = extract_slug_from_annotation_id(annotation['id'])
-                                    result = miiify_client.upload_annotation(container_slug, annotation_slug, annotation)
-                                    if isinstance(result, dict) and result.get('skipped'):
-                                        annotations_skipped += 1
-                                    else:
-                                        annotations_uploaded += 1
-                                except Exception as e:
-                                    print(f"    ⚠ Error uploading annotation: {e}")
-                else:
-                    print(f"  ✗ No annotations generated (content not substantial enough)")
-            elif isinstance(generated_annotation_page, dict) and "items" in generated_annotation_page:
-                items = generated_annotation_page["items"]
-                # Only add if there are actual annotations
-                if items:
-                    print(f"  ✓ Generated {len(items)} annotations")
-                    annotation_pages_count += 1
-                    # Convert to proper AnnotationPage if missing type
-                    page = {
-                        "@context": "http://www.w3.org/ns/anno.jsonld",
-                        "type": "AnnotationPage",
-                        "id": f"urn:uuid:page-{annotation_pages_count}",
-                        **page_metadata,
-                        "items": items
-                    }
-                    
-                    # Upload to Miiify immediately
-                    if miiify_client and container_slug:
-                        print(f"  → Uploading {len(items)} annotations to Miiify...")
-                        for annotation in items:
-                            if 'id' in annotation:
-                                try:
-                                    annotation_slug = extract_slug_from_annotation_id(annotation['id'])
-                                    result = miiify_client.upload_annotation(container_slug, annotation_slug, annotation)
-                                    if isinstance(result, dict) and result.get('skipped'):
-                                        annotations_skipped += 1
-                                    else:
-                                        annotations_uploaded += 1
-                                except Exception as e:
-                                    print(f"    ⚠ Error uploading annotation: {e}")
-                else:
-                    print(f"  ✗ No annotations generated (content not substantial enough)")
-            elif isinstance(generated_annotation_page, list) and generated_annotation_page:
-                # Only add if there are actual annotations
-                print(f"  ✓ Generated {len(generated_annotation_page)} annotations")
-                annotation_pages_count += 1
-                # Wrap array of annotations in AnnotationPage
-                page = {
-                    "@context": "http://www.w3.org/ns/anno.jsonld",
-                    "type": "AnnotationPage",
-                    "id": f"urn:uuid:page-{annotation_pages_count}",
-                    **page_metadata,
-                    "items": generated_annotation_page
-                }
-                
-                # Upload to Miiify immediately
-                if miiify_client and container_slug:
-                    print(f"  → Uploading {len(generated_annotation_page)} annotations to Miiify...")
-                    for annotation in generated_annotation_page:
-                        if 'id' in annotation:
-                            try:
-                                annotation_slug = extract_slug_from_annotation_id(annotation['id'])
-                                result = miiify_client.upload_annotation(container_slug, annotation_slug, annotation)
-                                if isinstance(result, dict) and result.get('skipped'):
-                                    annotations_skipped += 1
-                                else:
-                                    annotations_uploaded += 1
-                            except Exception as e:
-                                print(f"    ⚠ Error uploading annotation: {e}")
+            page = build_annotation_page(
+                generated_annotation_page,
+                build_page_metadata(warc_metadata),
+                annotation_pages_count + 1
+            )
+
+            # Entities and annotations handed on while the response streamed, or by an earlier
+            # response that failed part way, are not sent again
+            if streamed is not None:
+                new_entities = streamed.remaining_entities(extracted_entities)
+                streamed_parts = streamed.parts
             else:
-                print(f"  ✗ No annotations generated (content not substantial enough)")
-        else:
-            print(f"  ✗ Rejected by filter (URL pattern/extension)")
+                new_entities = remaining_entities(
+                    extracted_entities, (journal.get(record_id) or {}).get("written_entities", ())
+                )
+                streamed_parts = 0
+
+            # The record is finished once its entities are flushed and its annotations uploaded
+            write_entities = bool(new_entities) and not journal.reached(record_id, ENTITIES_WRITTEN)
+            upload = page is not None and uploader is not None
+            if page is None:
+                final_stage = SKIPPED
+            elif uploader:
+                final_stage = UPLOADED
+            else:
+                final_stage = ENTITIES_WRITTEN
+            finish = journal.mark_after(
+                record_id, final_stage, write_entities + upload + streamed_parts, url=str(url), accepted=True
+            )
+            if streamed is not None:
+                streamed.attach(finish)
+
+            # Write entities to JSONL if any were extracted (and not already written before a restart)
+            if journal.reached(record_id, ENTITIES_WRITTEN):
+                log.info("  ✓ Entities already written by an earlier run", extra=extra)
+            else:
+                if streamed is not None and streamed.entities:
+                    entities_extracted_count += streamed.entities
+                    log.info("  ✓ Extracted %d entities while the response streamed", streamed.entities, extra=extra)
+                if write_entities:
+                    try:
+                        entity_file = entity_sink.write(
+                            entities=new_entities,
+                            url=url,
+                            warc_metadata=warc_metadata,
+                            on_flushed=finish if final_stage == ENTITIES_WRITTEN else entities_flushed(record_id, url, finish)
+                        )
+                        entities_extracted_count += len(new_entities)
+                        log.info("  ✓ Extracted %d entities to %s", len(new_entities), os.path.basename(entity_file),
+                                 extra=extra)
+                    except Exception as e:
+                        log.warning("  ⚠ Error writing entities: %s", e, extra=extra)
+
+            if page is None:
+                log.info("  ✗ No annotations generated (content not substantial enough)", extra=extra)
+                continue
+
+            items = page["items"]
+            log.info("  ✓ Generated %d annotations", len(items), extra=extra)
+            annotation_pages_count += 1
+
+            # Upload to Miiify in the background while the next pages are annotated
+            if uploader:
+                if streamed is not None and streamed.annotations:
+                    log.info("  ✓ %d annotations were uploaded while the response streamed", streamed.annotations,
+                             extra=extra)
+                    items = streamed.remaining_annotations(items)
+                if items:
+                    log.info("  → Uploading %d annotations to Miiify...", len(items), extra=extra)
+                uploader.submit(items, on_complete=uploads_done(finish))
+    finally:
+        # Drain in-flight LLM requests, uploads and entity writes before the journal is flushed
+        dispatcher.close()
+        upload_counts = uploader.close() if uploader else None
+        entity_sink.close()
+        journal.close()
+        if snapshot_writer is not None:
+            snapshot_writer.close()
+        if metrics_server is not None:
+            metrics_server.close()
+    cache_stats = response_cache.stats()
+    response_cache.close()
+    report = metrics.run_report(
+        time.monotonic() - run_started, url_count, usage=dispatcher.usage.summary(),
+        throttled_seconds=dispatcher.limiter.throttled_seconds,
+        extra={
+            "pages_annotated": annotation_pages_count,
+            "entities": entities_extracted_count,
+            "pages_resumed": resumed_count,
+            "response_cache": cache_stats,
+            "near_duplicates_skipped": near_duplicates.calls_saved,
+            "stopped_early": stop.is_set(),
+        }
+    )
+    metrics.write_json(RUN_REPORT_PATH, report)
 
     print("="*60)
     print(f"COMPLETED: Processed {url_count} URLs")
     print(f"Generated annotations from {annotation_pages_count} URLs")
     print(f"Extracted {entities_extracted_count} entities for RAG")
+    usage = dispatcher.usage.summary()
+    print(f"Billed tokens: {usage['prompt_tokens']} prompt, {usage['completion_tokens']} completion "
+          f"({usage['reasoning_tokens']} reasoning) over {usage['requests']} requests")
+    print(f"Prompt cache: {usage['cached_tokens']} of {usage['prompt_tokens']} prompt tokens cached "
+          f"({usage['cache_hit_rate']:.0%}), {usage['effective_tokens']} effective billed tokens")
+    print(f"Time spent waiting on rate limits: {dispatcher.limiter.throttled_seconds:.1f}s")
+    print(f"LLM response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    print(f"Prompt tokens saved by content deduplication: ~{preprocess_totals['tokens_saved']}")
+    print(f"Near-duplicate pages skipped: {near_duplicates.calls_saved} LLM calls saved")
+    if span_totals["spans"]:
+        print(f"Compact responses: {span_totals['located']} of {span_totals['spans']} spans located in the page DOM "
+              f"({span_totals['spans'] - span_totals['located']} kept with a TextQuoteSelector)")
+    if pack_totals["requests"]:
+        print(f"Packed {pack_totals['pages']} small pages into {pack_totals['requests']} requests "
+              f"({pack_totals['fallbacks']} annotated on their own after being left out)")
+    seen_stats = seen_store_stats()
+    print(f"URL dedupe ({SEEN_STORE}): {seen_stats['lookups']} lookups, {seen_stats['hits']} duplicates, "
+          f"{seen_stats['memory_bytes'] / 1024:.0f} KiB")
+    if resumed_count:
+        print(f"Resumed: {resumed_count} records already completed by an earlier run")
+    if stop.is_set():
+        print("Stopped early on SIGTERM; run again to resume")
+    print(f"Throughput: {report['pages_per_second']} pages/s, {report['tokens_per_second']} tokens/s "
+          f"over {report['elapsed_seconds']:.1f}s")
+    print("Time per stage:")
+    for line in metrics.format_stage_table(report):
+        print(line)
+    print(f"Run report written to {RUN_REPORT_PATH}")
     print("="*60)
 
     # Report Miiify upload results
-    if miiify_client and container_slug:
-        msg = f"✓ Uploaded {annotations_uploaded} annotations to container: {container_slug}"
-        if annotations_skipped > 0:
-            msg += f" (skipped {annotations_skipped} duplicates)"
+    if upload_counts:
+        msg = f"✓ Uploaded {upload_counts['uploaded']} annotations to container: {container_slug}"
+        if upload_counts['skipped'] > 0:
+            msg += f" (skipped {upload_counts['skipped']} duplicates)"
         print(msg)
 
 
@@ -1,14 +1,21 @@
 from CrawlToW3C.process_warc import get_warc_file_paths, iter_html_responses
-from CrawlToW3C.html_preprocess import process_html
-from CrawlToW3C.url_filter import should_archive
-from CrawlToW3C.llms.openai_wrapper import get_client, generate_response
+from CrawlToW3C.html_preprocess import process_html, preprocess_version
+from CrawlToW3C.url_filter import should_archive, configure_url_rules
+from CrawlToW3C.llms.openai_wrapper import get_client, create_completion
 from CrawlToW3C.llms.load_system_prompt import load_system_prompt
-from CrawlToW3C.llms.token_count import count_tokens_openai
+from CrawlToW3C.llms.token_count import count_tokens_openai, TokenEstimator, MESSAGE_OVERHEAD_TOKENS
+from CrawlToW3C.llms.token_accounting import UsageTotals, budget_tokens
+from CrawlToW3C.llms.response_cache import ResponseCache, make_cache_key
+from CrawlToW3C.llms.url_selection import DECISIONS, DecisionCache, UrlSelector
 from CrawlToW3C.entity_writer import write_entities_to_jsonl
+from CrawlToW3C.parquet_parts import ParquetPartWriter, list_parts, merge_parts, read_column
+from CrawlToW3C.checkpoint_index import CheckpointIndex
+from CrawlToW3C.pipeline_log import configure_logging, get_logger
 
 import json
+import os
 import time
-import pandas as pd
+import pyarrow as pa
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -16,127 +23,305 @@ load_dotenv()
 
 # config
 TOKEN_BUDGET = 30000
+CACHED_TOKEN_WEIGHT = 0.0  # share of a prompt-cached token counted against TOKEN_BUDGET
 DELAY = 60
 RESULTS_DIR = Path("src/CrawlToW3C/results")
-CHECKPOINT_JSONL = RESULTS_DIR / "analysis.jsonl"
+CHECKPOINT_JSONL = RESULTS_DIR / "analysis.jsonl"  # written by earlier versions; migrated into the parts
+CHECKPOINT_PARTS_DIR = RESULTS_DIR / "analysis_parts"
 FINAL_PARQUET = RESULTS_DIR / "analysis.parquet"
-STATE_FILE = RESULTS_DIR / "state.json"
+ROWS_PER_PART = 500  # rows buffered per Parquet part file (one row group)
+PARQUET_COMPRESSION = "zstd"
+STATE_FILE = RESULTS_DIR / "state.json"  # written by earlier versions; state now lives in the index
+CHECKPOINT_INDEX_PATH = RESULTS_DIR / "checkpoint_index.sqlite"
+RESPONSE_CACHE_PATH = RESULTS_DIR / "llm_cache.sqlite"
+URL_SELECTION_BATCH_SIZE = 50  # URLs per selection request; 1 asks about each URL on its own
+URL_DECISION_CACHE_PATH = RESULTS_DIR / "url_decisions.sqlite"
+CRAWL_CONFIG_PATH = "crawl-config.yaml"
+MODEL = "gpt-5"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")  # WARNING drops the per-URL progress lines, DEBUG adds the responses
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json" (one object per line)
 
+log = get_logger()
 
-def load_state():
+
+def load_state(index):
+    state = index.load_state()
+    if state is not None:
+        return state
     if STATE_FILE.exists():
         with open(STATE_FILE, "r", encoding="utf-8") as f:
             return json.load(f)
     return {"token_count": 0}
 
 
-def save_state(state):
-    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
-    with open(STATE_FILE, "w", encoding="utf-8") as f:
-        json.dump(state, f)
+def save_state(index, state):
+    index.save_state(state)
+
+
+# Raw HTML is not stored: warc_filename + warc_offset locate the record for
+# process_warc.read_html_response_at
+ANALYSIS_SCHEMA = pa.schema([
+    ("url", pa.string()),
+    ("warc_filename", pa.dictionary(pa.int32(), pa.string())),
+    ("warc_offset", pa.int64()),
+    ("warc_length", pa.int64()),
+    ("warc_record_id", pa.string()),
+    ("heuristic_decision", pa.bool_()),
+    ("llm_decision", pa.dictionary(pa.int32(), pa.string())),
+    ("processed_html", pa.string()),
+    ("generated_annotation", pa.string()),
+])
+
 
+def _text_or_none(value):
+    return value if isinstance(value, str) else None
 
-def append_checkpoint(record):
-    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
-    with open(CHECKPOINT_JSONL, "a", encoding="utf-8") as f:
-        f.write(json.dumps(record, ensure_ascii=False) + "\n")
 
+def iter_legacy_checkpoint_rows():
+    """
+    Rows of analysis.jsonl as ANALYSIS_SCHEMA rows. The raw HTML these rows
+    stored is dropped: the schema keeps a WARC location instead, which the
+    legacy rows do not have.
+    """
+    with open(CHECKPOINT_JSONL, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(obj, dict) or "url" not in obj:
+                continue
+            heuristic_decision = obj.get("heuristic_decision")
+            yield {
+                "url": str(obj["url"]),
+                "heuristic_decision": heuristic_decision if isinstance(heuristic_decision, bool) else None,
+                "llm_decision": _text_or_none(obj.get("llm_decision")),
+                "processed_html": _text_or_none(obj.get("processed_html")),
+                "generated_annotation": _text_or_none(obj.get("generated_annotation")),
+            }
+
+
+def migrate_legacy_checkpoint(index):
+    """
+    Move the rows of analysis.jsonl into committed Parquet parts, so they are
+    indexed and end up in analysis.parquet, then rename the file to
+    analysis.jsonl.migrated. Rows already indexed are skipped, so an
+    interrupted migration carries on where it stopped.
+    """
+    migrated = ParquetPartWriter(
+        str(CHECKPOINT_PARTS_DIR), ANALYSIS_SCHEMA, rows_per_part=ROWS_PER_PART, compression=PARQUET_COMPRESSION,
+        on_commit=index.commit_part
+    )
+    rows = 0
+    for row in iter_legacy_checkpoint_rows():
+        if index.is_processed(row["url"]):
+            continue
+        migrated.write(row)
+        rows += 1
+    migrated.close()
+    os.replace(CHECKPOINT_JSONL, f"{CHECKPOINT_JSONL}.migrated")
+    print(f"Checkpoint: migrated {rows} rows from {CHECKPOINT_JSONL.name} into {CHECKPOINT_PARTS_DIR.name}/")
 
-def read_processed_urls():
-    processed = set()
+
+def open_checkpoint_index():
+    """
+    Open the checkpoint index, repair the part directory after a crash and,
+    the first time, index parts written before the index existed and migrate
+    the rows of analysis.jsonl.
+    """
+    index = CheckpointIndex(str(CHECKPOINT_INDEX_PATH))
+    repaired = index.recover(str(CHECKPOINT_PARTS_DIR))
+    if repaired["recovered"] or repaired["removed"]:
+        print(f"Checkpoint: {repaired['recovered']} committed parts restored, "
+              f"{repaired['removed']} uncommitted parts discarded")
+
+    if not index.committed_parts() and len(index) == 0:
+        legacy_parts = list_parts(str(CHECKPOINT_PARTS_DIR))
+        for path in legacy_parts:
+            index.add_urls(read_column(path, "url"), part_name=os.path.basename(path))
+        if STATE_FILE.exists() and index.load_state() is None:
+            save_state(index, load_state(index))
+        if len(index):
+            print(f"Checkpoint: indexed {len(index)} URLs from existing checkpoint files")
     if CHECKPOINT_JSONL.exists():
-        with open(CHECKPOINT_JSONL, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    obj = json.loads(line)
-                    if "url" in obj:
-                        processed.add(obj["url"])
-                except Exception:
-                    continue
-    return processed
+        migrate_legacy_checkpoint(index)
+    return index
+
+
+def iter_selection_windows(records, index, batch_size):
+    """
+    Group unprocessed records into windows holding up to `batch_size` URLs
+    that pass should_archive, so one selection request covers a window.
+    Rejected records ride along in order; a window is also closed after
+    4 * batch_size records to bound the HTML held in memory.
+    """
+    window = []
+    candidates = 0
+    for url, html, warc_metadata in records:
+        if index.is_processed(url):
+            continue
+        heuristic_decision = should_archive(str(url))
+        window.append((url, html, warc_metadata, heuristic_decision))
+        candidates += heuristic_decision is True
+        if candidates >= batch_size or len(window) >= 4 * batch_size:
+            yield window
+            window = []
+            candidates = 0
+    if window:
+        yield window
 
 
 def finalise_parquet():
-    if CHECKPOINT_JSONL.exists():
-        df = pd.read_json(CHECKPOINT_JSONL, lines=True)
-        df.to_parquet(FINAL_PARQUET, index=False)
+    """Merge the checkpoint parts into analysis.parquet, one row group at a time."""
+    rows = merge_parts(str(CHECKPOINT_PARTS_DIR), FINAL_PARQUET, compression=PARQUET_COMPRESSION)
+    if rows:
+        print(f"Wrote {rows} rows to {FINAL_PARQUET}")
 
 
 def main():
+    configure_logging(LOG_LEVEL, LOG_FORMAT)
+    configure_url_rules(CRAWL_CONFIG_PATH)
     llm = get_client()
     file_paths = get_warc_file_paths()
     system_prompt_gen = load_system_prompt("src/CrawlToW3C/llms/system_prompts.yml", "gpt5_generation")
     system_prompt_filter = load_system_prompt("src/CrawlToW3C/llms/system_prompts.yml", "gpt5_url_selection")
-    sys_prompt_tokens = count_tokens_openai(system_prompt_gen)
+    system_prompt_filter_batch = load_system_prompt("src/CrawlToW3C/llms/system_prompts.yml", "gpt5_url_selection_batch")
+    sys_prompt_tokens = count_tokens_openai(system_prompt_gen, model=MODEL)
+    estimator = TokenEstimator(model=MODEL)
+    usage_totals = UsageTotals()
 
-    state = load_state()
+    index = open_checkpoint_index()
+    state = load_state(index)
     token_count = int(state.get("token_count", 0))
-    processed_urls = read_processed_urls()
+    response_cache = ResponseCache(str(RESPONSE_CACHE_PATH))
+    decision_cache = DecisionCache(str(URL_DECISION_CACHE_PATH))
+    selector = UrlSelector(
+        llm, system_prompt_filter_batch, system_prompt_filter, model=MODEL,
+        cache=decision_cache, usage_totals=usage_totals, batch_size=URL_SELECTION_BATCH_SIZE,
+        cached_token_weight=CACHED_TOKEN_WEIGHT
+    )
+    # Entities of the rows still buffered in the checkpoint writer. They are
+    # written once their part is committed: a crash before that reprocesses
+    # the rows, and their entities must not be written twice.
+    pending_entities = []
+
+    def commit_part(part_name, rows):
+        index.commit_part(part_name, rows, {"token_count": token_count})
+        for entities, url, warc_metadata in pending_entities:
+            write_entities_to_jsonl(
+                entities=entities,
+                url=url,
+                warc_metadata=warc_metadata,
+                output_dir="src/CrawlToW3C/results"
+            )
+        pending_entities.clear()
+
+    # Each part's URLs and the token count are indexed in one transaction
+    # before the part is renamed into place (see checkpoint_index)
+    checkpoint = ParquetPartWriter(
+        str(CHECKPOINT_PARTS_DIR), ANALYSIS_SCHEMA, rows_per_part=ROWS_PER_PART, compression=PARQUET_COMPRESSION,
+        on_commit=commit_part
+    )
     entities_extracted_count = 0
+    undecided_count = 0
 
-    for url, html, warc_metadata in iter_html_responses(file_paths):
-        if url in processed_urls:
-            continue
+    try:
+        records = iter_html_responses(file_paths)
+        for window in iter_selection_windows(records, index, URL_SELECTION_BATCH_SIZE):
+            decisions, selection_tokens = selector.decide(
+                [str(url) for url, _, _, accepted in window if accepted is True]
+            )
+            token_count += selection_tokens
+            for url, html, warc_metadata, heuristic_decision in window:
+                generated_annotation = None
+                processed_html = None
+                llm_decision = None
 
-        generated_annotation = None
-        processed_html = None
-        llm_decision = None
+                if heuristic_decision is True:
+                    llm_decision = decisions.get(str(url))
+                    if llm_decision not in DECISIONS:
+                        # Not even the single-URL retry gave a decision: leave the
+                        # URL out of the checkpoint so the next run asks again
+                        log.warning("Warning: no archive/skip decision for %s, it will be retried on the next run",
+                                    url, extra={"url": str(url)})
+                        undecided_count += 1
+                        continue
 
-        heuristic_decision = should_archive(str(url))
+                    if llm_decision == "archive":
+                        processed_html = process_html(str(html))
+                        processed_html = "".join((f"{str(url)}\n\n", processed_html))
+                        prompt_tokens = sys_prompt_tokens + estimator.estimate(processed_html) + MESSAGE_OVERHEAD_TOKENS
 
-        if heuristic_decision is True:
-            sel = json.loads(generate_response(llm=llm, system_prompt=system_prompt_filter, user_prompt=str(url)))
-            llm_decision = sel.get("decision")
-
-            if llm_decision == "archive":
-                processed_html = process_html(str(html))
-                processed_html = "".join((f"{str(url)}\n\n", processed_html))
-                prompt_tokens = sys_prompt_tokens + count_tokens_openai(processed_html)
-
-                if token_count + prompt_tokens > TOKEN_BUDGET:
-                    time.sleep(DELAY)
-                    token_count = 0
-
-                generated_annotation = generate_response(llm=llm, system_prompt=system_prompt_gen, user_prompt=str(processed_html))
-                print(generated_annotation)
-                
-                # Extract entities from the LLM response
-                try:
-                    llm_response = json.loads(generated_annotation)
-                    extracted_entities = llm_response.get("entities", [])
-                    
-                    if extracted_entities:
-                        write_entities_to_jsonl(
-                            entities=extracted_entities,
-                            url=url,
-                            warc_metadata=warc_metadata,
-                            output_dir="src/CrawlToW3C/results"
+                        cache_key = make_cache_key(
+                            warc_metadata.get("warc_payload_digest"), url, system_prompt_gen, MODEL, preprocess_version()
                         )
-                        entities_extracted_count += len(extracted_entities)
-                        print(f"Extracted {len(extracted_entities)} entities from {url}")
-                except Exception as e:
-                    print(f"Warning: Could not extract entities: {e}")
-
-                completion_tokens = count_tokens_openai(generated_annotation) if generated_annotation else 0
-                token_count += prompt_tokens + completion_tokens
-
-                if token_count > TOKEN_BUDGET:
-                    time.sleep(DELAY)
-                    token_count = 0
-
-        record = {
-            "url": url,
-            "html": html,
-            "heuristic_decision": heuristic_decision,
-            "llm_decision": llm_decision,
-            "processed_html": processed_html,
-            "generated_annotation": generated_annotation
-        }
-
-        append_checkpoint(record)
-        save_state({"token_count": token_count})
+                        generated_annotation = response_cache.get(cache_key)
+                        cached = generated_annotation is not None
+
+                        if not cached:
+                            if token_count + prompt_tokens > TOKEN_BUDGET:
+                                time.sleep(DELAY)
+                                token_count = 0
+
+                            generated_annotation, _, gen_usage = create_completion(llm, system_prompt_gen, str(processed_html), model=MODEL)
+                            response_cache.put(cache_key, generated_annotation)
+                            # Budget on what OpenAI billed, and calibrate the estimate with it
+                            prompt_used, completion_used, _ = usage_totals.record(gen_usage)
+                            token_count += budget_tokens(gen_usage, CACHED_TOKEN_WEIGHT)
+                            user_tokens = prompt_used - sys_prompt_tokens - MESSAGE_OVERHEAD_TOKENS
+                            estimator.observe(len(processed_html.encode("utf-8")), user_tokens)
+                        log.debug("%s", generated_annotation, extra={"url": str(url)})
+
+                        # Extract entities from the LLM response
+                        try:
+                            llm_response = json.loads(generated_annotation)
+                            extracted_entities = llm_response.get("entities", [])
+
+                            if extracted_entities:
+                                pending_entities.append((extracted_entities, url, warc_metadata))
+                                entities_extracted_count += len(extracted_entities)
+                                log.info("Extracted %d entities from %s", len(extracted_entities), url,
+                                         extra={"url": str(url)})
+                        except Exception as e:
+                            log.warning("Warning: Could not extract entities: %s", e, extra={"url": str(url)})
+
+                        if token_count > TOKEN_BUDGET:
+                            time.sleep(DELAY)
+                            token_count = 0
+
+                record = {
+                    "url": url,
+                    "warc_filename": warc_metadata.get("warc_filename"),
+                    "warc_offset": warc_metadata.get("warc_offset"),
+                    "warc_length": warc_metadata.get("warc_length"),
+                    "warc_record_id": warc_metadata.get("warc_record_id"),
+                    "heuristic_decision": heuristic_decision,
+                    "llm_decision": llm_decision,
+                    "processed_html": processed_html,
+                    "generated_annotation": generated_annotation
+                }
+
+                checkpoint.write(record)
+                save_state(index, {"token_count": token_count})
+    finally:
+        # Buffered rows are written even if the run is interrupted
+        checkpoint.close()
+        index.close()
 
+    cache_stats = response_cache.stats()
+    response_cache.close()
+    decision_stats = decision_cache.stats()
+    decision_cache.close()
     print(f"\nTotal entities extracted: {entities_extracted_count}")
+    print(f"LLM response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    print(f"URL selection: {selector.requests} requests ({selector.fallbacks} single-URL fallbacks), "
+          f"decision cache {decision_stats['hits']} hits, {decision_stats['misses']} misses, "
+          f"{undecided_count} URLs left undecided")
+    usage = usage_totals.summary()
+    print(f"Billed tokens: {usage['prompt_tokens']} prompt, {usage['completion_tokens']} completion "
+          f"({usage['reasoning_tokens']} reasoning) over {usage['requests']} requests")
+    print(f"Prompt cache: {usage['cached_tokens']} of {usage['prompt_tokens']} prompt tokens cached "
+          f"({usage['cache_hit_rate']:.0%}), {usage['effective_tokens']} effective billed tokens")
     finalise_parquet()
 
 if __name__ == "__main__":
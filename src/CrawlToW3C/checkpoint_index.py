@@ -0,0 +1,129 @@
+"""
+Checkpoint Index
+
+SQLite sidecar for scripts/results.py: the URLs already checkpointed, the
+Parquet part files that hold them, and the run state (token budget). Resume
+looks URLs up here instead of reading the checkpoint itself, so startup time
+does not depend on the size of the checkpoint.
+
+A part file is committed in three steps, so the index and the parts always
+agree after a crash:
+
+1. the part is written to `<part>.tmp`
+2. its URLs, its name and the state are committed in one transaction
+3. `<part>.tmp` is renamed to `<part>`
+
+recover() finishes step 3 for committed parts and removes uncommitted ones.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, Optional
+
+
+class CheckpointIndex:
+    """Processed URLs, committed part files and run state in one SQLite database."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS processed ("
+            " url TEXT PRIMARY KEY,"
+            " record_id TEXT,"
+            " part TEXT) WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS parts (name TEXT PRIMARY KEY) WITHOUT ROWID")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.commit()
+
+    def is_processed(self, url: str) -> bool:
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM processed WHERE url = ?", (str(url),)).fetchone() is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM processed").fetchone()[0]
+
+    def load_state(self) -> Optional[Dict[str, Any]]:
+        """The saved state, or None if none was saved yet."""
+        with self.lock:
+            rows = self.conn.execute("SELECT key, value FROM state").fetchall()
+        return {key: json.loads(value) for key, value in rows} if rows else None
+
+    def _save_state(self, state: Dict[str, Any]):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+            [(key, json.dumps(value)) for key, value in state.items()]
+        )
+
+    def save_state(self, state: Dict[str, Any]):
+        with self.lock, self.conn:
+            self._save_state(state)
+
+    def commit_part(self, part_name: str, rows: Iterable[Dict[str, Any]], state: Optional[Dict[str, Any]] = None):
+        """
+        Record a part file and the URLs it holds, with the current state, in one transaction.
+
+        Args:
+            part_name: File name of the part (not yet renamed into place)
+            rows: The part's rows; their url and warc_record_id are indexed
+            state: Run state to save with them
+        """
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO processed (url, record_id, part) VALUES (?, ?, ?)",
+                [(str(row["url"]), row.get("warc_record_id"), part_name) for row in rows]
+            )
+            self.conn.execute("INSERT OR IGNORE INTO parts (name) VALUES (?)", (part_name,))
+            if state is not None:
+                self._save_state(state)
+
+    def add_urls(self, urls: Iterable[str], part_name: Optional[str] = None):
+        """Index URLs checkpointed before the index existed."""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO processed (url, part) VALUES (?, ?)",
+                ((str(url), part_name) for url in urls)
+            )
+            if part_name is not None:
+                self.conn.execute("INSERT OR IGNORE INTO parts (name) VALUES (?)", (part_name,))
+
+    def committed_parts(self) -> set:
+        with self.lock:
+            return {name for (name,) in self.conn.execute("SELECT name FROM parts")}
+
+    def recover(self, directory: str) -> Dict[str, int]:
+        """
+        Bring a part directory in line with the index after a crash.
+
+        Returns:
+            Counts of parts renamed into place and uncommitted parts removed
+        """
+        committed = self.committed_parts()
+        recovered = removed = 0
+        if not os.path.isdir(directory):
+            return {"recovered": 0, "removed": 0}
+        for name in os.listdir(directory):
+            if not name.endswith(".tmp"):
+                continue
+            part_name = name[:-len(".tmp")]
+            tmp_path = os.path.join(directory, name)
+            if part_name in committed:
+                os.replace(tmp_path, os.path.join(directory, part_name))
+                recovered += 1
+            else:
+                os.remove(tmp_path)
+                removed += 1
+        return {"recovered": recovered, "removed": removed}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
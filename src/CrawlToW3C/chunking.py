@@ -0,0 +1,141 @@
+"""
+Chunking
+
+Splits oversized preprocessed pages into chunks under a token cap, on block
+(line) boundaries, and merges the LLM responses for the chunks back into one
+annotationPage and entity list for the page.
+"""
+
+import json
+import re
+from typing import Any, Callable, Dict, List
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def _split_long_block(block: str, max_tokens: int, count_tokens: Callable[[str], int]) -> List[str]:
+    """Split a single block that is over the cap at sentence, then word, boundaries."""
+    pieces = _SENTENCE_END.split(block)
+    if len(pieces) == 1:
+        pieces = block.split(" ")
+    if len(pieces) == 1:
+        # One enormous word: cut it by characters
+        size = max(1, len(block) * max_tokens // max(count_tokens(block), 1))
+        return [block[i:i + size] for i in range(0, len(block), size)]
+
+    parts = []
+    current = []
+    current_tokens = 0
+    for piece in pieces:
+        piece_tokens = count_tokens(piece) + 1
+        if current and current_tokens + piece_tokens > max_tokens:
+            parts.append(" ".join(current))
+            current = []
+            current_tokens = 0
+        if piece_tokens > max_tokens:
+            parts.extend(_split_long_block(piece, max_tokens, count_tokens))
+            continue
+        current.append(piece)
+        current_tokens += piece_tokens
+    if current:
+        parts.append(" ".join(current))
+    return parts
+
+
+def split_into_chunks(processed_html: str, max_tokens: int, count_tokens: Callable[[str], int]) -> List[str]:
+    """
+    Split preprocessed content into chunks of at most `max_tokens` tokens.
+
+    Chunks are cut between blocks (lines of process_html output); a block
+    larger than the cap is split at sentence or word boundaries.
+
+    Args:
+        processed_html: Output of process_html
+        max_tokens: Token cap per chunk
+        count_tokens: Token counter (estimate or exact)
+
+    Returns:
+        List of chunks, in document order
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+    for block in processed_html.split("\n"):
+        block_tokens = count_tokens(block) + 1
+        if block_tokens > max_tokens:
+            blocks = _split_long_block(block, max_tokens, count_tokens)
+        else:
+            blocks = [block]
+        for part in blocks:
+            part_tokens = block_tokens if len(blocks) == 1 else count_tokens(part) + 1
+            if current and current_tokens + part_tokens > max_tokens:
+                chunks.append("\n".join(current))
+                current = []
+                current_tokens = 0
+            current.append(part)
+            current_tokens += part_tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def _annotation_items(annotation_page) -> List[Dict[str, Any]]:
+    if isinstance(annotation_page, dict):
+        return annotation_page.get("items", []) or []
+    if isinstance(annotation_page, list):
+        return annotation_page
+    return []
+
+
+def _annotation_key(annotation: Dict[str, Any]) -> str:
+    # Body values may be lists or objects, so keys are compared as canonical JSON
+    annotation_id = annotation.get("id")
+    if annotation_id:
+        return "id:" + json.dumps(annotation_id, sort_keys=True, ensure_ascii=False)
+    body = annotation.get("body")
+    value = body.get("value") if isinstance(body, dict) else body
+    return "body:" + json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def merge_llm_responses(responses: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merge parsed LLM responses for the chunks of one page.
+
+    Annotations are deduplicated by id (or by body value when they have no
+    id), entities by case-insensitive name and type; first occurrences win.
+
+    Returns:
+        A single response of the form {"annotationPage": {...}, "entities": [...]}
+    """
+    items = []
+    seen_annotations = set()
+    entities = []
+    seen_entities = set()
+
+    for response in responses:
+        for annotation in _annotation_items(response.get("annotationPage")):
+            if not isinstance(annotation, dict):
+                continue
+            key = _annotation_key(annotation)
+            if key in seen_annotations:
+                continue
+            seen_annotations.add(key)
+            items.append(annotation)
+
+        for entity in response.get("entities", []) or []:
+            if not isinstance(entity, dict):
+                continue
+            key = (str(entity.get("name", "")).strip().lower(), json.dumps(entity.get("type"), sort_keys=True))
+            if not key[0] or key in seen_entities:
+                continue
+            seen_entities.add(key)
+            entities.append(entity)
+
+    return {
+        "annotationPage": {
+            "@context": "http://www.w3.org/ns/anno.jsonld",
+            "type": "AnnotationPage",
+            "items": items
+        },
+        "entities": entities
+    }
@@ -0,0 +1,201 @@
+"""
+Entity Compaction
+
+Merges the worker-N_entities.jsonl files of a crawl into one canonical,
+deduplicated entity file, in bounded memory however many lines there are:
+
+1. Entity lines are streamed from every worker file into sorted runs of at
+   most `run_size` lines, each spilled to a temporary file.
+2. The runs are k-way merged with heapq.merge on the normalised
+   (name, type) key, so all mentions of an entity arrive together.
+3. Each entity is written once, with its most common spelling, a mention
+   count and its distinct sources (URL, WARC record ID, ...).
+
+Output lines look like
+
+    {"entity": {"name": "Pablo Picasso", "type": "artist"}, "count": 12,
+     "source_count": 9, "sources": [{"url": ..., "warc_record_id": ..., ...}],
+     "sources_truncated": false}
+"""
+
+import glob
+import gzip
+import heapq
+import json
+import os
+import shutil
+import tempfile
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from CrawlToW3C.entity_writer import iter_entities_from_jsonl
+
+ENTITY_FILE_PATTERNS = ("*_entities.jsonl", "*_entities.jsonl.gz", "*_entities.jsonl.zst")
+
+# Runs merged at once; more runs are merged in several passes to stay under the open file limit
+MAX_MERGE_FAN_IN = 128
+
+# Fields of a run row
+_KEY_NAME, _KEY_TYPE, _URL, _RECORD_ID, _NAME, _TYPE, _WARC_FILENAME, _WARC_DATE = range(8)
+
+
+def normalise_entity_key(name: Optional[str], entity_type: Optional[str]) -> Tuple[str, str]:
+    """Dedupe key: Unicode-normalised, case-folded name with collapsed whitespace, and lowercase type."""
+    name = " ".join(unicodedata.normalize("NFKC", name or "").casefold().split())
+    return name, (entity_type or "").strip().lower()
+
+
+def find_entity_files(directory: str) -> List[str]:
+    """Worker entity files (plain or compressed) in a results directory."""
+    paths = set()
+    for pattern in ENTITY_FILE_PATTERNS:
+        paths.update(glob.glob(os.path.join(directory, pattern)))
+    return sorted(paths)
+
+
+def _rows(paths: Iterable[str]) -> Iterator[list]:
+    for path in paths:
+        for record in iter_entities_from_jsonl(path):
+            entity = record.get("entity", {})
+            source = record.get("source", {})
+            key_name, key_type = normalise_entity_key(entity.get("name"), entity.get("type"))
+            if not key_name:
+                continue
+            yield [key_name, key_type, source.get("url") or "", source.get("warc_record_id") or "",
+                   entity.get("name"), entity.get("type"), source.get("warc_filename"), source.get("warc_date")]
+
+
+def _write_run(rows: List[list], tmp_dir: str) -> str:
+    rows.sort(key=lambda row: row[:_NAME])
+    fd, path = tempfile.mkstemp(suffix=".run", dir=tmp_dir)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    return path
+
+
+def _read_run(path: str) -> Iterator[list]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def _sorted_runs(paths: Iterable[str], run_size: int, tmp_dir: str) -> Tuple[List[str], int]:
+    runs = []
+    rows = []
+    total = 0
+    for row in _rows(paths):
+        rows.append(row)
+        total += 1
+        if len(rows) >= run_size:
+            runs.append(_write_run(rows, tmp_dir))
+            rows = []
+    if rows:
+        runs.append(_write_run(rows, tmp_dir))
+    return runs, total
+
+
+def _merge(runs: List[str]) -> Iterator[list]:
+    return heapq.merge(*(_read_run(run) for run in runs), key=lambda row: row[:_NAME])
+
+
+def _reduce_fan_in(runs: List[str], tmp_dir: str) -> List[str]:
+    """Merge runs in groups until at most MAX_MERGE_FAN_IN are left."""
+    while len(runs) > MAX_MERGE_FAN_IN:
+        merged = []
+        for i in range(0, len(runs), MAX_MERGE_FAN_IN):
+            group = runs[i:i + MAX_MERGE_FAN_IN]
+            fd, path = tempfile.mkstemp(suffix=".run", dir=tmp_dir)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                for row in _merge(group):
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            for run in group:
+                os.remove(run)
+            merged.append(path)
+        runs = merged
+    return runs
+
+
+def _canonical_records(rows: Iterator[list], max_sources: int) -> Iterator[Dict[str, Any]]:
+    key = None
+    for row in rows:
+        row_key = (row[_KEY_NAME], row[_KEY_TYPE])
+        if row_key != key:
+            if key is not None:
+                yield _canonical_record(names, types, count, sources, source_count, max_sources)
+            key = row_key
+            names = Counter()
+            types = Counter()
+            count = 0
+            sources = []
+            source_count = 0
+            last_source = None
+        names[row[_NAME]] += 1
+        types[row[_TYPE]] += 1
+        count += 1
+        # Rows are sorted by source within an entity, so repeats are adjacent
+        source = (row[_URL], row[_RECORD_ID])
+        if source != last_source:
+            last_source = source
+            source_count += 1
+            if len(sources) < max_sources:
+                sources.append({
+                    "url": row[_URL] or None,
+                    "warc_record_id": row[_RECORD_ID] or None,
+                    "warc_filename": row[_WARC_FILENAME],
+                    "warc_date": row[_WARC_DATE],
+                })
+    if key is not None:
+        yield _canonical_record(names, types, count, sources, source_count, max_sources)
+
+
+def _canonical_record(names: Counter, types: Counter, count: int, sources: List[Dict[str, Any]],
+                      source_count: int, max_sources: int) -> Dict[str, Any]:
+    # Most common spelling wins; ties go to the alphabetically first for stable output
+    name = min(names.items(), key=lambda item: (-item[1], item[0]))[0]
+    entity_type = min(types.items(), key=lambda item: (-item[1], str(item[0])))[0]
+    return {
+        "entity": {"name": name, "type": entity_type},
+        "count": count,
+        "source_count": source_count,
+        "sources": sources,
+        "sources_truncated": source_count > max_sources,
+    }
+
+
+def compact_entities(input_paths: List[str], output_path: str, run_size: int = 200_000,
+                     max_sources: int = 1000, tmp_dir: Optional[str] = None) -> Dict[str, int]:
+    """
+    Compact entity files into one canonical deduplicated file.
+
+    Args:
+        input_paths: Worker entity files (.jsonl, .jsonl.gz or .jsonl.zst)
+        output_path: Canonical output file; written as gzip if it ends in .gz
+        run_size: Lines sorted in memory at a time (bounds memory use)
+        max_sources: Sources listed per entity; source_count still counts all
+        tmp_dir: Directory for the sorted runs (defaults to beside the output)
+
+    Returns:
+        Counts of input lines, sorted runs and canonical entities
+    """
+    output_dir = os.path.dirname(output_path) or "."
+    os.makedirs(output_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="entity-runs-", dir=tmp_dir or output_dir)
+    try:
+        runs, lines = _sorted_runs(input_paths, run_size, work_dir)
+        run_count = len(runs)
+        runs = _reduce_fan_in(runs, work_dir)
+
+        tmp_path = output_path + ".tmp"
+        opener = gzip.open if output_path.endswith(".gz") else open
+        entities = 0
+        with opener(tmp_path, "wt", encoding="utf-8") as f:
+            for record in _canonical_records(_merge(runs), max_sources):
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                entities += 1
+        os.replace(tmp_path, output_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {"input_lines": lines, "runs": run_count, "entities": entities}
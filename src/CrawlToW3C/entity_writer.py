@@ -5,10 +5,244 @@ This module provides functionality to write extracted entities to JSONL files
 for later processing in RAG systems.
 """
 
+import gzip
+import io
 import json
 import os
+import threading
+import time
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import Callable, Iterator, List, Dict, Any, Optional
+
+from CrawlToW3C import metrics
+
+try:
+    import zstandard
+except ImportError:  # zstd output is optional
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = None
+
+DEFAULT_OUTPUT_DIR = "/app/src/CrawlToW3C/results"
+
+# File suffix per compression
+COMPRESSION_SUFFIXES = {None: ".jsonl", "gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+
+# fsync policies: never, after every flushed batch, or only when the sink is closed
+FSYNC_NEVER = "never"
+FSYNC_FLUSH = "flush"
+FSYNC_CLOSE = "close"
+
+
+def entity_output_path(warc_metadata: Dict[str, Any], output_dir: str, compression: Optional[str] = None) -> str:
+    """Output file for the entities of a WARC record: one file per crawler worker."""
+    # Create filename based on worker number from WARC filename
+    warc_filename = warc_metadata.get("warc_filename", "unknown")
+    # Extract worker number from filename (e.g., "rec-one-20260105185218349-0" -> "worker-0")
+    if '-' in warc_filename:
+        worker_num = warc_filename.split('-')[-1].split('.')[0]  # Get last number before extension
+        base_name = f"worker-{worker_num}"
+    else:
+        base_name = warc_filename.replace('.warc.gz', '').replace('.warc', '')
+    return os.path.join(output_dir, f"{base_name}_entities{COMPRESSION_SUFFIXES[compression]}")
+
+
+def _entity_lines(entities: List[Dict[str, Any]], url: str, warc_metadata: Dict[str, Any]) -> List[str]:
+    extracted_at = datetime.utcnow().isoformat() + "Z"
+    lines = []
+    for entity in entities:
+        # Clean entity - only keep name and type (remove context if LLM included it)
+        clean_entity = {
+            "name": entity.get("name"),
+            "type": entity.get("type")
+        }
+
+        # Enrich entity with provenance metadata
+        enriched_entity = {
+            "entity": clean_entity,
+            "source": {
+                "url": url,
+                "warc_filename": warc_metadata.get("warc_filename"),
+                "warc_date": warc_metadata.get("warc_date"),
+                "warc_record_id": warc_metadata.get("warc_record_id"),
+                "extracted_at": extracted_at
+            }
+        }
+        # Write as single line JSON
+        lines.append(json.dumps(enriched_entity, ensure_ascii=False) + '\n')
+    return lines
+
+
+class _EntityFile:
+    """One open output file: the raw handle (for fsync) and the writer that compresses into it."""
+
+    def __init__(self, path: str, compression: Optional[str]):
+        self.raw = open(path, 'ab')
+        if compression == "gzip":
+            # Appending starts a new gzip member; concatenated members read back as one stream
+            self.writer = gzip.GzipFile(fileobj=self.raw, mode='ab')
+        elif compression == "zstd":
+            self.writer = zstandard.ZstdCompressor().stream_writer(self.raw, closefd=False)
+        else:
+            self.writer = self.raw
+        self.compression = compression
+        self.buffer: List[str] = []
+        self.buffered_bytes = 0
+        self.callbacks: List[Callable[[], None]] = []
+
+    def flush(self, fsync: bool):
+        start = time.perf_counter()
+        wrote = bool(self.buffer)
+        if wrote:
+            self.writer.write(''.join(self.buffer).encode('utf-8'))
+            self.buffer.clear()
+            self.buffered_bytes = 0
+        # Make the data readable in the file now: a gzip sync flush or a complete zstd frame
+        if self.compression == "gzip":
+            self.writer.flush()
+        elif self.compression == "zstd":
+            self.writer.flush(zstandard.FLUSH_FRAME)
+        self.raw.flush()
+        if fsync:
+            os.fsync(self.raw.fileno())
+        if wrote:
+            metrics.observe("entity_flush", time.perf_counter() - start)
+
+    def close(self, fsync: bool):
+        self.flush(fsync)
+        if self.writer is not self.raw:
+            self.writer.close()
+        self.raw.close()
+
+
+class EntitySink:
+    """
+    Long-lived entity writer: keeps one handle per output file and writes
+    entities in batches.
+
+    A file's buffered entities are written when they reach `flush_bytes`, when
+    `flush_interval` seconds have passed since they were buffered (checked by a
+    background thread) and when the sink is closed. Safe to use from several
+    threads.
+    """
+
+    def __init__(self, output_dir: str = None, compression: Optional[str] = None,
+                 flush_interval: float = 5.0, flush_bytes: int = 1024 * 1024, fsync: str = FSYNC_CLOSE):
+        """
+        Initialize the sink.
+
+        Args:
+            output_dir: Directory to write entity files (defaults to results/)
+            compression: None for plain JSONL, "gzip" or "zstd" (needs the zstandard package)
+            flush_interval: Longest time in seconds entities stay buffered; 0 writes every batch at once
+            flush_bytes: Buffered size per file that triggers a write
+            fsync: "never", "flush" (after every write to the file) or "close"
+        """
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Unknown compression: {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise ImportError("zstd compression requires the zstandard package")
+        if fsync not in (FSYNC_NEVER, FSYNC_FLUSH, FSYNC_CLOSE):
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.output_dir = output_dir or DEFAULT_OUTPUT_DIR
+        self.compression = compression
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.fsync = fsync
+        self.files: Dict[str, _EntityFile] = {}
+        self.oldest_buffered = None
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.flusher = None
+        if flush_interval > 0:
+            self.flusher = threading.Thread(target=self._flush_periodically, name="entity-sink", daemon=True)
+            self.flusher.start()
+
+    def _file(self, path: str) -> _EntityFile:
+        entity_file = self.files.get(path)
+        if entity_file is None:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            entity_file = self.files[path] = _EntityFile(path, self.compression)
+        return entity_file
+
+    def _flush_file(self, entity_file: _EntityFile) -> List[Callable[[], None]]:
+        entity_file.flush(self.fsync == FSYNC_FLUSH)
+        callbacks = entity_file.callbacks
+        entity_file.callbacks = []
+        return callbacks
+
+    def write(self, entities: List[Dict[str, Any]], url: str, warc_metadata: Dict[str, Any],
+              on_flushed: Optional[Callable[[], None]] = None) -> str:
+        """
+        Buffer the entities of one page.
+
+        Args:
+            entities: List of entity dictionaries with name, type, and context
+            url: Source URL where entities were extracted from
+            warc_metadata: WARC metadata for provenance tracking
+            on_flushed: Optional callback, called once these entities have
+                been written to the file
+
+        Returns:
+            Path to the JSONL file the entities go to
+        """
+        path = entity_output_path(warc_metadata, self.output_dir, self.compression)
+        lines = _entity_lines(entities, url, warc_metadata)
+        callbacks = []
+        with self.lock:
+            if self.closed.is_set():
+                raise ValueError("EntitySink is closed")
+            entity_file = self._file(path)
+            entity_file.buffer.extend(lines)
+            metrics.inc("entities_written", len(lines))
+            entity_file.buffered_bytes += sum(len(line) for line in lines)
+            if on_flushed is not None:
+                entity_file.callbacks.append(on_flushed)
+            if self.oldest_buffered is None:
+                self.oldest_buffered = time.monotonic()
+            if entity_file.buffered_bytes >= self.flush_bytes or self.flush_interval <= 0:
+                callbacks = self._flush_file(entity_file)
+        for callback in callbacks:
+            callback()
+        return path
+
+    def flush(self):
+        """Write every buffered entity to its file; files with nothing pending are left alone."""
+        with self.lock:
+            callbacks = []
+            for entity_file in self.files.values():
+                if entity_file.buffer or entity_file.callbacks:
+                    callbacks.extend(self._flush_file(entity_file))
+            self.oldest_buffered = None
+        for callback in callbacks:
+            callback()
+
+    def _flush_periodically(self):
+        while not self.closed.wait(self.flush_interval / 2):
+            oldest = self.oldest_buffered
+            if oldest is not None and time.monotonic() - oldest >= self.flush_interval:
+                self.flush()
+
+    def close(self):
+        """Flush, fsync (unless the policy is "never") and close every file."""
+        self.flush()
+        with self.lock:
+            self.closed.set()
+            for entity_file in self.files.values():
+                entity_file.close(self.fsync != FSYNC_NEVER)
+            self.files.clear()
+        if self.flusher is not None:
+            self.flusher.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 
 def write_entities_to_jsonl(entities: List[Dict[str, Any]], url: str, 
@@ -18,7 +252,8 @@ def write_entities_to_jsonl(entities: List[Dict[str, Any]], url: str,
     Write extracted entities to a JSONL file.
     
     Each entity is written as a single line JSON object with metadata
-    about the source URL and WARC information for provenance.
+    about the source URL and WARC information for provenance. Opens and
+    closes the file on every call; use an EntitySink when writing many pages.
     
     Args:
         entities: List of entity dictionaries with name, type, and context
@@ -29,47 +264,37 @@ def write_entities_to_jsonl(entities: List[Dict[str, Any]], url: str,
     Returns:
         Path to the written JSONL file
     """
-    if output_dir is None:
-        # Use the existing results directory
-        output_dir = "/app/src/CrawlToW3C/results"
-    
-    # Ensure output directory exists
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Create filename based on worker number from WARC filename
-    warc_filename = warc_metadata.get("warc_filename", "unknown")
-    # Extract worker number from filename (e.g., "rec-one-20260105185218349-0" -> "worker-0")
-    if '-' in warc_filename:
-        worker_num = warc_filename.split('-')[-1].split('.')[0]  # Get last number before extension
-        base_name = f"worker-{worker_num}"
-    else:
-        base_name = warc_filename.replace('.warc.gz', '').replace('.warc', '')
-    output_file = os.path.join(output_dir, f"{base_name}_entities.jsonl")
-    
-    # Write entities to JSONL
-    with open(output_file, 'a', encoding='utf-8') as f:
-        for entity in entities:
-            # Clean entity - only keep name and type (remove context if LLM included it)
-            clean_entity = {
-                "name": entity.get("name"),
-                "type": entity.get("type")
-            }
-            
-            # Enrich entity with provenance metadata
-            enriched_entity = {
-                "entity": clean_entity,
-                "source": {
-                    "url": url,
-                    "warc_filename": warc_metadata.get("warc_filename"),
-                    "warc_date": warc_metadata.get("warc_date"),
-                    "warc_record_id": warc_metadata.get("warc_record_id"),
-                    "extracted_at": datetime.utcnow().isoformat() + "Z"
-                }
-            }
-            # Write as single line JSON
-            f.write(json.dumps(enriched_entity, ensure_ascii=False) + '\n')
+    with EntitySink(output_dir, flush_interval=0, fsync=FSYNC_NEVER) as sink:
+        return sink.write(entities, url, warc_metadata)
+
+
+def _open_entities(jsonl_file: str):
+    """Open an entity file for reading text, decompressing .gz and .zst files."""
+    if jsonl_file.endswith('.gz'):
+        return gzip.open(jsonl_file, 'rt', encoding='utf-8')
+    if jsonl_file.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError("Reading .zst entity files requires the zstandard package")
+        raw = open(jsonl_file, 'rb')
+        reader = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+        return io.TextIOWrapper(reader, encoding='utf-8')
+    return open(jsonl_file, 'r', encoding='utf-8')
+
+
+def iter_entities_from_jsonl(jsonl_file: str) -> Iterator[Dict[str, Any]]:
+    """
+    Stream entities from a JSONL file (plain, .gz or .zst) one at a time.
     
-    return output_file
+    Args:
+        jsonl_file: Path to the JSONL file
+        
+    Yields:
+        Entity dictionaries
+    """
+    with _open_entities(jsonl_file) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
 
 
 def read_entities_from_jsonl(jsonl_file: str) -> List[Dict[str, Any]]:
@@ -82,29 +307,148 @@ def read_entities_from_jsonl(jsonl_file: str) -> List[Dict[str, Any]]:
     Returns:
         List of entity dictionaries
     """
-    entities = []
-    with open(jsonl_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            if line.strip():
-                entities.append(json.loads(line))
-    return entities
+    return list(iter_entities_from_jsonl(jsonl_file))
 
 
 def get_entities_by_type(jsonl_file: str, entity_type: str) -> List[Dict[str, Any]]:
     """
-    Filter entities by type from a JSONL file.
+    Filter entities by type from a JSONL file, or from a Parquet export
+    (a columnar scan that skips row groups without the type).
     
     Args:
-        jsonl_file: Path to the JSONL file
+        jsonl_file: Path to the JSONL or .parquet file
         entity_type: Type of entity to filter (e.g., "artist", "person", "organization")
         
     Returns:
         List of entities matching the specified type
     """
-    entities = read_entities_from_jsonl(jsonl_file)
+    if jsonl_file.endswith('.parquet'):
+        table = read_entities_from_parquet(jsonl_file, entity_type=entity_type)
+        return [_record_from_row(row) for row in table.to_pylist()]
+    entities = iter_entities_from_jsonl(jsonl_file)
     return [e for e in entities if e.get("entity", {}).get("type") == entity_type]
 
 
+# Columns of the Parquet export; low-cardinality columns are dictionary encoded
+PARQUET_DICTIONARY_COLUMNS = ["type", "warc_filename", "url"]
+PARQUET_METADATA_KEY = "crawl2w3c.entities"
+
+
+def _parquet_schema():
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("name", pa.string()),
+        ("type", dictionary),
+        ("url", dictionary),
+        ("warc_filename", dictionary),
+        ("warc_date", pa.string()),
+        ("warc_record_id", pa.string()),
+        ("extracted_at", pa.string()),
+    ])
+
+
+def _record_from_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Rebuild the JSONL record shape from a Parquet row."""
+    return {
+        "entity": {"name": row["name"], "type": row["type"]},
+        "source": {
+            "url": row["url"],
+            "warc_filename": row["warc_filename"],
+            "warc_date": row["warc_date"],
+            "warc_record_id": row["warc_record_id"],
+            "extracted_at": row["extracted_at"],
+        }
+    }
+
+
+def _write_row_group(writer, schema, rows: List[Dict[str, Any]]):
+    # Sorting by type keeps each type's rows together, so page statistics can skip the rest
+    rows.sort(key=lambda row: row["type"] or "")
+    columns = {field.name: [row[field.name] for row in rows] for field in schema}
+    writer.write_table(pa.Table.from_pydict(columns, schema=schema), row_group_size=len(rows))
+
+
+def export_entities_to_parquet(jsonl_files: List[str], parquet_file: str, row_group_size: int = 100_000,
+                               compression: str = "zstd") -> Dict[str, Any]:
+    """
+    Stream entity JSONL files (plain, .gz or .zst) into one Parquet file.
+    
+    Rows are written in row groups of `row_group_size`, so memory use does
+    not depend on the number of entities. type, warc_filename and url are
+    dictionary encoded, column statistics are written for every row group,
+    and run-level statistics (row count, per-type counts, source files) are
+    stored in the file metadata under "crawl2w3c.entities".
+    
+    Args:
+        jsonl_files: Entity JSONL files to export
+        parquet_file: Output Parquet file
+        row_group_size: Rows per row group
+        compression: Parquet compression codec
+        
+    Returns:
+        The run-level statistics
+    """
+    if pa is None:
+        raise ImportError("Parquet export requires the pyarrow package")
+    schema = _parquet_schema()
+    stats = {"rows": 0, "row_groups": 0, "types": {}, "source_files": [os.path.basename(p) for p in jsonl_files]}
+    tmp_file = parquet_file + ".tmp"
+    os.makedirs(os.path.dirname(parquet_file) or '.', exist_ok=True)
+    with pq.ParquetWriter(tmp_file, schema, compression=compression,
+                          use_dictionary=PARQUET_DICTIONARY_COLUMNS, write_statistics=True) as writer:
+        rows = []
+        for jsonl_file in jsonl_files:
+            for record in iter_entities_from_jsonl(jsonl_file):
+                entity = record.get("entity", {})
+                source = record.get("source", {})
+                row = {
+                    "name": entity.get("name"),
+                    "type": entity.get("type"),
+                    "url": source.get("url"),
+                    "warc_filename": source.get("warc_filename"),
+                    "warc_date": source.get("warc_date"),
+                    "warc_record_id": source.get("warc_record_id"),
+                    "extracted_at": source.get("extracted_at"),
+                }
+                rows.append(row)
+                stats["types"][row["type"]] = stats["types"].get(row["type"], 0) + 1
+                if len(rows) >= row_group_size:
+                    _write_row_group(writer, schema, rows)
+                    stats["rows"] += len(rows)
+                    stats["row_groups"] += 1
+                    rows = []
+        if rows:
+            _write_row_group(writer, schema, rows)
+            stats["rows"] += len(rows)
+            stats["row_groups"] += 1
+        writer.add_key_value_metadata({PARQUET_METADATA_KEY: json.dumps(stats, ensure_ascii=False)})
+    os.replace(tmp_file, parquet_file)
+    return stats
+
+
+def read_entities_from_parquet(parquet_file: str, entity_type: Optional[str] = None,
+                               columns: Optional[List[str]] = None):
+    """
+    Load a Parquet entity export as a pyarrow Table, optionally only one type.
+    
+    The type filter is pushed down to the reader, which skips row groups
+    whose statistics rule the type out.
+    """
+    if pa is None:
+        raise ImportError("Reading Parquet entity files requires the pyarrow package")
+    filters = [("type", "==", entity_type)] if entity_type is not None else None
+    return pq.read_table(parquet_file, columns=columns, filters=filters)
+
+
+def read_parquet_entity_stats(parquet_file: str) -> Dict[str, Any]:
+    """Run-level statistics stored by export_entities_to_parquet, read from the file footer only."""
+    if pa is None:
+        raise ImportError("Reading Parquet entity files requires the pyarrow package")
+    metadata = pq.read_metadata(parquet_file).metadata or {}
+    value = metadata.get(PARQUET_METADATA_KEY.encode('utf-8'))
+    return json.loads(value) if value else {}
+
+
 def deduplicate_entities(entities: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
     Deduplicate entities by name (case-insensitive).
@@ -1,29 +1,224 @@
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, CData, NavigableString
 
-def process_html(html_content):
+from CrawlToW3C import metrics
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:  # lxml is optional, the bs4 engine is always available
+    lxml = None
+
+# Bump whenever process_html output changes so cached LLM responses are not reused
+PREPROCESS_VERSION = "2"
+
+DEFAULT_ENGINE = "lxml" if lxml is not None else "bs4"
+
+REMOVED_TAGS = {'script', 'style', 'header', 'footer', 'form'}
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+FULL_TEXT_TAGS = {'title'} | HEADING_TAGS | {'p'}
+BLOCK_TAGS = FULL_TEXT_TAGS | {'div'}
+# Text inside these is not page text (bs4 gives it its own string types, excluded from get_text)
+NON_TEXT_CONTAINERS = {'template', 'rt', 'rp'}
+# Elements that don't break a line of text; any other element boundary is treated as whitespace
+INLINE_TAGS = {
+    'a', 'abbr', 'b', 'bdi', 'bdo', 'cite', 'code', 'data', 'del', 'dfn', 'em', 'font', 'i', 'ins',
+    'kbd', 'label', 'mark', 'q', 'rb', 'ruby', 's', 'samp', 'small', 'span', 'strike', 'strong',
+    'sub', 'sup', 'time', 'u', 'var',
+}
+
+# Kinds of text node passed to the renderer
+TEXT = "text"  # ordinary text and CDATA
+OTHER = "other"  # comments, doctypes, processing instructions
+
+
+class _Renderer:
+    """
+    Builds the preprocessed output from a document-order walk of the tree.
+
+    Every engine walks its own parse tree and calls start/text/end; the output
+    rules live here so all engines agree:
+    - every text node is emitted once, by its nearest title, h1-h6, p or div
+    - a block containing another block is split around it, so text stays in
+      document order and is never repeated by the outer block
+    - whitespace is collapsed and blocks identical to an earlier one are dropped
+    - img emits its src, and its alt unless that alt text was already emitted
+
+    It also tracks roughly how much the previous rules (full text for every
+    title/heading/p, direct text for div, every img) would have produced.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.emitted = set()
+        self.emitted_alts = set()
+        self.stack = []  # tags of open elements
+        self.blocks = []  # (tag, pieces) for open blocks
+        self.non_text_depth = 0
+        self.full_text_depth = 0
+        self.legacy_chars = 0
+        self.duplicate_blocks = 0
+
+    def _emit(self, line):
+        if line in self.emitted:
+            self.duplicate_blocks += 1
+            return
+        self.emitted.add(line)
+        self.lines.append(line)
+
+    def _flush(self, tag, pieces):
+        text = ' '.join(''.join(pieces).split())
+        pieces.clear()
+        if text:
+            self._emit(f"<{tag}>{text}</{tag}>")
+
+    def _boundary(self, tag):
+        if tag not in INLINE_TAGS and self.blocks:
+            self.blocks[-1][1].append(' ')
+
+    def start(self, tag, get_attr):
+        if tag in NON_TEXT_CONTAINERS:
+            self.non_text_depth += 1
+        if tag in BLOCK_TAGS:
+            if self.blocks:
+                self._flush(*self.blocks[-1])
+            self.blocks.append((tag, []))
+            if tag in FULL_TEXT_TAGS:
+                self.full_text_depth += 1
+                self.legacy_chars += 2 * len(tag) + 6
+        elif tag == 'img':
+            src = get_attr("src") or ""
+            alt = get_attr("alt") or ""
+            self.legacy_chars += len(src) + len(alt) + 18
+            if alt in self.emitted_alts:
+                alt = ""
+            elif alt:
+                self.emitted_alts.add(alt)
+            self._emit(f'<img src="{src}" alt="{alt}">')
+        else:
+            self._boundary(tag)
+        self.stack.append(tag)
+
+    def text(self, value, kind):
+        if not self.stack:
+            return
+        if self.stack[-1] == 'div':
+            self.legacy_chars += len(value)
+        if kind != TEXT or self.non_text_depth:
+            return
+        self.legacy_chars += len(value.strip()) * self.full_text_depth
+        if self.blocks:
+            self.blocks[-1][1].append(value)
+
+    def end(self):
+        tag = self.stack.pop()
+        if tag in NON_TEXT_CONTAINERS:
+            self.non_text_depth -= 1
+        if tag in BLOCK_TAGS:
+            if tag in FULL_TEXT_TAGS:
+                self.full_text_depth -= 1
+            self._flush(*self.blocks.pop())
+        else:
+            self._boundary(tag)
+
+    def result(self):
+        while self.stack:
+            self.end()
+        return '\n'.join(self.lines)
+
+
+def _walk_bs4(html_content, renderer):
     soup = BeautifulSoup(html_content, 'html.parser')
+    stack = [(soup, False)]
+    while stack:
+        node, closing = stack.pop()
+        if closing:
+            renderer.end()
+            continue
+        if isinstance(node, NavigableString):
+            kind = TEXT if type(node) in (NavigableString, CData) else OTHER
+            renderer.text(str(node), kind)
+            continue
+        if node is not soup:
+            if node.name in REMOVED_TAGS:
+                continue
+            renderer.start(node.name, node.get)
+            stack.append((node, True))
+        stack.extend((child, False) for child in reversed(node.contents))
+
+
+def _walk_lxml(html_content, renderer):
+    try:
+        root = lxml.html.document_fromstring(html_content)
+    except ValueError:
+        # Unicode strings with an XML encoding declaration must be passed as bytes
+        root = lxml.html.document_fromstring(html_content.encode('utf-8'))
+    except etree.ParserError:
+        return  # empty document
+
+    # lxml keeps top-level comments outside the root element
+    for sibling in reversed(list(root.itersiblings(preceding=True))):
+        _walk_lxml_node(sibling, renderer)
+    _walk_lxml_node(root, renderer)
+    for sibling in root.itersiblings():
+        _walk_lxml_node(sibling, renderer)
+
+
+def _walk_lxml_node(root, renderer):
+    stack = [(root, False)]
+    while stack:
+        node, closing = stack.pop()
+        if closing:
+            renderer.end()
+            if node.tail:
+                renderer.text(node.tail, TEXT)
+            continue
+        tag = node.tag
+        if not isinstance(tag, str):
+            # Comment or processing instruction
+            if node.text:
+                renderer.text(node.text, OTHER)
+        elif tag not in REMOVED_TAGS:
+            renderer.start(tag, node.get)
+            if node.text:
+                renderer.text(node.text, TEXT)
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node))
+            continue
+        if node.tail:
+            renderer.text(node.tail, TEXT)
+
+
+ENGINES = {
+    'bs4': _walk_bs4,
+}
+if lxml is not None:
+    ENGINES['lxml'] = _walk_lxml
+
+
+def preprocess_version(engine=None):
+    """Identifies the output of process_html for cache keys: engines can differ on malformed HTML."""
+    return f"{PREPROCESS_VERSION}-{engine or DEFAULT_ENGINE}"
+
+
+def process_html(html_content, engine=None, stats=None):
+    """
+    Reduce an HTML page to the title, headings, paragraphs, div text and
+    images that are sent to the LLM.
 
-    for tag in soup(['script', 'style', 'header', 'footer', 'form']):
-        tag.decompose()
-
-    essential_tags = soup.find_all(['title', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'div', 'p', 'img'])
-
-    processed_content = []
-
-    for tag in essential_tags:
-        if tag.name == 'title':
-            processed_content.append(f"<title>{tag.get_text(strip=True)}</title>")
-        elif tag.name.startswith('h'):
-            processed_content.append(f"<{tag.name}>{tag.get_text(strip=True)}</{tag.name}>")
-        elif tag.name == 'div':
-            div_text = ''.join(tag.find_all(text=True, recursive=False)).strip()
-            if div_text:
-                processed_content.append(f"<div>{div_text}</div>")
-        elif tag.name == 'p':
-            processed_content.append(f"<p>{tag.get_text(strip=True)}</p>")
-        elif tag.name == 'img':
-            src = tag.get('src', '')
-            alt = tag.get('alt', '')
-            processed_content.append(f'<img src="{src}" alt="{alt}">')
-
-    return '\n'.join(processed_content)
\ No newline at end of file
+    Args:
+        html_content: HTML page
+        engine: Parser to use, 'lxml' (default when installed) or 'bs4'
+        stats: Optional dict filled with 'chars' (output size), 'legacy_chars'
+            (approximate size under the previous nested-block rules) and
+            'duplicate_blocks' (repeated blocks dropped)
+    """
+    walk = ENGINES[engine or DEFAULT_ENGINE]
+    renderer = _Renderer()
+    with metrics.timer("html_preprocess"):
+        walk(html_content, renderer)
+        result = renderer.result()
+    if stats is not None:
+        stats["chars"] = len(result)
+        stats["legacy_chars"] = max(renderer.legacy_chars, len(result))
+        stats["duplicate_blocks"] = renderer.duplicate_blocks
+    return result
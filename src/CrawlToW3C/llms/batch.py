@@ -0,0 +1,380 @@
+"""
+OpenAI Batch API
+
+Runs chat completion requests offline through the Batch API: results come
+back within 24 hours instead of interactively, at half the price and under
+separate rate limits. Requests are written to JSONL input files, split to
+stay under the per-batch limits, then submitted, polled, and read back by
+custom_id.
+
+Each batch keeps its files in its own directory under the batch root:
+
+    input.jsonl     requests, one per line
+    manifest.jsonl  caller data for the requests (e.g. the page they belong to)
+    state.json      batch ID and status, written once the input is complete
+    output.jsonl    results, once downloaded
+
+A directory without state.json was interrupted while being written and is
+discarded, so a run can always be picked up again from the state files or
+by batch ID.
+
+LocalBatchClient runs a batch in-process against an ordinary client, or any
+completion function (a stub in tests), and writes output in the Batch API
+format, for tests and for running the batch flow without the Batch API.
+"""
+
+import json
+import os
+import shutil
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from CrawlToW3C.llms.openai_wrapper import completion_params
+from CrawlToW3C.pipeline_log import get_logger
+
+log = get_logger()
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+MAX_REQUESTS_PER_BATCH = 50_000
+MAX_BYTES_PER_BATCH = 190 * 1024 * 1024  # the API allows 200MB input files
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# Local state of a batch directory
+PREPARED = "prepared"    # input written, not submitted
+SUBMITTED = "submitted"  # running on the batch endpoint
+INGESTED = "ingested"    # results processed
+FAILED = "failed"        # failed, expired or cancelled; whatever output it had was processed
+FINISHED = (INGESTED, FAILED)
+
+
+def batch_request_line(custom_id: str, system_prompt: str, user_prompt: str, model: str = "gpt-5") -> str:
+    """One line of a batch input file, with the same parameters as create_completion."""
+    return json.dumps({
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": completion_params(system_prompt, user_prompt, model=model)
+    }, ensure_ascii=False) + "\n"
+
+
+def _usage_from_dict(usage: Optional[Dict[str, Any]]):
+    """Usage object with the attributes UsageTotals reads, from a JSON usage block."""
+    if not usage:
+        return None
+    details = usage.get("completion_tokens_details") or {}
+    prompt_details = usage.get("prompt_tokens_details") or {}
+    return SimpleNamespace(
+        prompt_tokens=usage.get("prompt_tokens", 0),
+        completion_tokens=usage.get("completion_tokens", 0),
+        total_tokens=usage.get("total_tokens", 0),
+        completion_tokens_details=SimpleNamespace(reasoning_tokens=details.get("reasoning_tokens", 0)),
+        prompt_tokens_details=SimpleNamespace(cached_tokens=prompt_details.get("cached_tokens", 0))
+    )
+
+
+def parse_output_line(line: str) -> Tuple[str, Optional[str], Any, Optional[str]]:
+    """
+    Read one line of a batch output or error file.
+
+    Returns:
+        (custom_id, content, usage, error); content is None when the request failed
+    """
+    item = json.loads(line)
+    custom_id = item.get("custom_id")
+    if item.get("error"):
+        error = item["error"]
+        return custom_id, None, None, f"{error.get('code')}: {error.get('message')}"
+    response = item.get("response") or {}
+    body = response.get("body") or {}
+    if response.get("status_code") != 200:
+        message = (body.get("error") or {}).get("message", "no response body")
+        return custom_id, None, None, f"HTTP {response.get('status_code')}: {message}"
+    try:
+        content = body["choices"][0]["message"]["content"].strip()
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return custom_id, None, None, "response has no message content"
+    return custom_id, content, _usage_from_dict(body.get("usage")), None
+
+
+class OpenAIBatchClient:
+    """Submits input files to the OpenAI Batch API and fetches the results."""
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    def submit(self, input_path: str, metadata: Optional[Dict[str, str]] = None) -> str:
+        with open(input_path, "rb") as f:
+            input_file = self.llm.files.create(file=f, purpose="batch")
+        batch = self.llm.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=COMPLETION_WINDOW,
+            metadata=metadata
+        )
+        return batch.id
+
+    def retrieve(self, batch_id: str) -> Dict[str, Any]:
+        batch = self.llm.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        return {
+            "status": batch.status,
+            "output_file_id": batch.output_file_id,
+            "error_file_id": batch.error_file_id,
+            "completed": counts.completed if counts else 0,
+            "failed": counts.failed if counts else 0,
+            "total": counts.total if counts else 0,
+        }
+
+    def download(self, file_id: str, path: str):
+        with self.llm.files.with_streaming_response.content(file_id) as response:
+            response.stream_to_file(path)
+
+
+class LocalBatchClient:
+    """
+    Batch endpoint stand-in: runs each request of a batch through an ordinary
+    chat completions client, or a completion function, when the batch is
+    submitted, and serves output files in the Batch API format.
+    """
+
+    def __init__(self, llm, directory: str, complete: Optional[Callable[[Dict[str, Any]], Any]] = None):
+        """
+        Args:
+            llm: Client whose chat.completions.create runs the requests
+            directory: Where the output files are kept
+            complete: Runs one request instead of `llm`: called with the request
+                body, returns a chat completion (e.g. a stub in tests)
+        """
+        self.llm = llm
+        self.complete = complete or (lambda body: llm.chat.completions.create(**body))
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _state_path(self, batch_id: str) -> str:
+        return os.path.join(self.directory, f"{batch_id}.json")
+
+    def _response_line(self, request: Dict[str, Any]) -> str:
+        try:
+            response = self.complete(request["body"])
+        except Exception as e:
+            return json.dumps({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"],
+                               "response": None, "error": {"code": type(e).__name__, "message": str(e)}})
+        usage = response.usage
+        details = getattr(usage, "completion_tokens_details", None)
+        prompt_details = getattr(usage, "prompt_tokens_details", None)
+        body = {
+            "object": "chat.completion",
+            "model": request["body"].get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": response.choices[0].message.content}}],
+            "usage": {
+                "prompt_tokens": getattr(usage, "prompt_tokens", 0),
+                "completion_tokens": getattr(usage, "completion_tokens", 0),
+                "total_tokens": getattr(usage, "total_tokens", 0),
+                "completion_tokens_details": {"reasoning_tokens": getattr(details, "reasoning_tokens", 0)},
+                "prompt_tokens_details": {"cached_tokens": getattr(prompt_details, "cached_tokens", 0)},
+            },
+        }
+        return json.dumps({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"],
+                           "response": {"status_code": 200, "body": body}, "error": None}, ensure_ascii=False)
+
+    def submit(self, input_path: str, metadata: Optional[Dict[str, str]] = None) -> str:
+        batch_id = f"batch_local_{uuid.uuid4().hex}"
+        output_path = os.path.join(self.directory, f"{batch_id}.output.jsonl")
+        completed = failed = 0
+        with open(input_path, "r", encoding="utf-8") as f, open(output_path, "w", encoding="utf-8") as out:
+            for line in f:
+                if not line.strip():
+                    continue
+                response_line = self._response_line(json.loads(line))
+                out.write(response_line + "\n")
+                if json.loads(response_line)["error"] is None:
+                    completed += 1
+                else:
+                    failed += 1
+        with open(self._state_path(batch_id), "w", encoding="utf-8") as f:
+            json.dump({
+                "status": "completed", "output_file_id": output_path, "error_file_id": None,
+                "completed": completed, "failed": failed, "total": completed + failed
+            }, f)
+        return batch_id
+
+    def retrieve(self, batch_id: str) -> Dict[str, Any]:
+        with open(self._state_path(batch_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def download(self, file_id: str, path: str):
+        shutil.copyfile(file_id, path)
+
+
+class BatchDirectory:
+    """The input, manifest, state and output files of one batch."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.input_path = os.path.join(path, "input.jsonl")
+        self.manifest_path = os.path.join(path, "manifest.jsonl")
+        self.state_path = os.path.join(path, "state.json")
+        self.output_path = os.path.join(path, "output.jsonl")
+        self.errors_path = os.path.join(path, "errors.jsonl")
+        self.state = self._load_state()
+
+    def _load_state(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.state_path):
+            return None
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_state(self, **fields):
+        self.state = {**(self.state or {}), **fields}
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_path)
+
+    @property
+    def status(self) -> Optional[str]:
+        return self.state.get("status") if self.state else None
+
+    @property
+    def batch_id(self) -> Optional[str]:
+        return self.state.get("batch_id") if self.state else None
+
+    def iter_manifest(self) -> Iterator[Dict[str, Any]]:
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def read_results(self) -> Dict[str, Tuple[Optional[str], Any, Optional[str]]]:
+        """(content, usage, error) per custom_id, from the downloaded output and error files."""
+        results = {}
+        for path in (self.output_path, self.errors_path):
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        custom_id, content, usage, error = parse_output_line(line)
+                        results[custom_id] = (content, usage, error)
+        return results
+
+
+class BatchPreparer:
+    """
+    Writes requests into batch directories, grouped by an item (e.g. a page)
+    whose requests always share a batch, and starts a new batch before one
+    would exceed the request or size limit.
+    """
+
+    def __init__(self, root: str, max_requests: int = MAX_REQUESTS_PER_BATCH, max_bytes: int = MAX_BYTES_PER_BATCH):
+        self.root = root
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.prepared: List[BatchDirectory] = []
+        self.current: Optional[BatchDirectory] = None
+        self.input_file = None
+        self.manifest_file = None
+        self.requests = 0
+        self.bytes = 0
+
+    def _open(self):
+        name = time.strftime("%Y%m%d-%H%M%S") + f"-{uuid.uuid4().hex[:8]}"
+        path = os.path.join(self.root, name)
+        os.makedirs(path)
+        self.current = BatchDirectory(path)
+        self.input_file = open(self.current.input_path, "w", encoding="utf-8")
+        self.manifest_file = open(self.current.manifest_path, "w", encoding="utf-8")
+        self.requests = 0
+        self.bytes = 0
+
+    def _close_current(self):
+        if self.current is None:
+            return
+        for f in (self.input_file, self.manifest_file):
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        self.current.save_state(status=PREPARED, requests=self.requests, created=time.time())
+        self.prepared.append(self.current)
+        self.current = None
+
+    def add(self, manifest_entry: Dict[str, Any], request_lines: List[str]):
+        """
+        Add one item's requests (from batch_request_line) and its manifest entry.
+        """
+        size = sum(len(line.encode("utf-8")) for line in request_lines)
+        if self.current is not None and (self.requests + len(request_lines) > self.max_requests
+                                         or self.bytes + size > self.max_bytes):
+            self._close_current()
+        if self.current is None:
+            self._open()
+        self.input_file.writelines(request_lines)
+        self.manifest_file.write(json.dumps(manifest_entry, ensure_ascii=False) + "\n")
+        self.requests += len(request_lines)
+        self.bytes += size
+
+    def close(self) -> List[BatchDirectory]:
+        """Finish the last batch. Returns every batch prepared."""
+        self._close_current()
+        return self.prepared
+
+
+def list_batches(root: str) -> List[BatchDirectory]:
+    """
+    Batch directories under `root` in creation order. Directories whose input
+    was never completed are removed.
+    """
+    if not os.path.isdir(root):
+        return []
+    batches = []
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if not os.path.isdir(path):
+            continue
+        batch = BatchDirectory(path)
+        if batch.state is None:
+            shutil.rmtree(path)
+            continue
+        batches.append(batch)
+    return batches
+
+
+def find_batch(root: str, batch_id: str) -> Optional[BatchDirectory]:
+    for batch in list_batches(root):
+        if batch.batch_id == batch_id:
+            return batch
+    return None
+
+
+def wait_for_batch(client, batch: BatchDirectory, poll_seconds: float = 60.0, stop=None) -> Optional[Dict[str, Any]]:
+    """
+    Poll a submitted batch until it ends, then download its output.
+
+    Returns:
+        The final batch info, or None if `stop` was set first
+    """
+    last = None
+    while True:
+        info = client.retrieve(batch.batch_id)
+        progress = (info["status"], info["completed"], info["failed"])
+        if progress != last:
+            log.info("  Batch %s: %s (%d/%d done, %d failed)",
+                     batch.batch_id, info['status'], info['completed'], info['total'], info['failed'])
+            last = progress
+        if info["status"] in TERMINAL_STATUSES:
+            break
+        if stop is not None and stop.wait(poll_seconds):
+            return None
+        if stop is None:
+            time.sleep(poll_seconds)
+
+    if info.get("output_file_id"):
+        client.download(info["output_file_id"], batch.output_path)
+    if info.get("error_file_id"):
+        client.download(info["error_file_id"], batch.errors_path)
+    return info
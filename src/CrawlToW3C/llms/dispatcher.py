@@ -0,0 +1,319 @@
+"""
+LLM Dispatcher
+
+Keeps several chat completion requests in flight against the OpenAI API while
+staying inside the account's tokens-per-minute (TPM) and requests-per-minute
+(RPM) limits. Both limits are tracked with continuously refilling token
+buckets which are corrected from the x-ratelimit-* response headers, and a 429
+pauses every worker for the advertised retry-after period. Connection errors,
+timeouts and 5xx responses are retried with exponential backoff, as the SDK
+client would have.
+
+Prompt tokens served from the provider's prompt cache can be credited: each
+counts as `cached_token_weight` of a token against the TPM budget, both when
+a request is settled and when the next request with the same system prompt
+reserves its tokens. The x-ratelimit headers still clamp the budget if the
+account counts them in full.
+"""
+
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
+
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+from CrawlToW3C import metrics
+from CrawlToW3C.llms.openai_wrapper import create_completion, stream_completion
+from CrawlToW3C.llms.token_accounting import UsageTotals, budget_tokens, cached_prompt_tokens
+from CrawlToW3C.llms.token_count import TokenEstimator, count_tokens_openai, MESSAGE_OVERHEAD_TOKENS
+
+
+# Failures worth another attempt; APITimeoutError is an APIConnectionError, listed for clarity
+TRANSIENT_ERRORS = (APIConnectionError, APITimeoutError, InternalServerError)
+
+MAX_BACKOFF_SECONDS = 60
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_SECONDS = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a rate limit duration header into seconds.
+
+    Accepts plain seconds ("20", "0.5") as sent in retry-after, and the
+    compound form used by x-ratelimit-reset-* ("1m30s", "250ms").
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_SECONDS[unit] for amount, unit in parts)
+
+
+def _header_int(headers, name: str) -> Optional[int]:
+    value = headers.get(name) if headers is not None else None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """A bucket of `per_minute` units that refills continuously at per_minute / 60 per second."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available (requests larger than the bucket wait for a full bucket)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount: float, now: float):
+        """Take `amount` units. The level may go negative, which is repaid by refilling."""
+        self._refill(now)
+        self.level -= amount
+
+    def clamp(self, remaining: float, now: float):
+        """Never believe we have more headroom than the server reports."""
+        self._refill(now)
+        self.level = min(self.level, remaining)
+
+
+class RateLimiter:
+    """Shared TPM/RPM limiter used by every dispatcher worker thread."""
+
+    def __init__(self, tokens_per_minute: int, requests_per_minute: int):
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.requests = TokenBucket(requests_per_minute)
+        self.paused_until = 0.0
+        self.throttled_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: int):
+        """Block until one request carrying `tokens` tokens fits inside both limits."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = max(
+                    self.paused_until - now,
+                    self.tokens.wait_time(tokens, now),
+                    self.requests.wait_time(1, now),
+                )
+                if wait <= 0:
+                    self.tokens.consume(tokens, now)
+                    self.requests.consume(1, now)
+                    metrics.observe("rate_limit_wait", waited)
+                    return
+            wait = min(wait, 1.0)
+            time.sleep(wait)
+            waited += wait
+            with self.lock:
+                self.throttled_seconds += wait
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        """Correct the token bucket once the real usage of a request is known."""
+        with self.lock:
+            self.tokens.consume(actual_tokens - estimated_tokens, time.monotonic())
+
+    def update_from_headers(self, headers):
+        """Clamp both buckets to the x-ratelimit-remaining-* values returned by the API."""
+        remaining_tokens = _header_int(headers, "x-ratelimit-remaining-tokens")
+        remaining_requests = _header_int(headers, "x-ratelimit-remaining-requests")
+        with self.lock:
+            now = time.monotonic()
+            if remaining_tokens is not None:
+                self.tokens.clamp(remaining_tokens, now)
+            if remaining_requests is not None:
+                self.requests.clamp(remaining_requests, now)
+
+    def pause(self, seconds: float):
+        """Stop all workers for `seconds` and empty the buckets after a 429."""
+        with self.lock:
+            now = time.monotonic()
+            self.paused_until = max(self.paused_until, now + seconds)
+            self.tokens.clamp(0, now)
+            self.requests.clamp(0, now)
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """Work out how long a 429 asks us to wait, from retry-after-ms, retry-after or x-ratelimit-reset-*."""
+    if headers is None:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+    for name in ("retry-after", "x-ratelimit-reset-tokens", "x-ratelimit-reset-requests"):
+        seconds = parse_duration(headers.get(name))
+        if seconds is not None:
+            return seconds
+    return None
+
+
+class LLMDispatcher:
+    """
+    Runs chat completions on a thread pool with at most `max_in_flight`
+    requests outstanding, all sharing one RateLimiter.
+    """
+
+    def __init__(self, llm, max_in_flight: int = 8, tokens_per_minute: int = 400000,
+                 requests_per_minute: int = 500, model: str = "gpt-5", max_retries: int = 6,
+                 completion_tokens_estimate: int = 1500, cached_token_weight: float = 1.0):
+        """
+        Initialize the dispatcher.
+
+        Args:
+            llm: OpenAI client
+            max_in_flight: Number of concurrent requests
+            tokens_per_minute: TPM budget (keep some headroom under the account limit)
+            requests_per_minute: RPM budget
+            model: Model name passed to every request
+            max_retries: Attempts per request after a 429 or a transient error before giving up
+            completion_tokens_estimate: Completion tokens reserved per request until usage is known
+            cached_token_weight: Share of a cached prompt token counted against the TPM budget
+        """
+        # Retries are handled here so the limiter sees every 429 (see complete())
+        self.llm = llm.with_options(max_retries=0)
+        self.max_in_flight = max_in_flight
+        self.model = model
+        self.max_retries = max_retries
+        self.completion_tokens_estimate = completion_tokens_estimate
+        self.cached_token_weight = cached_token_weight
+        self.limiter = RateLimiter(tokens_per_minute, requests_per_minute)
+        self.estimator = TokenEstimator(model=model)
+        self.usage = UsageTotals()
+        self.system_prompt_tokens = {}
+        # Cached prompt tokens last reported per system prompt: the prefix the next request can expect cached
+        self.cached_prefix_tokens = {}
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="llm")
+
+    def count_system_prompt(self, system_prompt: str) -> int:
+        """Exact token count of a system prompt, tokenized once per prompt."""
+        tokens = self.system_prompt_tokens.get(system_prompt)
+        if tokens is None:
+            tokens = count_tokens_openai(system_prompt, model=self.model)
+            self.system_prompt_tokens[system_prompt] = tokens
+        return tokens
+
+    def estimate_prompt(self, system_prompt: str, user_prompt: str) -> int:
+        """Pre-flight prompt token estimate: exact system prompt plus calibrated user prompt estimate."""
+        return (self.count_system_prompt(system_prompt) + self.estimator.estimate(user_prompt)
+                + MESSAGE_OVERHEAD_TOKENS)
+
+    def complete(self, system_prompt: str, user_prompt: str, prompt_tokens: Optional[int] = None,
+                 on_text: Optional[Callable[[str], None]] = None) -> str:
+        """
+        Make one rate limited chat completion, retrying on 429 and, with
+        exponential backoff, on connection errors, timeouts and 5xx responses.
+
+        Args:
+            system_prompt: System prompt
+            user_prompt: User prompt
+            prompt_tokens: Prompt tokens (system + user) used to reserve TPM;
+                estimated with estimate_prompt() when not given
+            on_text: Stream the response and call this with each piece of
+                content as it arrives (on the worker thread). A 429 arrives
+                before any content; a stream that fails after content was
+                passed on is not retried, so retries never repeat content.
+
+        Returns:
+            The response content
+        """
+        if prompt_tokens is None:
+            prompt_tokens = self.estimate_prompt(system_prompt, user_prompt)
+        cached_credit = round(self.cached_prefix_tokens.get(system_prompt, 0) * (1 - self.cached_token_weight))
+        estimated_tokens = prompt_tokens - cached_credit + self.completion_tokens_estimate
+        streamed = []
+
+        def on_stream_text(text):
+            streamed.append(True)
+            on_text(text)
+
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(estimated_tokens)
+            try:
+                if on_text is not None:
+                    content, headers, usage = stream_completion(
+                        self.llm, system_prompt, user_prompt, model=self.model, on_text=on_stream_text
+                    )
+                else:
+                    content, headers, usage = create_completion(
+                        self.llm, system_prompt, user_prompt, model=self.model
+                    )
+            except RateLimitError as e:
+                metrics.inc("llm_rate_limited")
+                if attempt == self.max_retries:
+                    raise
+                delay = retry_after_seconds(e.response.headers if e.response is not None else None)
+                self.limiter.pause(delay if delay is not None else min(2 ** attempt, MAX_BACKOFF_SECONDS))
+                continue
+            except TRANSIENT_ERRORS:
+                metrics.inc("llm_transient_errors")
+                if attempt == self.max_retries or streamed:
+                    raise
+                # Only this request backs off: the other workers' requests may well succeed
+                time.sleep(min(2 ** attempt, MAX_BACKOFF_SECONDS))
+                continue
+
+            self.limiter.update_from_headers(headers)
+            if usage is not None:
+                billed_prompt, billed_completion, _ = self.usage.record(usage)
+                self.cached_prefix_tokens[system_prompt] = min(
+                    cached_prompt_tokens(usage), self.count_system_prompt(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+                )
+                self.limiter.settle(estimated_tokens, budget_tokens(usage, self.cached_token_weight))
+                user_tokens = billed_prompt - self.count_system_prompt(system_prompt) - MESSAGE_OVERHEAD_TOKENS
+                self.estimator.observe(len(user_prompt.encode("utf-8")), user_tokens)
+            return content
+
+    def imap(self, fn: Callable[[Any], Any], items: Iterable[Any]) -> Iterator[Tuple[Any, Any, Optional[BaseException]]]:
+        """
+        Apply `fn` to each item on the pool and yield (item, result, error) in input order.
+
+        Items are pulled lazily so only a small window of work is pending at any
+        time; a slow request holds back output but not the other workers.
+        """
+        window = self.max_in_flight * 2
+        pending = deque()
+
+        def _next_result():
+            item, future = pending.popleft()
+            try:
+                return item, future.result(), None
+            except Exception as e:
+                return item, None, e
+
+        for item in items:
+            pending.append((item, self.executor.submit(fn, item)))
+            while len(pending) >= window or (pending and pending[0][1].done()):
+                yield _next_result()
+
+        while pending:
+            yield _next_result()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
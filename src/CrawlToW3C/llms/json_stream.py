@@ -0,0 +1,122 @@
+"""
+Incremental JSON Parsing
+
+Parses a JSON document as it streams in and hands on each element of
+selected arrays (e.g. annotationPage.items) as soon as the element is
+complete, before the rest of the document has arrived. Elements finished
+before a stream is cut off are therefore not lost.
+
+Object, array and string elements are handed on; number, boolean and null
+elements of the selected arrays are skipped, as are selected arrays nested inside an
+element that is already being handed on. Memory use is bounded by the
+largest element, not the document.
+"""
+
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+Path = Tuple[str, ...]
+
+
+class _Frame:
+    __slots__ = ("is_object", "path", "key", "expect_key", "captured")
+
+    def __init__(self, is_object: bool, path: Path, captured: bool):
+        self.is_object = is_object
+        self.path = path
+        self.key = None
+        self.expect_key = is_object
+        # This container is an element of a selected array
+        self.captured = captured
+
+
+class StreamingArrayParser:
+    """Calls a callback with each element of the selected arrays as it completes."""
+
+    def __init__(self, callbacks: Dict[Path, Callable[[Any], None]]):
+        """
+        Args:
+            callbacks: Callback per array path, e.g. {("annotationPage", "items"): on_annotation,
+                ("entities",): on_entity}; the path lists the object keys from the root
+        """
+        self.callbacks = callbacks
+        self.stack: List[_Frame] = []
+        self.in_string = False
+        self.escape = False
+        self.key_chars: Optional[List[str]] = None  # the object key being read
+        self.element_chars: Optional[List[str]] = None  # the selected element being read
+        self.string_element = False  # the selected element being read is a string
+        self.elements = 0
+
+    def _child_path(self) -> Path:
+        if not self.stack:
+            return ()
+        parent = self.stack[-1]
+        if parent.is_object:
+            return parent.path + (parent.key if parent.key is not None else "?",)
+        return parent.path + ("[]",)
+
+    def _selected_element(self) -> bool:
+        """Whether a value starting here is an element of a selected array."""
+        return (self.element_chars is None and bool(self.stack) and not self.stack[-1].is_object
+                and self.stack[-1].path in self.callbacks)
+
+    def _element_done(self):
+        element_text = "".join(self.element_chars)
+        self.element_chars = None
+        self.string_element = False
+        try:
+            element = json.loads(element_text)
+        except ValueError:
+            return
+        self.elements += 1
+        self.callbacks[self.stack[-1].path](element)
+
+    def feed(self, text: str):
+        """Parse the next piece of the document."""
+        for char in text:
+            if self.element_chars is not None:
+                self.element_chars.append(char)
+
+            if self.in_string:
+                if self.key_chars is not None:
+                    self.key_chars.append(char)
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.string_element:
+                        self._element_done()
+                    elif self.key_chars is not None:
+                        try:
+                            self.stack[-1].key = json.loads("".join(self.key_chars))
+                        except ValueError:
+                            self.stack[-1].key = None
+                        self.stack[-1].expect_key = False
+                        self.key_chars = None
+                continue
+
+            if char == '"':
+                self.in_string = True
+                if self.stack and self.stack[-1].is_object and self.stack[-1].expect_key:
+                    self.key_chars = [char]
+                elif self._selected_element():
+                    self.element_chars = [char]
+                    self.string_element = True
+            elif char in "{[":
+                captured = self._selected_element()
+                if captured:
+                    self.element_chars = [char]
+                self.stack.append(_Frame(char == "{", self._child_path(), captured))
+            elif char in "}]":
+                if not self.stack:
+                    continue
+                frame = self.stack.pop()
+                if frame.captured:
+                    self._element_done()
+            elif char == ",":
+                if self.stack and self.stack[-1].is_object:
+                    self.stack[-1].expect_key = True
+                    self.stack[-1].key = None
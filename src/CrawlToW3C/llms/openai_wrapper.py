@@ -1,24 +1,72 @@
+import hashlib
 import os
 from openai import OpenAI
+from CrawlToW3C import metrics
 
 def get_client():
     """Must have .env variable 'OPENAI_API_KEY' set"""
     return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-def generate_response(llm, system_prompt:str, user_prompt:str, model: str="gpt-5"):
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt}
-    ]
-
-    response = llm.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=1,
-        reasoning_effort="minimal",
-        response_format={"type": "json_object"}
-    )
+def make_prompt_cache_key(system_prompt:str, model: str="gpt-5"):
+    """Stable prompt_cache_key for a system prompt, so requests sharing it are routed to the same prompt cache."""
+    return "crawl2w3c-" + hashlib.sha256(f"{model}\n{system_prompt}".encode("utf-8")).hexdigest()[:16]
+
+def completion_params(system_prompt:str, user_prompt:str, model: str="gpt-5"):
+    """Chat completion parameters for one request; also the body of a Batch API request.
+
+    The system prompt comes first and never varies within a run, and the page
+    content only appears in the user message, so every request starts with
+    the same bytes and the provider's prompt cache can serve that prefix.
+    """
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        "temperature": 1,
+        "reasoning_effort": "minimal",
+        "response_format": {"type": "json_object"},
+        "prompt_cache_key": make_prompt_cache_key(system_prompt, model=model)
+    }
+
+def create_completion(llm, system_prompt:str, user_prompt:str, model: str="gpt-5"):
+    """Same request as generate_response, but also returns the HTTP response headers
+    (for the x-ratelimit-* values) and the usage block reported by the API."""
+    metrics.inc("llm_requests")
+    with metrics.timer("llm_request"):
+        raw_response = llm.chat.completions.with_raw_response.create(
+            **completion_params(system_prompt, user_prompt, model=model)
+        )
+        response = raw_response.parse()
 
     content = response.choices[0].message.content.strip()
-    return content
+    return content, raw_response.headers, response.usage
+
+def stream_completion(llm, system_prompt:str, user_prompt:str, model: str="gpt-5", on_text=None):
+    """create_completion with the response streamed: `on_text` is called with
+    each piece of content as it arrives. Returns (content, headers, usage)
+    like create_completion; the usage comes with the last chunk."""
+    metrics.inc("llm_requests")
+    with metrics.timer("llm_request"):
+        raw_response = llm.chat.completions.with_raw_response.create(
+            **completion_params(system_prompt, user_prompt, model=model),
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        parts = []
+        usage = None
+        for chunk in raw_response.parse():
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            for choice in chunk.choices:
+                text = choice.delta.content
+                if text:
+                    parts.append(text)
+                    if on_text is not None:
+                        on_text(text)
+    return "".join(parts).strip(), raw_response.headers, usage
 
+def generate_response(llm, system_prompt:str, user_prompt:str, model: str="gpt-5"):
+    content, _, _ = create_completion(llm, system_prompt, user_prompt, model=model)
+    return content
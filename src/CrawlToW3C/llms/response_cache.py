@@ -0,0 +1,131 @@
+"""
+LLM Response Cache
+
+Persistent SQLite cache of LLM responses keyed on the content of the request:
+the WARC payload digest of the page, its URL, the system prompt, the model and
+the preprocessing version. Re-running the pipeline over unchanged pages then
+costs no API calls. The cache is capped in size and evicts the least recently
+used responses.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+def make_cache_key(payload_digest: Optional[str], url: str, system_prompt: str,
+                   model: str, preprocess_version: str) -> Optional[str]:
+    """
+    Build a cache key for one page request.
+
+    The URL is part of the key because the annotations returned by the LLM
+    target it, so identical payloads served at different URLs must not share
+    a response.
+
+    Returns:
+        Hex digest key, or None when the record has no payload digest
+    """
+    if not payload_digest:
+        return None
+    prompt_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+    parts = [payload_digest, str(url), prompt_hash, model, preprocess_version]
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Size-capped LRU cache of LLM responses stored in SQLite."""
+
+    def __init__(self, path: str, max_bytes: int = 512 * 1024 * 1024):
+        """
+        Open (or create) the cache.
+
+        Args:
+            path: SQLite database file
+            max_bytes: Total size of cached responses before LRU eviction starts
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: Optional[str]) -> Optional[str]:
+        """Return the cached response for `key` (or None), counting the hit or miss."""
+        if key is None:
+            return None
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            return row[0]
+
+    def put(self, key: Optional[str], response: str):
+        """Store a response, evicting the least recently used entries if over the size cap."""
+        if key is None or response is None:
+            return
+        size = len(response.encode("utf-8"))
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if old is not None:
+                self.total_bytes -= old[0]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time())
+            )
+            self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        # Evict down to 90% of the cap so we don't evict on every put
+        target = int(self.max_bytes * 0.9)
+        while self.total_bytes > target:
+            rows = self.conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 256"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self.total_bytes <= target:
+                    break
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.total_bytes -= size
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "bytes": self.total_bytes,
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,94 @@
+"""
+Token Accounting
+
+Tracks the tokens OpenAI actually bills, taken from the `usage` block of each
+response, so budgets and rate limit decisions match the invoice rather than a
+local re-tokenization of the prompt and completion.
+
+Prompt tokens served from the provider's prompt cache are reported in
+`usage.prompt_tokens_details.cached_tokens` and billed at a discount
+(CACHED_PROMPT_PRICE_RATIO); they are tracked separately so runs can report
+the cache hit rate and the effective billed tokens.
+"""
+
+import threading
+from typing import Any, Dict, Tuple
+
+# Price of a cached prompt token relative to an uncached one (gpt-5: $0.125 vs $1.25 per 1M)
+CACHED_PROMPT_PRICE_RATIO = 0.1
+
+
+def usage_tokens(usage) -> Tuple[int, int, int]:
+    """
+    Extract billed token counts from an OpenAI usage object.
+
+    Returns:
+        (prompt_tokens, completion_tokens, reasoning_tokens); reasoning tokens
+        are already included in completion_tokens
+    """
+    if usage is None:
+        return 0, 0, 0
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    details = getattr(usage, "completion_tokens_details", None)
+    reasoning_tokens = (getattr(details, "reasoning_tokens", 0) or 0) if details is not None else 0
+    return prompt_tokens, completion_tokens, reasoning_tokens
+
+
+def cached_prompt_tokens(usage) -> int:
+    """Prompt tokens served from the prompt cache (part of prompt_tokens)."""
+    details = getattr(usage, "prompt_tokens_details", None) if usage is not None else None
+    return (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+
+
+def budget_tokens(usage, cached_token_weight: float = 1.0) -> int:
+    """
+    Tokens a response counts against a token budget, with each cached prompt
+    token counted as `cached_token_weight` of a token.
+    """
+    prompt_tokens, completion_tokens, _ = usage_tokens(usage)
+    cached = cached_prompt_tokens(usage)
+    return round(prompt_tokens - cached * (1 - cached_token_weight) + completion_tokens)
+
+
+class UsageTotals:
+    """Thread-safe running totals of billed tokens across a run."""
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.reasoning_tokens = 0
+        self.cached_tokens = 0
+        self.lock = threading.Lock()
+
+    def record(self, usage) -> Tuple[int, int, int]:
+        """Add one response's usage to the totals and return its (prompt, completion, reasoning) tokens."""
+        prompt_tokens, completion_tokens, reasoning_tokens = usage_tokens(usage)
+        cached_tokens = cached_prompt_tokens(usage)
+        with self.lock:
+            self.requests += 1
+            self.cached_tokens += cached_tokens
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.reasoning_tokens += reasoning_tokens
+        return prompt_tokens, completion_tokens, reasoning_tokens
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def summary(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "reasoning_tokens": self.reasoning_tokens,
+                "total_tokens": self.prompt_tokens + self.completion_tokens,
+                "cached_tokens": self.cached_tokens,
+                "cache_hit_rate": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+                # Uncached-token equivalent of what was billed
+                "effective_tokens": round(self.prompt_tokens - self.cached_tokens * (1 - CACHED_PROMPT_PRICE_RATIO)
+                                          + self.completion_tokens),
+            }
@@ -1,6 +1,95 @@
+import math
+import threading
+from functools import lru_cache
+
 import tiktoken
 
-def count_tokens_openai(text: str):
-    encoding = tiktoken.get_encoding("cl100k_base")
-    tokens = len(encoding.encode(text))
+from CrawlToW3C import metrics
+
+# Tokens added by the chat format around each request (role markers etc.)
+MESSAGE_OVERHEAD_TOKENS = 7
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = "gpt-5"):
+    """The tokenizer for `model` (o200k_base for gpt-5 and other current models)."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens_openai(text: str, model: str = "gpt-5"):
+    encoding = get_encoding(model)
+    with metrics.timer("tokenize"):
+        tokens = len(encoding.encode(text, disallowed_special=()))
+    metrics.inc("tokenized_texts")
     return tokens
+
+
+def count_tokens_batch(texts, model: str = "gpt-5"):
+    """Exact token counts for several texts, encoded in parallel by tiktoken."""
+    encoding = get_encoding(model)
+    texts = list(texts)
+    with metrics.timer("tokenize"):
+        counts = [len(tokens) for tokens in encoding.encode_batch(texts, disallowed_special=())]
+    metrics.inc("tokenized_texts", len(texts))
+    return counts
+
+
+class TokenEstimator:
+    """
+    Cheap pre-flight token estimate from the UTF-8 byte length of a text.
+
+    The bytes-per-token ratio starts at a typical value for English HTML text
+    and is calibrated with the prompt tokens OpenAI actually bills (see
+    observe()). Exact tokenization is only used for texts whose estimate is
+    close to a limit that matters.
+    """
+
+    def __init__(self, bytes_per_token: float = 4.0, smoothing: float = 0.05,
+                 exact_margin: float = 0.15, model: str = "gpt-5"):
+        """
+        Initialize the estimator.
+
+        Args:
+            bytes_per_token: Starting bytes-per-token ratio
+            smoothing: Weight of each new observation in the running ratio
+            exact_margin: Texts estimated within this fraction of a limit are counted exactly
+            model: Model whose tokenizer is used for exact counts
+        """
+        self.bytes_per_token = bytes_per_token
+        self.smoothing = smoothing
+        self.exact_margin = exact_margin
+        self.model = model
+        self.exact_counts = 0
+        self.lock = threading.Lock()
+
+    def estimate(self, text: str) -> int:
+        return math.ceil(len(text.encode("utf-8")) / self.bytes_per_token)
+
+    def observe(self, num_bytes: int, billed_tokens: int):
+        """Calibrate the ratio against a billed token count for a text of `num_bytes` bytes."""
+        if num_bytes <= 0 or billed_tokens <= 0:
+            return
+        ratio = num_bytes / billed_tokens
+        with self.lock:
+            self.bytes_per_token += self.smoothing * (ratio - self.bytes_per_token)
+
+    def count_near_limit(self, texts, limit: int):
+        """
+        Token counts for `texts` that are exact wherever it could matter for `limit`.
+
+        Texts whose estimate is within exact_margin of the limit (or over it)
+        are tokenized together with one encode_batch call; the rest keep the
+        estimate.
+        """
+        counts = [self.estimate(text) for text in texts]
+        threshold = limit * (1.0 - self.exact_margin)
+        near = [i for i, count in enumerate(counts) if count >= threshold]
+        if near:
+            exact = count_tokens_batch([texts[i] for i in near], model=self.model)
+            for i, count in zip(near, exact):
+                counts[i] = count
+            self.exact_counts += len(near)
+        return counts
@@ -0,0 +1,206 @@
+"""
+Batched URL Selection
+
+Asks the LLM for archive/skip decisions on many URLs in one request instead
+of one request per URL, so the system prompt and the round trip are paid once
+per batch. Decisions are cached in SQLite by normalised URL, keyed on the
+prompt and model, so recrawls and duplicate URLs cost nothing.
+
+URLs missing from a batch response, or given an unknown decision, fall back
+to the single-URL prompt.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from CrawlToW3C.llms.openai_wrapper import create_completion
+from CrawlToW3C.llms.token_accounting import budget_tokens
+from CrawlToW3C.url_filter import normalise
+
+DECISIONS = ("archive", "skip")
+
+
+def build_batch_prompt(urls: List[str]) -> str:
+    """User prompt for a batch: the URLs with their position as id."""
+    return json.dumps({"urls": [{"id": i, "url": url} for i, url in enumerate(urls)]})
+
+
+def parse_batch_decisions(content: str, count: int) -> Dict[int, str]:
+    """
+    Read the decisions out of a batch response.
+
+    Args:
+        content: Response JSON, {"decisions": [{"id": ..., "decision": ...}, ...]}
+        count: Number of URLs in the batch
+
+    Returns:
+        Decision per id; ids that are missing, out of range or have an unknown
+        decision are left out
+    """
+    try:
+        items = json.loads(content).get("decisions", [])
+    except (ValueError, AttributeError):
+        return {}
+    decisions = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        try:
+            i = int(item.get("id"))
+        except (TypeError, ValueError):
+            continue
+        decision = item.get("decision")
+        if 0 <= i < count and decision in DECISIONS:
+            decisions[i] = decision
+    return decisions
+
+
+class DecisionCache:
+    """URL selection decisions stored in SQLite by normalised URL."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS decisions ("
+            " url_key TEXT NOT NULL,"
+            " version TEXT NOT NULL,"
+            " decision TEXT NOT NULL,"
+            " PRIMARY KEY (url_key, version)) WITHOUT ROWID"
+        )
+        self.conn.commit()
+
+    def get_many(self, keys: Iterable[str], version: str) -> Dict[str, str]:
+        """Cached decisions for the keys that have one, counting hits and misses."""
+        found = {}
+        with self.lock:
+            for key in keys:
+                row = self.conn.execute(
+                    "SELECT decision FROM decisions WHERE url_key = ? AND version = ?", (key, version)
+                ).fetchone()
+                if row is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                    found[key] = row[0]
+        return found
+
+    def put_many(self, decisions: Dict[str, str], version: str):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO decisions (url_key, version, decision) VALUES (?, ?, ?)",
+                [(key, version, decision) for key, decision in decisions.items()]
+            )
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM decisions").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class UrlSelector:
+    """Archive/skip decisions for URLs, batched and cached."""
+
+    def __init__(self, llm, batch_prompt: str, single_prompt: str, model: str = "gpt-5",
+                 cache: Optional[DecisionCache] = None, usage_totals=None, batch_size: int = 50,
+                 cached_token_weight: float = 1.0):
+        """
+        Initialize the selector.
+
+        Args:
+            llm: OpenAI client
+            batch_prompt: System prompt for a batch of URLs (gpt5_url_selection_batch)
+            single_prompt: System prompt for one URL (gpt5_url_selection)
+            model: Model name
+            cache: Decision cache, or None to always ask the LLM
+            usage_totals: UsageTotals that billed usage is recorded in
+            batch_size: URLs per request; 1 sends every URL on its own with the single prompt
+            cached_token_weight: Share of a prompt-cached token counted in the tokens returned by decide()
+        """
+        self.llm = llm
+        self.batch_prompt = batch_prompt
+        self.single_prompt = single_prompt
+        self.model = model
+        self.cache = cache
+        self.usage_totals = usage_totals
+        self.batch_size = max(1, batch_size)
+        self.cached_token_weight = cached_token_weight
+        self.version = hashlib.sha256("\n".join([batch_prompt, single_prompt, model]).encode("utf-8")).hexdigest()
+        self.requests = 0
+        self.fallbacks = 0
+
+    def _complete(self, system_prompt: str, user_prompt: str) -> Tuple[str, int]:
+        content, _, usage = create_completion(self.llm, system_prompt, user_prompt, model=self.model)
+        self.requests += 1
+        if self.usage_totals is not None:
+            self.usage_totals.record(usage)
+        return content, budget_tokens(usage, self.cached_token_weight)
+
+    def _decide_one(self, url: str) -> Tuple[Optional[str], int]:
+        content, tokens = self._complete(self.single_prompt, url)
+        try:
+            decision = json.loads(content).get("decision")
+        except (ValueError, AttributeError):
+            decision = None
+        return decision, tokens
+
+    def _decide_batch(self, urls: List[str]) -> Tuple[Dict[str, Optional[str]], int]:
+        if len(urls) == 1:
+            decision, tokens = self._decide_one(urls[0])
+            return {urls[0]: decision}, tokens
+        content, tokens = self._complete(self.batch_prompt, build_batch_prompt(urls))
+        by_id = parse_batch_decisions(content, len(urls))
+        decisions = {}
+        for i, url in enumerate(urls):
+            if i in by_id:
+                decisions[url] = by_id[i]
+            else:
+                self.fallbacks += 1
+                decisions[url], used = self._decide_one(url)
+                tokens += used
+        return decisions, tokens
+
+    def decide(self, urls: List[str]) -> Tuple[Dict[str, Optional[str]], int]:
+        """
+        Decide a list of URLs.
+
+        Returns:
+            (decision per URL, tokens spent against the budget); a decision is "archive",
+            "skip", or whatever an unparseable single-URL response gave
+        """
+        keys = {url: normalise(url) for url in urls}
+        cached = self.cache.get_many(set(keys.values()), self.version) if self.cache is not None else {}
+
+        # One request slot per normalised URL
+        pending = {}
+        for url, key in keys.items():
+            if key not in cached and key not in pending:
+                pending[key] = url
+
+        tokens = 0
+        fresh = {}
+        pending_urls = list(pending.values())
+        for start in range(0, len(pending_urls), self.batch_size):
+            decisions, used = self._decide_batch(pending_urls[start:start + self.batch_size])
+            tokens += used
+            for url, decision in decisions.items():
+                fresh[keys[url]] = decision
+        if self.cache is not None:
+            self.cache.put_many({key: d for key, d in fresh.items() if d in DECISIONS}, self.version)
+
+        decisions = {url: cached.get(key, fresh.get(key)) for url, key in keys.items()}
+        return decisions, tokens
@@ -0,0 +1,316 @@
+"""
+Pipeline Metrics
+
+Counters and latency histograms per pipeline stage, kept in one
+process-wide registry (REGISTRY) that the stages record into:
+
+- warc_read: reading and inflating the WARC up to the next HTML response
+- html_preprocess: process_html
+- tokenize: exact tiktoken counts
+- llm_request: one chat completion, including a streamed body
+- rate_limit_wait: time a request waited for the TPM/RPM limiter
+- miiify_upload: one annotation upload
+- entity_flush: writing buffered entities to a file
+
+WARC reader processes send their metrics back to the parent with their
+results, so parallel reads are counted too. The registry can be served in
+the Prometheus text format (MetricsServer), written as periodic JSON
+snapshots (SnapshotWriter) and summarised as an end-of-run report
+(run_report). Histograms use fixed buckets, so recording is O(1) and
+percentiles are estimated within a bucket.
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+# Upper bounds in seconds, from sub-millisecond parsing to multi-minute LLM requests
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+
+REPORT_QUANTILES = (0.5, 0.95, 0.99)
+
+METRIC_PREFIX = "crawl2w3c"
+
+
+class Histogram:
+    """Bucketed latency distribution with count, sum and max."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by linear interpolation within its bucket (as Prometheus does)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def state(self) -> Dict[str, Any]:
+        return {"counts": list(self.counts), "count": self.count, "sum": self.sum, "max": self.max}
+
+    def merge(self, state: Dict[str, Any]):
+        for i, count in enumerate(state["counts"]):
+            self.counts[i] += count
+        self.count += state["count"]
+        self.sum += state["sum"]
+        self.max = max(self.max, state["max"])
+
+    def summary(self) -> Dict[str, float]:
+        summary = {
+            "count": self.count,
+            "total_seconds": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+            "max": round(self.max, 6),
+        }
+        for q in REPORT_QUANTILES:
+            summary[f"p{round(q * 100)}"] = round(self.quantile(q), 6)
+        return summary
+
+
+class MetricsRegistry:
+    """Named counters and histograms, safe to record into from several threads."""
+
+    def __init__(self):
+        self.counters: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """Observe the time spent in the with block, also when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def drain(self) -> Dict[str, Any]:
+        """Everything recorded so far, leaving the registry empty (see merge())."""
+        with self.lock:
+            state = {
+                "counters": self.counters,
+                "histograms": {name: histogram.state() for name, histogram in self.histograms.items()},
+            }
+            self.counters = {}
+            self.histograms = {}
+        return state
+
+    def merge(self, state: Dict[str, Any]):
+        """Add a drained state, e.g. from a worker process."""
+        with self.lock:
+            for name, value in state["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, histogram_state in state["histograms"].items():
+                histogram = self.histograms.get(name)
+                if histogram is None:
+                    histogram = self.histograms[name] = Histogram()
+                histogram.merge(histogram_state)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters and per-stage latency summaries, as plain data."""
+        with self.lock:
+            return {
+                "counters": dict(sorted(self.counters.items())),
+                "stages": {name: self.histograms[name].summary() for name in sorted(self.histograms)},
+            }
+
+    def prometheus_text(self, prefix: str = METRIC_PREFIX) -> str:
+        """The registry in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                metric = f"{prefix}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value:g}")
+            for name, histogram in sorted(self.histograms.items()):
+                metric = f"{prefix}_{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound:g}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f"{metric}_sum {histogram.sum:.6f}")
+                lines.append(f"{metric}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def inc(name: str, value: float = 1):
+    """Add to a counter of the process-wide registry."""
+    REGISTRY.inc(name, value)
+
+
+def observe(name: str, seconds: float):
+    """Record a latency in the process-wide registry."""
+    REGISTRY.observe(name, seconds)
+
+
+def timer(name: str):
+    """Time a with block into the process-wide registry."""
+    return REGISTRY.timer(name)
+
+
+class MetricsServer:
+    """Serves a registry over HTTP: /metrics (Prometheus text) and /metrics.json."""
+
+    def __init__(self, port: int, registry: MetricsRegistry = REGISTRY, host: str = "0.0.0.0"):
+        """
+        Start serving on a background thread.
+
+        Args:
+            port: Port to listen on
+            registry: Registry to serve
+            host: Interface to bind
+        """
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = registry.prometheus_text().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(registry.snapshot()).encode("utf-8")
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # scrapes are not worth a log line each
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+def write_json(path: str, data: Dict[str, Any]):
+    """Write JSON atomically, so readers never see a partial file."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class SnapshotWriter:
+    """Writes a registry snapshot to a JSON file every `interval` seconds, and once more on close()."""
+
+    def __init__(self, path: str, interval: float = 30.0, registry: MetricsRegistry = REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="metrics-snapshot", daemon=True)
+        self.thread.start()
+
+    def _write(self):
+        write_json(self.path, dict(self.registry.snapshot(), time=time.time()))
+
+    def _run(self):
+        while not self.closed.wait(self.interval):
+            self._write()
+
+    def close(self):
+        self.closed.set()
+        self.thread.join()
+        self._write()
+
+
+def run_report(elapsed_seconds: float, pages: int, usage: Optional[Dict[str, Any]] = None,
+               throttled_seconds: float = 0.0, extra: Optional[Dict[str, Any]] = None,
+               registry: MetricsRegistry = REGISTRY) -> Dict[str, Any]:
+    """
+    Summarise a run.
+
+    Args:
+        elapsed_seconds: Wall-clock duration of the run
+        pages: Pages (WARC HTML responses) processed
+        usage: UsageTotals.summary() of the LLM requests
+        throttled_seconds: Time requests spent waiting on rate limits
+        extra: Further fields to include, e.g. pipeline totals
+        registry: Registry whose counters and stages are reported
+
+    Returns:
+        The report: throughput, LLM usage, counters and p50/p95/p99 per stage
+    """
+    usage = usage or {}
+    tokens = usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+    per_second = (lambda n: round(n / elapsed_seconds, 2)) if elapsed_seconds > 0 else (lambda n: 0.0)
+    report = {
+        "finished": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "elapsed_seconds": round(elapsed_seconds, 3),
+        "pages": pages,
+        "pages_per_second": per_second(pages),
+        "tokens": tokens,
+        "tokens_per_second": per_second(tokens),
+        "throttled_seconds": round(throttled_seconds, 3),
+        "usage": usage,
+    }
+    report.update(extra or {})
+    report.update(registry.snapshot())
+    return report
+
+
+def format_stage_table(report: Dict[str, Any]) -> List[str]:
+    """One line per stage of a run report: count, total time and latency percentiles."""
+    lines = []
+    for name, stage in report.get("stages", {}).items():
+        lines.append(f"  {name:<16} {stage['count']:>8}  total {stage['total_seconds']:>9.2f}s  "
+                     f"p50 {stage['p50'] * 1000:>9.1f}ms  p95 {stage['p95'] * 1000:>9.1f}ms  "
+                     f"p99 {stage['p99'] * 1000:>9.1f}ms")
+    return lines
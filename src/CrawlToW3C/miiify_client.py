@@ -7,24 +7,55 @@ to create containers and upload W3C Web Annotations.
 
 import json
 import hashlib
+import queue
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from typing import Dict, List, Any, Optional
 from urllib.parse import urljoin
+from urllib3.util.retry import Retry
+
+from CrawlToW3C import metrics
+from CrawlToW3C.pipeline_log import get_logger
+
+log = get_logger()
+
+# Statuses retried with exponential backoff (server errors and overload)
+RETRY_STATUSES = (500, 502, 503, 504)
 
 
 class MiiifyClient:
     """Client for interacting with Miiify annotation server."""
     
-    def __init__(self, base_url: str = "http://miiify:10000", host: Optional[str] = None):
+    def __init__(self, base_url: str = "http://miiify:10000", host: Optional[str] = None,
+                 pool_maxsize: int = 16, max_retries: int = 5, backoff_factor: float = 0.5):
         """
         Initialize Miiify client.
         
         Args:
             base_url: Base URL of the Miiify annotation server
             host: Optional Host header value (for W3C Web Annotation protocol)
+            pool_maxsize: Connections kept open to the server (at least the number of upload workers)
+            max_retries: Retries on connection errors and 5xx responses
+            backoff_factor: Exponential backoff base in seconds (0.5, 1, 2, ...)
         """
         self.base_url = base_url.rstrip('/')
         self.session = requests.Session()
+        # Annotation and container POSTs carry a Slug, so retrying them is safe:
+        # a retried upload that had already been stored comes back as a duplicate
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=None,
+            backoff_factor=backoff_factor,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         headers = {
             'Content-Type': 'application/json',
             'Accept': 'application/json'
@@ -68,6 +99,24 @@ class MiiifyClient:
             print(f"Response content: {response.text if 'response' in locals() else 'No response'}")
             raise
     
+    def open_container(self, container_slug: str, container_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Use an existing container, creating it only if it does not exist yet.
+        Unlike create_container, this never deletes annotations already uploaded.
+
+        Args:
+            container_slug: Unique identifier for the container
+            container_data: W3C AnnotationCollection data, used if the container is created
+
+        Returns:
+            The existing container, or the server's response to creating it
+        """
+        response = self.session.get(urljoin(self.base_url, f"/annotations/{container_slug}/"))
+        if response.status_code == 404:
+            return self.create_container(container_slug, container_data)
+        response.raise_for_status()
+        return response.json()
+
     def upload_annotation(self, container_slug: str, annotation_slug: str, 
                          annotation_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -99,7 +148,7 @@ class MiiifyClient:
                 return response.json()
             elif response.status_code == 400 and "annotation exists" in response.text.lower():
                 # Annotation already exists - log and skip
-                print(f"Skipping duplicate annotation: {annotation_slug}")
+                log.info("Skipping duplicate annotation: %s", annotation_slug)
                 return {"skipped": True, "reason": "duplicate"}
             elif response.status_code == 400:
                 raise requests.exceptions.HTTPError(f"400 Bad Request: {response.text}")
@@ -109,7 +158,7 @@ class MiiifyClient:
         except requests.exceptions.RequestException as e:
             # Only raise if it's not a duplicate error we already handled
             if "annotation exists" not in str(e).lower():
-                print(f"Error uploading annotation {annotation_slug}: {e}")
+                log.warning("Error uploading annotation %s: %s", annotation_slug, e)
                 raise
             # For duplicate errors, just return skip status
             return {"skipped": True, "reason": "duplicate"}
@@ -164,6 +213,128 @@ class MiiifyClient:
             return False
 
 
+def _target_source(annotation: Dict[str, Any]) -> Optional[str]:
+    """The page an annotation targets; a target may be an object with a source or just the IRI."""
+    target = annotation.get('target')
+    if isinstance(target, dict):
+        return target.get('source')
+    return target if isinstance(target, str) else None
+
+
+class AnnotationUploader:
+    """
+    Uploads annotations to one container from a pool of background threads.
+
+    Annotations are queued with submit() and return immediately, so uploads
+    overlap with the caller's work; the queue is bounded, so submit() blocks
+    when the server falls behind. Upload, skip and error counts are kept for
+    close() to report.
+    """
+
+    def __init__(self, client: MiiifyClient, container_slug: str, max_in_flight: int = 8,
+                 queue_size: int = 256):
+        """
+        Start the upload workers.
+
+        Args:
+            client: Miiify client shared by the workers
+            container_slug: Container the annotations are uploaded to
+            max_in_flight: Number of concurrent upload requests
+            queue_size: Annotations waiting for a worker before submit() blocks
+        """
+        self.client = client
+        self.container_slug = container_slug
+        self.uploaded = 0
+        self.skipped = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.workers = [
+            threading.Thread(target=self._worker, name=f"miiify-upload-{i}", daemon=True)
+            for i in range(max_in_flight)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def _worker(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                self.queue.task_done()
+                break
+            annotation, batch = task
+            failed = False
+            try:
+                annotation_slug = extract_slug_from_annotation_id(annotation['id'])
+                with metrics.timer("miiify_upload"):
+                    result = self.client.upload_annotation(self.container_slug, annotation_slug, annotation)
+                skipped = isinstance(result, dict) and result.get('skipped')
+                with self.lock:
+                    if skipped:
+                        self.skipped += 1
+                    else:
+                        self.uploaded += 1
+                metrics.inc("annotations_skipped" if skipped else "annotations_uploaded")
+            except Exception as e:
+                log.warning("    ⚠ Error uploading annotation %s: %s", annotation.get('id'), e,
+                            extra={"url": _target_source(annotation)})
+                failed = True
+                with self.lock:
+                    self.errors += 1
+                metrics.inc("annotation_upload_errors")
+            if batch is not None:
+                self._finish(batch, failed)
+            self.queue.task_done()
+
+    def _finish(self, batch: Dict[str, Any], failed: bool):
+        with self.lock:
+            batch['remaining'] -= 1
+            batch['errors'] += failed
+            done = batch['remaining'] == 0
+        if done:
+            batch['on_complete'](batch['errors'])
+
+    def submit(self, annotations: List[Dict[str, Any]], on_complete=None) -> int:
+        """
+        Queue annotations for upload. Annotations without an id are ignored.
+
+        Args:
+            annotations: W3C Annotations
+            on_complete: Optional callback, called with the number of failed
+                uploads once every queued annotation has been attempted
+
+        Returns:
+            Number of annotations queued
+        """
+        annotations = [annotation for annotation in annotations if 'id' in annotation]
+        batch = None
+        if on_complete is not None:
+            if not annotations:
+                on_complete(0)
+                return 0
+            batch = {'remaining': len(annotations), 'errors': 0, 'on_complete': on_complete}
+        for annotation in annotations:
+            self.queue.put((annotation, batch))
+        return len(annotations)
+
+    def join(self):
+        """Wait until every annotation queued so far has been attempted and its batch callback has run."""
+        self.queue.join()
+
+    def close(self) -> Dict[str, int]:
+        """
+        Wait for every queued annotation to be uploaded and stop the workers.
+
+        Returns:
+            Counts of uploaded, skipped (duplicate) and failed annotations
+        """
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        return {'uploaded': self.uploaded, 'skipped': self.skipped, 'errors': self.errors}
+
+
 def extract_slug_from_annotation_id(annotation_id: str) -> str:
     """
     Extract a slug from an annotation ID.
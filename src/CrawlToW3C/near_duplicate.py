@@ -0,0 +1,129 @@
+"""
+Near-Duplicate Detection
+
+SimHash fingerprints of preprocessed page content, and an in-memory index that
+finds earlier pages within a Hamming distance of a new fingerprint. Used to
+skip the LLM call for pages that are the same article served under another URL
+(pagination, print views, tag pages, session parameters).
+"""
+
+import hashlib
+import re
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional
+
+FINGERPRINT_BITS = 64
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def shingles(text: str, size: int = 3) -> Counter:
+    """Count word shingles of `size` words in lower-cased text."""
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        return Counter([" ".join(words)]) if words else Counter()
+    return Counter(" ".join(words[i:i + size]) for i in range(len(words) - size + 1))
+
+
+def simhash(features: Counter) -> int:
+    """64-bit SimHash of weighted features."""
+    weights = [0] * FINGERPRINT_BITS
+    for feature, weight in features.items():
+        h = _feature_hash(feature)
+        for bit in range(FINGERPRINT_BITS):
+            if h >> bit & 1:
+                weights[bit] += weight
+            else:
+                weights[bit] -= weight
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class NearDuplicateIndex:
+    """
+    In-memory SimHash index.
+
+    Fingerprints are split into max_distance + 1 bands. By the pigeonhole
+    principle two fingerprints within max_distance bits agree exactly on at
+    least one band, so only pages sharing a band value are compared.
+    """
+
+    def __init__(self, threshold: float = 0.95, min_features: int = 20, shingle_size: int = 3):
+        """
+        Initialize the index.
+
+        Args:
+            threshold: Similarity (1 - hamming distance / 64) at or above which pages are duplicates
+            min_features: Pages with fewer shingles are never treated as duplicates
+            shingle_size: Words per shingle
+        """
+        self.max_distance = int((1.0 - threshold) * FINGERPRINT_BITS)
+        self.min_features = min_features
+        self.shingle_size = shingle_size
+        num_bands = self.max_distance + 1
+        self.band_bits = -(-FINGERPRINT_BITS // num_bands)
+        self.band_mask = (1 << self.band_bits) - 1
+        self.bands: List[Dict[int, array]] = [dict() for _ in range(num_bands)]
+        self.fingerprints = array("Q")
+        self.urls: List[str] = []
+        self.calls_saved = 0
+
+    def _band_values(self, fingerprint: int):
+        for band in range(len(self.bands)):
+            yield band, (fingerprint >> (band * self.band_bits)) & self.band_mask
+
+    def find(self, fingerprint: int) -> Optional[str]:
+        """Return the URL of an indexed page within max_distance of `fingerprint`, if any."""
+        checked = set()
+        for band, value in self._band_values(fingerprint):
+            for doc_id in self.bands[band].get(value, ()):
+                if doc_id in checked:
+                    continue
+                checked.add(doc_id)
+                if hamming_distance(fingerprint, self.fingerprints[doc_id]) <= self.max_distance:
+                    return self.urls[doc_id]
+        return None
+
+    def add(self, fingerprint: int, url: str):
+        doc_id = len(self.urls)
+        self.fingerprints.append(fingerprint)
+        self.urls.append(url)
+        for band, value in self._band_values(fingerprint):
+            self.bands[band].setdefault(value, array("L")).append(doc_id)
+
+    def check(self, text: str, url: str) -> Optional[str]:
+        """
+        Look up a page and index it if it is new.
+
+        Args:
+            text: Preprocessed page content
+            url: Page URL
+
+        Returns:
+            URL of the earlier near-duplicate page, or None if the page is new
+        """
+        features = shingles(text, self.shingle_size)
+        if len(features) < self.min_features:
+            return None
+        fingerprint = simhash(features)
+        original = self.find(fingerprint)
+        if original is not None:
+            self.calls_saved += 1
+            return original
+        self.add(fingerprint, url)
+        return None
+
+    def __len__(self):
+        return len(self.urls)
@@ -0,0 +1,62 @@
+"""
+Packing
+
+Packs several small preprocessed pages into one LLM request, each between
+delimiter lines carrying a page ID, and routes the per-page results of the
+response back to their pages. Sharing one request amortises the system
+prompt, which is larger than many pages.
+"""
+
+import json
+from typing import Dict, List, Tuple
+
+PAGE_START = "<<<PAGE {page_id}>>>"
+PAGE_END = "<<<END PAGE {page_id}>>>"
+
+
+def build_packed_prompt(pages: List[Tuple[str, str]]) -> str:
+    """
+    Build the user prompt for a pack.
+
+    Args:
+        pages: (page ID, user prompt) per page; each user prompt is the page
+            URL, a blank line and the preprocessed content
+
+    Returns:
+        The pages between their delimiter lines, in order
+    """
+    parts = []
+    for page_id, prompt in pages:
+        parts.append(f"{PAGE_START.format(page_id=page_id)}\n{prompt}\n{PAGE_END.format(page_id=page_id)}")
+    return "\n\n".join(parts)
+
+
+def split_packed_response(content: str, page_ids: List[str]) -> Dict[str, str]:
+    """
+    Route a packed response back to its pages.
+
+    Args:
+        content: Response JSON, {"pages": [{"id": ..., <single-page response fields>}, ...]},
+            e.g. {"id": ..., "annotationPage": ..., "entities": ...}
+        page_ids: IDs of the pages in the pack
+
+    Returns:
+        Per page ID, its single-page response (the entry without its id) as
+        JSON text; pages missing from the response (or an unparseable
+        response) are left out
+    """
+    try:
+        pages = json.loads(content).get("pages", [])
+    except (ValueError, AttributeError):
+        return {}
+    wanted = set(page_ids)
+    routed = {}
+    for page in pages if isinstance(pages, list) else []:
+        if not isinstance(page, dict):
+            continue
+        page_id = str(page.get("id"))
+        if page_id not in wanted or page_id in routed:
+            continue
+        routed[page_id] = json.dumps({key: value for key, value in page.items() if key != "id"},
+                                     ensure_ascii=False)
+    return routed
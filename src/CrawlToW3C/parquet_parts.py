@@ -0,0 +1,117 @@
+"""
+Parquet Part Files
+
+Incremental Parquet output in bounded memory. Rows are buffered up to
+`rows_per_part` and each batch is written as its own part file in a
+directory (part-000001.parquet, ...), atomically, so a crash loses at most
+the rows still buffered. merge_parts() later concatenates the parts into
+one file by streaming them row group by row group.
+
+An `on_commit` hook lets a caller record each part (e.g. in an index)
+after it is written but before it is renamed into place.
+"""
+
+import os
+import re
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+_PART_NAME = re.compile(r"^part-(\d+)\.parquet$")
+
+
+def list_parts(directory: str) -> List[str]:
+    """Part files of a directory, in write order."""
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(name for name in os.listdir(directory) if _PART_NAME.match(name))
+    return [os.path.join(directory, name) for name in names]
+
+
+class ParquetPartWriter:
+    """Buffers rows and writes them as numbered Parquet part files."""
+
+    def __init__(self, directory: str, schema: "pa.Schema", rows_per_part: int = 1000,
+                 compression: str = "zstd",
+                 on_commit: Optional[Callable[[str, List[Dict[str, Any]]], None]] = None):
+        """
+        Initialize the writer.
+
+        Args:
+            directory: Directory for the part files (created if missing)
+            schema: Arrow schema of the rows
+            rows_per_part: Rows buffered before a part (one row group) is written
+            compression: Parquet compression codec
+            on_commit: Called with (part file name, rows) once a part is written
+                to `<part>.tmp` and before it is renamed into place
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.schema = schema
+        self.rows_per_part = rows_per_part
+        self.compression = compression
+        self.on_commit = on_commit
+        self.rows: List[Dict[str, Any]] = []
+        parts = list_parts(directory)
+        self.next_part = int(_PART_NAME.match(os.path.basename(parts[-1])).group(1)) + 1 if parts else 1
+
+    def write(self, row: Dict[str, Any]):
+        self.rows.append(row)
+        if len(self.rows) >= self.rows_per_part:
+            self.flush()
+
+    def flush(self) -> Optional[str]:
+        """Write the buffered rows as a new part file. Returns its path, or None if nothing was buffered."""
+        if not self.rows:
+            return None
+        columns = {field.name: [row.get(field.name) for row in self.rows] for field in self.schema}
+        table = pa.Table.from_pydict(columns, schema=self.schema)
+        path = os.path.join(self.directory, f"part-{self.next_part:06d}.parquet")
+        tmp_path = path + ".tmp"
+        pq.write_table(table, tmp_path, compression=self.compression)
+        if self.on_commit is not None:
+            self.on_commit(os.path.basename(path), self.rows)
+        os.replace(tmp_path, path)
+        self.next_part += 1
+        self.rows = []
+        return path
+
+    def close(self):
+        self.flush()
+
+
+def read_column(path: str, column: str) -> List[Any]:
+    """Values of one column of one part file, reading only that column."""
+    return pq.read_table(path, columns=[column]).column(column).to_pylist()
+
+
+def iter_column(directory: str, column: str) -> Iterator[Any]:
+    """Values of one column across every part, reading only that column."""
+    for path in list_parts(directory):
+        yield from read_column(path, column)
+
+
+def merge_parts(directory: str, output_path: str, compression: str = "zstd") -> int:
+    """
+    Concatenate the part files into one Parquet file in constant memory: one
+    row group is held at a time.
+
+    Returns:
+        Number of rows written
+    """
+    parts = list_parts(directory)
+    if not parts:
+        return 0
+    schema = pq.read_schema(parts[0])
+    rows = 0
+    tmp_path = str(output_path) + ".tmp"
+    with pq.ParquetWriter(tmp_path, schema, compression=compression) as writer:
+        for path in parts:
+            part = pq.ParquetFile(path)
+            for i in range(part.num_row_groups):
+                table = part.read_row_group(i)
+                writer.write_table(table)
+                rows += table.num_rows
+    os.replace(tmp_path, output_path)
+    return rows
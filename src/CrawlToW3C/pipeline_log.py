@@ -0,0 +1,75 @@
+"""
+Pipeline Logging
+
+Per-page progress goes through the "crawl2w3c" logger instead of print(), so
+how much of it is written is set by a level: INFO gives the usual per-URL
+lines, WARNING only the problems. The text format writes the bare messages;
+the JSON format writes one object per line with the time, level and the
+structured fields (page number, URL) passed as `extra`. Messages take
+%-style arguments, so lines below the level are never formatted.
+"""
+
+import json
+import logging
+import sys
+from typing import Optional, TextIO
+
+LOGGER_NAME = "crawl2w3c"
+
+FORMATS = ("text", "json")
+
+# `extra` fields copied into JSON lines
+STRUCTURED_FIELDS = ("page", "url", "chunk")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            # Text lines open with a blank line or an indent to group a page's lines
+            "message": record.getMessage().strip(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def get_logger() -> logging.Logger:
+    """The pipeline logger; scripts that don't configure it get INFO-level text on stdout, as print() gave."""
+    logger = logging.getLogger(LOGGER_NAME)
+    if not logger.handlers:
+        configure_logging()
+    return logger
+
+
+def configure_logging(level: str = "INFO", log_format: str = "text",
+                      stream: Optional[TextIO] = None) -> logging.Logger:
+    """
+    Set up the pipeline logger.
+
+    Args:
+        level: Logging level name, e.g. "INFO", or "WARNING" to drop the per-URL progress lines
+        log_format: "text" (bare messages) or "json" (one object per line)
+        stream: Output stream, stdout by default
+
+    Returns:
+        The logger
+    """
+    if log_format not in FORMATS:
+        raise ValueError(f"Unknown log format: {log_format}")
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(level.upper())
+    logger.propagate = False
+    return logger
@@ -1,5 +1,19 @@
 import os
+import mmap
+import multiprocessing
+import time
+from contextlib import contextmanager
 from warcio.archiveiterator import ArchiveIterator
+from CrawlToW3C.warc_index import load_index, has_fresh_index, iter_index, is_html
+from CrawlToW3C import metrics
+
+# Target size of the byte ranges a large WARC is split into for parallel reads
+SEGMENT_BYTES = 64 * 1024 * 1024
+
+_WORKER_DONE = "__done__"
+_WORKER_ERROR = "__error__"
+_WORKER_METRICS = "__metrics__"
+
 
 def get_warc_file_paths():
     archive_path = os.path.join(
@@ -27,6 +41,11 @@ def iter_warc_records(warc_filepaths: str):
 
 def get_urls(warc_filepaths: str):
     "Returns a list of URLs from a WARC file that correspond to HTML response records"
+    return get_urls_from_index(warc_filepaths)
+
+
+def get_urls_by_scanning(warc_filepaths: str):
+    "Like get_urls, but inflates every record instead of using the CDXJ index"
     urls = []
     for record in iter_warc_records(warc_filepaths):
         if record.rec_type != "response":
@@ -47,55 +66,236 @@ def get_urls(warc_filepaths: str):
     return urls
 
 
-def iter_html_responses(warc_filepaths: str):
-    """Iterate over HTML responses in WARC file. Yields HTML, URL, metadata, and filename."""
+def _html_response(record, warc_filename: str):
+    """Return (url, html, metadata) for an HTML response record, or None for any other record."""
+    if record.rec_type != "response":
+        return None
+
+    http_headers = record.http_headers
+    if not http_headers:
+        return None
+
+    content_type = http_headers.get_header("content-type")
+    if not content_type or "text/html" not in content_type:
+        return None
+
+    payload = record.content_stream().read()
+    html = payload.decode("utf-8", errors="ignore")
+
+    url = record.rec_headers.get_header("WARC-Target-URI")
+
+    # Extract WARC metadata for provenance
+    metadata = {
+        "warc_filename": warc_filename,
+        "warc_date": record.rec_headers.get_header("WARC-Date"),
+        "warc_record_id": record.rec_headers.get_header("WARC-Record-ID"),
+        "warc_ip_address": record.rec_headers.get_header("WARC-IP-Address"),
+        "warc_payload_digest": record.rec_headers.get_header("WARC-Payload-Digest"),
+        "warc_block_digest": record.rec_headers.get_header("WARC-Block-Digest"),
+        "content_length": record.rec_headers.get_header("Content-Length"),
+        "http_date": http_headers.get_header("date") if http_headers else None,
+        "http_server": http_headers.get_header("server") if http_headers else None,
+        "http_last_modified": http_headers.get_header("last-modified") if http_headers else None,
+    }
+
+    return url, html, metadata
+
+
+@contextmanager
+def _open_warc(warc_filepath: str):
+    """Open a WARC for reading; uncompressed files are memory-mapped to avoid read syscalls."""
+    with open(warc_filepath, "rb") as f:
+        if warc_filepath.endswith(".warc") and os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield mm
+        else:
+            yield f
+
+
+def _iter_html_responses_from(stream, warc_filename: str, end: int = None):
+    """
+    Yield HTML responses from an open WARC stream, stopping at the first record at or after `end`.
+
+    The time to read up to each response, including the records skipped on
+    the way, is recorded as the warc_read stage.
+    """
+    it = ArchiveIterator(stream)
+    start = time.perf_counter()
+    for record in it:
+        # The start offset of the record just parsed; get_record_offset() would
+        # read the record to its end first, so the payload of the first record
+        # past `end` would be read for nothing
+        offset = it.offset
+        if end is not None and offset >= end:
+            break
+        response = _html_response(record, warc_filename)
+        metrics.inc("warc_records")
+        if response is None:
+            continue
+        response[2]["warc_offset"] = offset
+        response[2]["warc_length"] = it.get_record_length()
+        metrics.inc("warc_html_responses")
+        metrics.observe("warc_read", time.perf_counter() - start)
+        yield response
+        start = time.perf_counter()
+
+
+def iter_html_responses(warc_filepaths: str, start_offsets=None):
+    """
+    Iterate over HTML responses in WARC file. Yields HTML, URL, metadata, and filename.
+
+    `start_offsets` optionally maps a file path to the record offset to start
+    reading that file at (e.g. when resuming).
+    """
     for warc_filepath in warc_filepaths:
-        warc_filename = os.path.basename(warc_filepath)
-        for record in iter_warc_records([warc_filepath]):
-            if record.rec_type != "response":
-                continue
-
-            http_headers = record.http_headers
-            if not http_headers:
-                continue
-
-        
-            content_type = http_headers.get_header("content-type")
-            if not content_type or "text/html" not in content_type:
-                continue
-
-            payload = record.content_stream().read()
-            html = payload.decode("utf-8", errors="ignore")
-            
-            url = record.rec_headers.get_header("WARC-Target-URI")
-            
-            # Extract WARC metadata for provenance
-            metadata = {
-                "warc_filename": warc_filename,
-                "warc_date": record.rec_headers.get_header("WARC-Date"),
-                "warc_record_id": record.rec_headers.get_header("WARC-Record-ID"),
-                "warc_ip_address": record.rec_headers.get_header("WARC-IP-Address"),
-                "warc_payload_digest": record.rec_headers.get_header("WARC-Payload-Digest"),
-                "warc_block_digest": record.rec_headers.get_header("WARC-Block-Digest"),
-                "content_length": record.rec_headers.get_header("Content-Length"),
-                "http_date": http_headers.get_header("date") if http_headers else None,
-                "http_server": http_headers.get_header("server") if http_headers else None,
-                "http_last_modified": http_headers.get_header("last-modified") if http_headers else None,
-            }
-
-            yield url, html, metadata
+        yield from iter_html_responses_range(warc_filepath, (start_offsets or {}).get(warc_filepath, 0))
+
+
+def iter_html_responses_range(warc_filepath: str, start: int = 0, end: int = None):
+    """
+    Iterate over the HTML responses of the records starting in [start, end) of one WARC.
+
+    `start` must be a record boundary (for .warc.gz, a gzip member boundary),
+    such as an offset from the CDXJ index.
+    """
+    warc_filename = os.path.basename(warc_filepath)
+    with _open_warc(warc_filepath) as stream:
+        stream.seek(start)
+        yield from _iter_html_responses_from(stream, warc_filename, end)
 
 
+def read_html_response_at(warc_filepath: str, offset: int):
+    """Fetch the single record at `offset` by seeking. Returns (url, html, metadata) or None if not HTML."""
+    warc_filename = os.path.basename(warc_filepath)
+    with _open_warc(warc_filepath) as stream:
+        stream.seek(offset)
+        for response in _iter_html_responses_from(stream, warc_filename, end=offset + 1):
+            return response
+    return None
+
+
+def get_urls_from_index(warc_filepaths: str):
+    """List HTML response URLs from the CDXJ index of each WARC, building missing indexes first."""
+    urls = []
+    for warc_filepath in warc_filepaths:
+        for entry in load_index(warc_filepath):
+            if is_html(entry) and entry.get("url"):
+                urls.append(entry["url"])
+    return urls
+
+
+def split_offset_ranges(warc_filepath: str, segment_bytes: int = SEGMENT_BYTES, start: int = 0):
+    """
+    Split a WARC into (start, end) byte ranges of roughly `segment_bytes`,
+    cut at indexed record boundaries, that together cover the file from the
+    record at `start` to the end.
+    """
+    size = os.path.getsize(warc_filepath)
+    if start >= size:
+        return []
+    ranges = []
+    for entry in iter_index(warc_filepath):
+        if entry["offset"] <= start:
+            continue
+        if entry["offset"] - start >= segment_bytes:
+            ranges.append((start, entry["offset"]))
+            start = entry["offset"]
+    ranges.append((start, size))
+    return ranges
+
+
+def _html_response_worker(task_queue, result_queue):
+    """
+    Worker process: parse each (file, start, end) range taken from task_queue
+    and stream its HTML responses back, followed by the metrics of the range.
+    """
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        warc_filepath, start, end = task
+        try:
+            for response in iter_html_responses_range(warc_filepath, start, end):
+                result_queue.put(response)
+        except Exception as e:
+            result_queue.put((_WORKER_ERROR, warc_filepath, repr(e)))
+        result_queue.put((_WORKER_METRICS, metrics.REGISTRY.drain()))
+    result_queue.put(_WORKER_DONE)
+
+
+def iter_html_responses_parallel(warc_filepaths, workers: int = None, queue_size: int = 64,
+                                 segment_bytes: int = SEGMENT_BYTES, start_offsets=None):
+    """
+    Like iter_html_responses, but WARC files are inflated and parsed in
+    worker processes. Responses are streamed back through a bounded queue so
+    memory stays flat however large the archives are.
+
+    Files with an up to date CDXJ index are split into ranges of about
+    `segment_bytes` so a single large archive is also read in parallel.
+    Responses from one range keep their order; ranges are interleaved, so
+    the overall order is not WARC order. `start_offsets` is as for
+    iter_html_responses.
+
+    Workers are started with the spawn method: callers typically have
+    threads running (LLM dispatcher, uploader), and forking a threaded
+    process can copy locks held by those threads into the child.
+    """
+    tasks = []
+    for warc_filepath in warc_filepaths:
+        first = (start_offsets or {}).get(warc_filepath, 0)
+        if has_fresh_index(warc_filepath):
+            tasks.extend((warc_filepath, start, end)
+                         for start, end in split_offset_ranges(warc_filepath, segment_bytes, first))
+        else:
+            tasks.append((warc_filepath, first, None))
+
+    if not tasks:
+        return
+    workers = min(workers or multiprocessing.cpu_count(), len(tasks))
+    if workers <= 1:
+        for warc_filepath, start, end in tasks:
+            yield from iter_html_responses_range(warc_filepath, start, end)
+        return
+
+    ctx = multiprocessing.get_context('spawn')
+    task_queue = ctx.Queue()
+    result_queue = ctx.Queue(maxsize=queue_size)
+    for task in tasks:
+        task_queue.put(task)
+    for _ in range(workers):
+        task_queue.put(None)
+
+    processes = [
+        ctx.Process(target=_html_response_worker, args=(task_queue, result_queue), daemon=True)
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        running = workers
+        while running:
+            item = result_queue.get()
+            if item == _WORKER_DONE:
+                running -= 1
+            elif item[0] == _WORKER_ERROR:
+                raise RuntimeError(f"Failed to read {item[1]}: {item[2]}")
+            elif item[0] == _WORKER_METRICS:
+                metrics.REGISTRY.merge(item[1])
+            else:
+                yield item
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
 
 if __name__ == "__main__":
     warcs = get_warc_file_paths()
     print(warcs)
     urls = get_urls(warc_filepaths=warcs)
     print(len(urls))
-    count = 0
-    for warc in warcs:
-        with open(warc, "rb") as stream:
-            for record in ArchiveIterator(stream):
-                count += 1
-
+    # Every record of every kind, as before: the index only lists response records
+    count = sum(1 for _ in iter_warc_records(warcs))
     print(count)
@@ -0,0 +1,177 @@
+"""
+Progress Journal
+
+Append-only JSONL journal of how far each WARC record got through the
+pipeline, keyed by its WARC-Record-ID. Each line is one event
+
+    {"id": "<urn:uuid:...>", "stage": "llm", "url": "...", "accepted": true}
+
+and the latest stage of a record wins when the journal is loaded. A restarted
+run skips records that are complete, resumes the others from their last stage
+(the LLM response itself comes from the response cache), and uses the CDXJ
+index to start reading each WARC after its leading run of complete records.
+"""
+
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from CrawlToW3C.warc_index import has_fresh_index, iter_index, is_html
+
+# Stages, in pipeline order
+ACCEPTED = "accepted"  # passed the URL filter
+LLM_DONE = "llm"  # response received (and cached)
+ENTITIES_WRITTEN = "entities"
+UPLOADED = "uploaded"
+SKIPPED = "skipped"  # rejected, near-duplicate or no annotations: nothing left to do
+
+_STAGE_ORDER = {ACCEPTED: 1, LLM_DONE: 2, ENTITIES_WRITTEN: 3, UPLOADED: 4, SKIPPED: 4}
+
+
+class ProgressJournal:
+    """Durable per-record progress, shared by the main loop and the upload threads."""
+
+    def __init__(self, path: str, resume: bool = True, fsync_every: int = 64):
+        """
+        Open the journal, loading the progress of an earlier run.
+
+        Args:
+            path: Journal file
+            resume: Keep earlier progress; False starts a fresh journal
+            fsync_every: Events between fsyncs (every event is flushed to the OS)
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.fsync_every = fsync_every
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        self.unsynced = 0
+        if resume and os.path.exists(path):
+            self._load()
+        self.file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    def _load(self):
+        complete = 0  # bytes up to the end of the last complete line
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn last line from a crash
+                complete += len(line)
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                record = self.records.setdefault(event["id"], {})
+                stage = event.pop("stage")
+                if _STAGE_ORDER[stage] >= _STAGE_ORDER.get(record.get("stage"), 0):
+                    record["stage"] = stage
+                record.update((k, v) for k, v in event.items() if k != "id")
+        if complete < os.path.getsize(self.path):
+            # Drop the torn line, or the next event would be appended to it and lost too
+            with open(self.path, "r+b") as f:
+                f.truncate(complete)
+
+    def stage(self, record_id: Optional[str]) -> Optional[str]:
+        """Latest stage reached by a record, or None if it was never journaled."""
+        record = self.records.get(record_id)
+        return record["stage"] if record else None
+
+    def get(self, record_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        return self.records.get(record_id)
+
+    def reached(self, record_id: Optional[str], stage: str) -> bool:
+        """True if the record got to `stage` (or further) in this or an earlier run."""
+        return _STAGE_ORDER.get(self.stage(record_id), 0) >= _STAGE_ORDER[stage]
+
+    def is_complete(self, record_id: Optional[str], uploads: bool = True) -> bool:
+        """
+        True if nothing is left to do for a record.
+
+        Args:
+            record_id: WARC-Record-ID
+            uploads: Whether this run uploads; without uploads a record is
+                complete once its entities are written
+        """
+        stage = self.stage(record_id)
+        if stage in (UPLOADED, SKIPPED):
+            return True
+        return not uploads and stage == ENTITIES_WRITTEN
+
+    def mark(self, record_id: Optional[str], stage: str, **fields):
+        """Append a progress event. Records without a WARC-Record-ID cannot be resumed and are ignored."""
+        if not record_id:
+            return
+        event = {"id": record_id, "stage": stage, **fields}
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self.lock:
+            record = self.records.setdefault(record_id, {})
+            if _STAGE_ORDER[stage] >= _STAGE_ORDER.get(record.get("stage"), 0):
+                record["stage"] = stage
+            record.update(fields)
+            self.file.write(line)
+            self.file.flush()
+            self.unsynced += 1
+            if self.unsynced >= self.fsync_every:
+                os.fsync(self.file.fileno())
+                self.unsynced = 0
+
+    def mark_after(self, record_id: Optional[str], stage: str, parts: int, **fields) -> Callable[..., None]:
+        """
+        Mark `stage` once work finishing in several parts, possibly on other
+        threads, is done.
+
+        Returns:
+            A callback to call once per finished part, with ok=False for a
+            part that failed (the stage is then never marked). With no parts
+            the stage is marked straight away.
+        """
+        state = {"remaining": parts, "failed": False}
+        state_lock = threading.Lock()
+
+        def part_done(ok: bool = True):
+            with state_lock:
+                state["failed"] = state["failed"] or not ok
+                state["remaining"] -= 1
+                done = state["remaining"] == 0 and not state["failed"]
+            if done:
+                self.mark(record_id, stage, **fields)
+
+        if parts == 0:
+            self.mark(record_id, stage, **fields)
+        return part_done
+
+    def resume_point(self, warc_filepath: str, uploads: bool = True) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Find where reading a WARC can start on resume.
+
+        Uses the CDXJ index to skip the leading run of complete HTML records
+        without inflating them. Without an up to date index the whole file is
+        read.
+
+        Returns:
+            (offset to start reading at, index entries of the skipped HTML records)
+        """
+        if not has_fresh_index(warc_filepath):
+            return 0, []
+        skipped = []
+        for entry in iter_index(warc_filepath):
+            if not is_html(entry):
+                continue
+            if not self.is_complete(entry.get("record_id"), uploads):
+                return entry["offset"], skipped
+            skipped.append(entry)
+        return os.path.getsize(warc_filepath), skipped
+
+    def flush(self):
+        """Flush and fsync every event written so far."""
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
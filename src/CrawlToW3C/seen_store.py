@@ -0,0 +1,241 @@
+"""
+Seen-URL Stores
+
+Backends for the URL deduplication in url_filter:
+
+- MemorySeenStore: exact, an in-process set (the default)
+- BloomSeenStore: in-process Bloom filter with a fixed memory footprint and a
+  configurable false-positive rate (a false positive drops a new URL)
+- SQLiteSeenStore: on disk, persists across runs and is safe to share between
+  processes
+
+Every store counts lookups and hits and reports its memory footprint.
+"""
+
+import hashlib
+import math
+import os
+import sqlite3
+import sys
+import threading
+from typing import Any, Dict
+
+
+class SeenStore:
+    """Common interface and counters; subclasses implement _check_and_add, add, __contains__ and clear."""
+
+    def __init__(self):
+        self.lookups = 0
+        self.hits = 0
+
+    def check_and_add(self, url: str) -> bool:
+        """Record `url` as seen. Returns True if it had been seen before."""
+        self.lookups += 1
+        seen = self._check_and_add(url)
+        if seen:
+            self.hits += 1
+        return seen
+
+    def _check_and_add(self, url: str) -> bool:
+        raise NotImplementedError
+
+    def add(self, url: str):
+        raise NotImplementedError
+
+    def __contains__(self, url: str) -> bool:
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def memory_bytes(self) -> int:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "store": type(self).__name__,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "memory_bytes": self.memory_bytes(),
+        }
+
+
+class MemorySeenStore(SeenStore):
+    """Exact set of URLs in process memory; grows with the number of URLs."""
+
+    def __init__(self):
+        super().__init__()
+        self.urls = set()
+        self.url_bytes = 0
+
+    def _check_and_add(self, url: str) -> bool:
+        if url in self.urls:
+            return True
+        self.add(url)
+        return False
+
+    def add(self, url: str):
+        if url not in self.urls:
+            self.urls.add(url)
+            self.url_bytes += sys.getsizeof(url)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self.urls
+
+    def __len__(self):
+        return len(self.urls)
+
+    def clear(self):
+        self.urls.clear()
+        self.url_bytes = 0
+
+    def memory_bytes(self) -> int:
+        return sys.getsizeof(self.urls) + self.url_bytes
+
+
+class BloomSeenStore(SeenStore):
+    """
+    Bloom filter sized for `capacity` URLs at `error_rate` false positives.
+
+    Memory is fixed up front (about 14.4 bits, or 1.8 bytes, per URL at
+    0.1%). Past `capacity` the false-positive rate climbs, so size it for
+    the crawl.
+    """
+
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.001):
+        """
+        Allocate the filter.
+
+        Args:
+            capacity: Expected number of distinct URLs
+            error_rate: Target false-positive rate at capacity
+        """
+        super().__init__()
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def _positions(self, url: str):
+        # Double hashing (Kirsch-Mitzenmacher): k positions from one 128-bit digest
+        digest = hashlib.blake2b(url.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def _check_and_add(self, url: str) -> bool:
+        with self.lock:
+            seen = True
+            for position in self._positions(url):
+                byte, mask = position >> 3, 1 << (position & 7)
+                if not self.bits[byte] & mask:
+                    seen = False
+                    self.bits[byte] |= mask
+            if not seen:
+                self.count += 1
+            return seen
+
+    def add(self, url: str):
+        self._check_and_add(url)
+
+    def __contains__(self, url: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(url))
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        with self.lock:
+            self.bits = bytearray(len(self.bits))
+            self.count = 0
+
+    def memory_bytes(self) -> int:
+        return len(self.bits)
+
+
+class SQLiteSeenStore(SeenStore):
+    """
+    URLs in a SQLite table. Persists across runs, and several processes can
+    share one file: the insert-if-absent is a single atomic statement.
+    """
+
+    def __init__(self, path: str, timeout: float = 30.0):
+        """
+        Open (or create) the store.
+
+        Args:
+            path: SQLite database file
+            timeout: Seconds to wait for another process's write lock
+        """
+        super().__init__()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS seen (url TEXT PRIMARY KEY) WITHOUT ROWID")
+
+    def _check_and_add(self, url: str) -> bool:
+        with self.lock:
+            cursor = self.conn.execute("INSERT OR IGNORE INTO seen (url) VALUES (?)", (url,))
+            return cursor.rowcount == 0
+
+    def add(self, url: str):
+        with self.lock:
+            self.conn.execute("INSERT OR IGNORE INTO seen (url) VALUES (?)", (url,))
+
+    def __contains__(self, url: str) -> bool:
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM seen WHERE url = ?", (url,)).fetchone() is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM seen")
+
+    def memory_bytes(self) -> int:
+        # Page cache in use by this connection; the table itself lives on disk
+        with self.lock:
+            page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+            cache_pages = self.conn.execute("PRAGMA cache_size").fetchone()[0]
+            page_count = self.conn.execute("PRAGMA page_count").fetchone()[0]
+        # A negative cache_size is a limit in KiB rather than pages
+        cache_bytes = -cache_pages * 1024 if cache_pages < 0 else cache_pages * page_size
+        return min(cache_bytes, page_count * page_size)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def make_seen_store(kind: str = "memory", path: str = None, capacity: int = 1_000_000,
+                    error_rate: float = 0.001) -> SeenStore:
+    """
+    Create a seen-URL store.
+
+    Args:
+        kind: 'memory', 'bloom' or 'sqlite'
+        path: Database file for 'sqlite'
+        capacity: Expected distinct URLs for 'bloom'
+        error_rate: False-positive rate for 'bloom'
+    """
+    if kind == "memory":
+        return MemorySeenStore()
+    if kind == "bloom":
+        return BloomSeenStore(capacity=capacity, error_rate=error_rate)
+    if kind == "sqlite":
+        if not path:
+            raise ValueError("The sqlite seen store needs a path")
+        return SQLiteSeenStore(path)
+    raise ValueError(f"Unknown seen store: {kind}")
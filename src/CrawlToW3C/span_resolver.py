@@ -0,0 +1,263 @@
+"""
+Span Resolution
+
+With the compact response format the LLM returns only the text spans it
+selected, {"spans": ["...", ...], "entities": [...]}, instead of complete
+W3C annotations; the ids, XPath selectors and annotation boilerplate made up
+most of the completion tokens, and the model could not compute the SHA-256
+ids or see the DOM the XPaths refer to anyway.
+
+This module finds each span in the page's original HTML, takes the deepest
+element whose text contains it, and expands the span into a full annotation
+with that element's XPath and the id sha256(page_url + text + xpath), the
+same scheme the full-format prompt asks for (so the ids still map onto Miiify
+slugs via extract_slug_from_annotation_id). Spans that cannot be found, e.g.
+because the model paraphrased them, keep their text under a
+TextQuoteSelector and are hashed with an empty XPath.
+"""
+
+import hashlib
+import json
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+from bs4 import BeautifulSoup, Tag
+
+from CrawlToW3C.html_preprocess import DEFAULT_ENGINE, NON_TEXT_CONTAINERS
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:  # lxml is optional, the bs4 engine is always available
+    lxml = None
+
+ANNOTATION_CONTEXT = "http://www.w3.org/ns/anno.jsonld"
+CREATOR = "urn:openai:gpt-5"
+LANGUAGE = "en"
+
+# Their text is not page text, so spans are never looked for in them. This
+# includes what process_html leaves out as non-text (e.g. ruby annotations),
+# which would otherwise split a span copied from its output in the DOM.
+NON_TEXT_TAGS = tuple(sorted(NON_TEXT_CONTAINERS | {'script', 'style', 'noscript'}))
+
+# Block markup of process_html output around a span copied with it (a chunk
+# boundary can leave only the opening or the closing tag)
+BLOCK_MARKUP = re.compile(r"^(?:<(?:title|h[1-6]|p|div)>)?(.*?)(?:</(?:title|h[1-6]|p|div)>)?$", re.S)
+
+
+def annotation_id(url: str, text: str, xpath: str) -> str:
+    """The id of an annotation: urn:sha256 of page URL + selected text + XPath."""
+    return "urn:sha256:" + hashlib.sha256((url + text + xpath).encode("utf-8")).hexdigest()
+
+
+def build_annotation(url: str, text: str, xpath: Optional[str]) -> Dict[str, Any]:
+    """
+    Expand a span into a full W3C annotation.
+
+    Args:
+        url: Page URL, the annotation target
+        text: Selected text, the annotation body
+        xpath: XPath of the element holding the text, or None if it was not found
+
+    Returns:
+        The annotation, with an XPathSelector or, without an XPath, a TextQuoteSelector
+    """
+    if xpath is not None:
+        selector = {"type": "XPathSelector", "value": xpath}
+    else:
+        selector = {"type": "TextQuoteSelector", "exact": text}
+    return {
+        "@context": ANNOTATION_CONTEXT,
+        "id": annotation_id(url, text, xpath or ""),
+        "type": "Annotation",
+        "motivation": "commenting",
+        "creator": CREATOR,
+        "body": {
+            "type": "TextualBody",
+            "value": text,
+            "format": "text/plain",
+            "language": LANGUAGE
+        },
+        "target": {
+            "source": url,
+            "selector": selector
+        }
+    }
+
+
+def _text_key(text: str) -> str:
+    # Whitespace is dropped entirely: the DOM joins adjacent blocks without a
+    # separator where the preprocessed text the model saw had a line break
+    return "".join(text.split())
+
+
+def _bs4_xpath(element: Tag) -> str:
+    """Absolute XPath of a bs4 element, positional only among same-named siblings (as lxml's getpath)."""
+    steps = []
+    while isinstance(element, Tag) and not isinstance(element, BeautifulSoup):
+        same = [s for s in element.parent.children if isinstance(s, Tag) and s.name == element.name]
+        step = element.name
+        if len(same) > 1:
+            step += f"[{same.index(element) + 1}]"
+        steps.append(step)
+        element = element.parent
+    return "/" + "/".join(reversed(steps))
+
+
+class SpanResolver:
+    """Locates text spans in one page's DOM and expands them into annotations."""
+
+    def __init__(self, url: str, html_content, engine: Optional[str] = None):
+        """
+        Args:
+            url: Page URL
+            html_content: The page's original HTML, or a function returning it;
+                the page is only parsed once a span needs locating
+            engine: "lxml" or "bs4"; defaults to lxml when it is installed
+        """
+        if engine is None:
+            engine = DEFAULT_ENGINE
+        if engine not in ("lxml", "bs4"):
+            raise ValueError(f"Unknown span resolution engine: {engine}")
+        self.url = url
+        self.html_content = html_content
+        self.engine = engine
+        self.root = None
+        self.parsed = False
+        self.lock = threading.Lock()
+        self.xpaths: Dict[str, Optional[str]] = {}
+        self.located = 0
+        self.unresolved = 0
+
+    def _parse(self):
+        html_content = self.html_content() if callable(self.html_content) else self.html_content
+        html_content = html_content or ""
+        if self.engine == "lxml":
+            try:
+                self.root = lxml.html.document_fromstring(html_content)
+            except ValueError:
+                # Unicode strings with an XML encoding declaration must be passed as bytes
+                self.root = lxml.html.document_fromstring(html_content.encode('utf-8'))
+            except etree.ParserError:
+                self.root = None  # empty document
+            if self.root is not None:
+                etree.strip_elements(self.root, *NON_TEXT_TAGS, with_tail=False)
+        else:
+            self.root = BeautifulSoup(html_content, 'html.parser')
+            for element in self.root.find_all(NON_TEXT_TAGS):
+                element.decompose()
+        self.html_content = None
+        self.parsed = True
+
+    def _children(self, element) -> List[Any]:
+        if self.engine == "lxml":
+            return [child for child in element if isinstance(child.tag, str)]
+        return [child for child in element.children if isinstance(child, Tag)]
+
+    def _text(self, element) -> str:
+        return element.text_content() if self.engine == "lxml" else element.get_text()
+
+    def _xpath(self, element) -> str:
+        return element.getroottree().getpath(element) if self.engine == "lxml" else _bs4_xpath(element)
+
+    def _find(self, key: str) -> Optional[str]:
+        if not self.parsed:
+            self._parse()
+        if self.root is None or key not in _text_key(self._text(self.root)):
+            return None
+        element = self.root
+        while True:
+            for child in self._children(element):
+                if key in _text_key(self._text(child)):
+                    element = child
+                    break
+            else:
+                break
+        if isinstance(element, BeautifulSoup):
+            # Text directly in a bs4 document without an html element
+            return None
+        return self._xpath(element)
+
+    def locate(self, text: str) -> Optional[str]:
+        """
+        XPath of the deepest element whose text contains `text`, the first
+        such element in document order when the text occurs more than once.
+        None when the page does not contain the text.
+        """
+        key = _text_key(text)
+        if not key:
+            return None
+        with self.lock:
+            if key not in self.xpaths:
+                self.xpaths[key] = self._find(key)
+            return self.xpaths[key]
+
+    def annotation(self, span: Any) -> Optional[Dict[str, Any]]:
+        """The annotation for one span of a compact response, or None for an empty or malformed span."""
+        if not isinstance(span, str) or not span.strip():
+            return None
+        text = BLOCK_MARKUP.match(span.strip()).group(1).strip()
+        if not text:
+            return None
+        return build_annotation(self.url, text, self.locate(text))
+
+    def expand(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Expand a parsed compact response into the full
+        {"annotationPage": ..., "entities": ...} format, counting its
+        located and unresolved spans.
+        """
+        items = []
+        seen = set()
+        spans = response.get("spans")
+        for span in spans if isinstance(spans, list) else []:
+            annotation = self.annotation(span)
+            if annotation is None or annotation["id"] in seen:
+                continue
+            seen.add(annotation["id"])
+            items.append(annotation)
+            if annotation["target"]["selector"]["type"] == "XPathSelector":
+                self.located += 1
+            else:
+                self.unresolved += 1
+        return {
+            "annotationPage": {
+                "@context": ANNOTATION_CONTEXT,
+                "type": "AnnotationPage",
+                "items": items
+            },
+            "entities": response.get("entities", [])
+        }
+
+
+def is_compact_response(response: Any) -> bool:
+    return isinstance(response, dict) and "spans" in response and "annotationPage" not in response
+
+
+def expand_response(content: str, resolver: SpanResolver, stats: Optional[Dict[str, int]] = None) -> str:
+    """
+    Expand a compact LLM response into the full format.
+
+    Args:
+        content: Response JSON text
+        resolver: SpanResolver for the response's page
+        stats: Optional dict; the "spans" expanded and how many were "located" are added to it
+
+    Returns:
+        The expanded response as JSON text; full-format and unparseable
+        responses are returned unchanged, without parsing the page
+    """
+    try:
+        response = json.loads(content)
+    except ValueError:
+        return content
+    if not is_compact_response(response):
+        return content
+    located, unresolved = resolver.located, resolver.unresolved
+    expanded = resolver.expand(response)
+    if stats is not None:
+        located = resolver.located - located
+        stats["spans"] = stats.get("spans", 0) + located + resolver.unresolved - unresolved
+        stats["located"] = stats.get("located", 0) + located
+    return json.dumps(expanded, ensure_ascii=False)
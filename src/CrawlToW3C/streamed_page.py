@@ -0,0 +1,148 @@
+"""
+Streamed Page
+
+Hands the annotations and entities of one page on to the uploader and the
+entity sink while the LLM response is still streaming in, and keeps track of
+what was handed on so the page's full response only adds what is left. Each
+upload and entity write is one part of the page's work; the callback from
+ProgressJournal.mark_after is attached once the response is complete, and
+parts that finished before that are replayed into it.
+
+A response that fails after some entities were written leaves the page to be
+annotated again; the keys of those entities are journaled once they are
+flushed, and the retry is given them so it does not write them twice.
+"""
+
+import json
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+def _entity_key(entity: Dict[str, Any]) -> str:
+    return json.dumps(entity, sort_keys=True, ensure_ascii=False)
+
+
+def remaining_entities(entities: List[Any], written_keys: Iterable[str]) -> List[Any]:
+    """The entities whose keys are not among `written_keys` (from StreamedPage.when_entities_flushed)."""
+    written_keys = set(written_keys)
+    return [e for e in entities if not (isinstance(e, dict) and _entity_key(e) in written_keys)]
+
+
+def _annotation_key(annotation: Dict[str, Any]) -> str:
+    return annotation.get("id") or json.dumps(annotation, sort_keys=True, ensure_ascii=False)
+
+
+class StreamedPage:
+    """Early uploads and entity writes for one page."""
+
+    def __init__(self, url: str, warc_metadata: Dict[str, Any], uploader=None, entity_sink=None,
+                 written_entities: Iterable[str] = ()):
+        """
+        Args:
+            url: Page URL
+            warc_metadata: WARC metadata of the page, written with its entities
+            uploader: AnnotationUploader, or None to leave annotations to the full response
+            entity_sink: EntitySink, or None to leave entities to the full response
+            written_entities: Keys of the entities an earlier, failed response
+                for the page already wrote
+        """
+        self.url = url
+        self.warc_metadata = warc_metadata
+        self.uploader = uploader
+        self.entity_sink = entity_sink
+        self.annotation_keys = set()
+        self.entity_keys = set()
+        self.written_entity_keys = set(written_entities)
+        self.parts = 0
+        self.unflushed_entities = 0
+        self.on_entities_flushed: Optional[Callable[[List[str]], None]] = None
+        self.lock = threading.Lock()
+        self.finish: Optional[Callable[..., None]] = None
+        self.finished_early: List[bool] = []
+
+    def _part_done(self, ok: bool = True):
+        with self.lock:
+            finish = self.finish
+            if finish is None:
+                self.finished_early.append(ok)
+        if finish is not None:
+            finish(ok=ok)
+
+    def _upload_done(self, errors: int):
+        self._part_done(ok=not errors)
+
+    def _entity_flushed(self):
+        with self.lock:
+            self.unflushed_entities -= 1
+            callback = self.on_entities_flushed if self.unflushed_entities == 0 else None
+            if callback is not None:
+                self.on_entities_flushed = None
+        if callback is not None:
+            callback(self._written_keys())
+        self._part_done()
+
+    def _written_keys(self) -> List[str]:
+        return sorted(self.entity_keys | self.written_entity_keys)
+
+    def on_annotation(self, annotation: Any):
+        """Upload one annotation of the streaming annotationPage."""
+        if self.uploader is None or not isinstance(annotation, dict) or "id" not in annotation:
+            return
+        key = _annotation_key(annotation)
+        with self.lock:
+            if key in self.annotation_keys:
+                return
+            self.annotation_keys.add(key)
+            self.parts += 1
+        self.uploader.submit([annotation], on_complete=self._upload_done)
+
+    def on_entity(self, entity: Any):
+        """Write one entity of the streaming entity list."""
+        if self.entity_sink is None or not isinstance(entity, dict):
+            return
+        key = _entity_key(entity)
+        with self.lock:
+            if key in self.entity_keys or key in self.written_entity_keys:
+                return
+            self.entity_keys.add(key)
+            self.parts += 1
+            self.unflushed_entities += 1
+        self.entity_sink.write(entities=[entity], url=self.url, warc_metadata=self.warc_metadata,
+                               on_flushed=self._entity_flushed)
+
+    @property
+    def annotations(self) -> int:
+        return len(self.annotation_keys)
+
+    @property
+    def entities(self) -> int:
+        return len(self.entity_keys)
+
+    def remaining_annotations(self, annotations: List[Any]) -> List[Any]:
+        """The annotations of the full response that were not uploaded while streaming."""
+        return [a for a in annotations if not (isinstance(a, dict) and "id" in a
+                                               and _annotation_key(a) in self.annotation_keys)]
+
+    def remaining_entities(self, entities: List[Any]) -> List[Any]:
+        """The entities of the full response that were not written while streaming, now or by an earlier response."""
+        return remaining_entities(entities, self.entity_keys | self.written_entity_keys)
+
+    def when_entities_flushed(self, callback: Callable[[List[str]], None]):
+        """
+        Call `callback` with the keys of every entity written for the page,
+        including by earlier responses, once those written while this
+        response streamed are flushed.
+        """
+        with self.lock:
+            if self.unflushed_entities:
+                self.on_entities_flushed = callback
+                return
+        callback(self._written_keys())
+
+    def attach(self, finish: Callable[..., None]):
+        """Send this page's parts, including those already finished, to `finish`."""
+        with self.lock:
+            self.finish = finish
+            finished, self.finished_early = self.finished_early, []
+        for ok in finished:
+            finish(ok=ok)
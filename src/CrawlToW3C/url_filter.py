@@ -1,22 +1,37 @@
 from urllib.parse import urlparse, parse_qs, urlunparse
 
-# URL shortener domains to skip
-SHORTENERS = {"bit.ly", "t.co", "goo.gl", "lnkd.in", "tinyurl.com"}
+from CrawlToW3C.seen_store import MemorySeenStore, SeenStore
+from CrawlToW3C.url_rules import CompiledRules, compile_rules, load_rules
 
-# HTML page extensions (crawler blocks other file types via blockRules)
-PAGE_EXTS = {"", ".html", ".htm", ".php", ".asp", ".aspx", ".jsp"}
+# URL rules (host deny-list, path patterns, query keys, per-site rules); replace with configure_url_rules
+rules: CompiledRules = compile_rules()
 
-# Track seen URLs for deduplication
-seen = set()
+# Track seen URLs for deduplication (swap in a Bloom or SQLite store with set_seen_store)
+seen: SeenStore = MemorySeenStore()
 
-def clear_seen_urls():
-    """Clear the seen URLs set. Call this at the start of each pipeline run."""
+def set_seen_store(store: SeenStore):
+    """Use `store` for URL deduplication from now on."""
     global seen
+    seen = store
+
+def configure_url_rules(config_path: str = "crawl-config.yaml"):
+    """Load the archiveFilter rules from the crawl config (defaults when it has none)."""
+    global rules
+    rules = load_rules(config_path)
+
+def clear_seen_urls():
+    """Clear the seen URLs. Call this at the start of each pipeline run that should not dedupe against earlier ones."""
     seen.clear()
 
-def normalise(url: str):
-    u = urlparse(url)
+def mark_seen(url: str):
+    """Record a URL accepted by an earlier run so a resumed run deduplicates against it."""
+    seen.add(normalise(url))
+
+def seen_store_stats():
+    """Lookups, hits and memory footprint of the seen-URL store."""
+    return seen.stats()
 
+def _normalise_parsed(u, q):
     scheme = u.scheme.lower()
     netloc = u.netloc.lower()
     if netloc.startswith("www."):
@@ -28,48 +43,41 @@ def normalise(url: str):
     elif path != "/" and path.endswith("/"):
         path = path[:-1]
 
-    q = parse_qs(u.query)
     q = {k: v for k, v in q.items() if not k.startswith("utm_")}
     query = "&".join(f"{k}={v[0]}" for k, v in sorted(q.items()) if v)
 
     return urlunparse((scheme, netloc, path, "", query, ""))
 
 
+def normalise(url: str):
+    u = urlparse(url)
+    return _normalise_parsed(u, parse_qs(u.query))
+
+
 def should_archive(url: str):
     """
     Heuristic filter for URLs. 
     Note: The crawler's blockRules already filter out media files (images, videos, PDFs, etc.)
     so this only needs to handle URL patterns and deduplication.
     """
+    # Parse once; the rules and the dedupe key share the result
     u = urlparse(url)
 
     # Only HTTP/HTTPS
     if u.scheme not in {"http", "https"}:
         return False 
 
-    # Skip URL shorteners
-    if u.netloc in SHORTENERS:
-        return False
-
-    # Skip common non-content pages
-    if any(p in u.path.lower() for p in ["login", "signup", "admin", "cart", "checkout"]):
-        return False
-
-    # Skip search/query URLs
+    # Host, path, query and per-site rules
+    host = (u.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
     q = parse_qs(u.query)
-    if "q" in q or "s" in q:
+    if rules.reject_reason(host, u.path.lower(), q) is not None:
         return False
 
     # Deduplication check
-    c_url = normalise(url)
-    if c_url in seen:
+    if seen.check_and_add(_normalise_parsed(u, q)):
         return False
-    seen.add(c_url)
 
     # Accept HTML pages (crawler blockRules already filtered out media/documents)
-    path_lower = u.path.lower()
-    for ext in PAGE_EXTS:
-        if path_lower.endswith(ext) or path_lower == "":
-            return True
-
     return True
@@ -0,0 +1,187 @@
+"""
+URL Rules
+
+The archive filter rules used by url_filter.should_archive, loaded from the
+`archiveFilter` section of crawl-config.yaml and compiled once:
+
+    archiveFilter:
+      denyHosts: [bit.ly, t.co, "*.doubleclick.net"]
+      denyPaths: [login, signup, "/tag/\\d+"]
+      denyQueryKeys: [q, s]
+      sites:
+        example.com:
+          allowPaths: ["^/collection/"]
+          denyPaths: ["/print$"]
+
+Host rules go into a trie of reversed domain labels ("*.example.com" also
+matches subdomains), and each list of path patterns is combined into a single
+regular expression, so checking a URL costs one trie walk and at most a few
+regex searches however many rules there are. Path patterns are regular
+expressions searched in the lowercased path.
+"""
+
+import re
+from typing import Any, Dict, List, Optional
+
+import yaml
+
+CONFIG_KEY = "archiveFilter"
+
+# The rules used when crawl-config.yaml has no archiveFilter section
+DEFAULT_RULES = {
+    # URL shortener domains to skip
+    "denyHosts": ["bit.ly", "t.co", "goo.gl", "lnkd.in", "tinyurl.com"],
+    # Common non-content pages
+    "denyPaths": ["login", "signup", "admin", "cart", "checkout"],
+    # Search/query URLs
+    "denyQueryKeys": ["q", "s"],
+    "sites": {},
+}
+
+_WILDCARD = "*"
+_MATCH = ""  # trie key marking the end of a host
+
+
+class HostTrie:
+    """Hosts stored by reversed labels; a lookup walks the labels of the URL host once."""
+
+    def __init__(self, hosts=()):
+        self.root: Dict[str, Any] = {}
+        for host in hosts:
+            self.add(host)
+
+    def add(self, host: str, value: Any = True):
+        labels = host.lower().strip(".").split(".")
+        wildcard = labels[0] == _WILDCARD
+        if wildcard:
+            labels = labels[1:]
+        node = self.root
+        for label in reversed(labels):
+            node = node.setdefault(label, {})
+        node[_MATCH] = value
+        if wildcard:
+            node[_WILDCARD] = value
+
+    def get(self, host: str) -> Optional[Any]:
+        """Value of the most specific rule matching `host`, or None."""
+        node = self.root
+        found = None
+        labels = host.split(".")
+        for i in range(len(labels) - 1, -1, -1):
+            node = node.get(labels[i])
+            if node is None:
+                return found
+            if i > 0 and _WILDCARD in node:
+                found = node[_WILDCARD]
+        return node.get(_MATCH, found)
+
+
+_META = set(".^$*+?{}[]\\|()")
+_QUANTIFIERS = set("*+?{")
+
+
+def _literal_prefix(pattern: str) -> int:
+    """Length of the plain-text prefix of a regex that can be factored out of an alternation."""
+    if "|" in pattern:
+        return 0
+    end = 0
+    while end < len(pattern) and pattern[end] not in _META:
+        end += 1
+    # A quantifier applies to the last literal character, which must stay with it
+    if end < len(pattern) and pattern[end] in _QUANTIFIERS:
+        end = max(0, end - 1)
+    return end
+
+
+def _trie_regex(node: Dict[str, Any]) -> str:
+    alternatives = [escaped + _trie_regex(child) for escaped, child in
+                    ((re.escape(char), child) for char, child in sorted(node.items()) if char != _MATCH)]
+    alternatives.extend(f"(?:{suffix})" if suffix else "" for suffix in node.get(_MATCH, ()))
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return "(?:" + "|".join(alternatives) + ")"
+
+
+def _combine(patterns: List[str]) -> Optional["re.Pattern"]:
+    """
+    Compile patterns into one regex matching where any of them matches.
+
+    Literal prefixes are merged into a character trie ('cart', 'career/\\d+'
+    become 'ca(?:rt|reer/\\d+)'), so a search rejects most positions on the
+    first character instead of trying every pattern in turn.
+    """
+    if not patterns:
+        return None
+    trie: Dict[str, Any] = {}
+    for pattern in patterns:
+        prefix = _literal_prefix(pattern)
+        node = trie
+        for char in pattern[:prefix]:
+            node = node.setdefault(char, {})
+        node.setdefault(_MATCH, []).append(pattern[prefix:])
+    return re.compile(_trie_regex(trie))
+
+
+class CompiledSiteRules:
+    def __init__(self, rules: Dict[str, Any]):
+        self.allow_paths = _combine(rules.get("allowPaths", []))
+        self.deny_paths = _combine(rules.get("denyPaths", []))
+
+
+class CompiledRules:
+    """Rules compiled for repeated checks; see reject_reason()."""
+
+    def __init__(self, rules: Dict[str, Any]):
+        self.deny_hosts = HostTrie(rules.get("denyHosts", []))
+        self.deny_paths = _combine(rules.get("denyPaths", []))
+        self.deny_query_keys = frozenset(rules.get("denyQueryKeys", []))
+        self.sites = HostTrie()
+        for site, site_rules in (rules.get("sites") or {}).items():
+            compiled = CompiledSiteRules(site_rules or {})
+            # A site rule covers the host and its subdomains
+            self.sites.add(f"*.{site}", compiled)
+
+    def reject_reason(self, host: str, path: str, query_keys) -> Optional[str]:
+        """
+        Check one parsed URL against the rules.
+
+        Args:
+            host: Lowercase host name without "www."
+            path: Lowercase path
+            query_keys: Query parameter names (with non-empty values)
+
+        Returns:
+            Which rule rejected the URL, or None if it is allowed
+        """
+        if self.deny_hosts.get(host):
+            return "host"
+        if self.deny_paths is not None and self.deny_paths.search(path):
+            return "path"
+        if self.deny_query_keys and not self.deny_query_keys.isdisjoint(query_keys):
+            return "query"
+        site = self.sites.get(host)
+        if site is not None:
+            if site.deny_paths is not None and site.deny_paths.search(path):
+                return "site"
+            if site.allow_paths is not None and not site.allow_paths.search(path):
+                return "site"
+        return None
+
+
+def compile_rules(rules: Optional[Dict[str, Any]] = None) -> CompiledRules:
+    """Compile a rules mapping (an archiveFilter section); missing keys take the defaults."""
+    return CompiledRules({**DEFAULT_RULES, **(rules or {})})
+
+
+def load_rules(config_path: str) -> CompiledRules:
+    """
+    Load and compile the archiveFilter section of a crawl config.
+
+    A missing file or section gives the default rules.
+    """
+    try:
+        with open(config_path, "r", encoding="utf-8") as f:
+            config = yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        config = {}
+    return compile_rules(config.get(CONFIG_KEY))
@@ -0,0 +1,117 @@
+"""
+WARC CDXJ Index
+
+Builds and reads a CDXJ index of the response records in a WARC file, stored
+beside the archive as `<archive>.cdxj`. Each line is
+
+    <urlkey> <timestamp> {"url": ..., "mime": ..., "digest": ..., "offset": ..., "length": ..., ...}
+
+so URLs can be listed, records fetched by seeking, and large archives split
+into ranges without inflating the whole file again.
+"""
+
+import json
+import os
+import re
+from typing import Any, Dict, Iterator, List
+from urllib.parse import urlsplit
+
+from warcio.archiveiterator import ArchiveIterator
+
+INDEX_SUFFIX = ".cdxj"
+
+
+def index_path(warc_filepath: str) -> str:
+    return warc_filepath + INDEX_SUFFIX
+
+
+def surt(url: str) -> str:
+    """Sort-friendly URL key: 'https://www.example.com/a?b' -> 'com,example)/a?b'."""
+    try:
+        u = urlsplit(url)
+    except ValueError:
+        return url
+    host = (u.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    key = ",".join(reversed(host.split("."))) + ")" + (u.path or "/").lower()
+    if u.query:
+        key += "?" + u.query
+    return key
+
+
+def _timestamp(warc_date: str) -> str:
+    # 2026-01-02T10:30:00Z -> 20260102103000
+    return re.sub(r"\D", "", warc_date or "")[:14]
+
+
+def build_index(warc_filepath: str) -> List[Dict[str, Any]]:
+    """
+    Scan a WARC file once and write its CDXJ index beside it.
+
+    Returns:
+        The index entries, in file order
+    """
+    entries = []
+    with open(warc_filepath, "rb") as f:
+        it = ArchiveIterator(f)
+        for record in it:
+            offset = it.get_record_offset()
+            if record.rec_type != "response":
+                continue
+            url = record.rec_headers.get_header("WARC-Target-URI")
+            http_headers = record.http_headers
+            entry = {
+                "url": url,
+                "mime": http_headers.get_header("content-type") if http_headers else None,
+                "status": http_headers.get_statuscode() if http_headers else None,
+                "digest": record.rec_headers.get_header("WARC-Payload-Digest"),
+                "record_id": record.rec_headers.get_header("WARC-Record-ID"),
+                "warc_date": record.rec_headers.get_header("WARC-Date"),
+                "offset": offset,
+            }
+            it.read_to_end(record)
+            entry["length"] = it.get_record_length()
+            entries.append(entry)
+
+    tmp_path = index_path(warc_filepath) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(f"{surt(entry['url'] or '')} {_timestamp(entry['warc_date'])} {json.dumps(entry)}\n")
+    os.replace(tmp_path, index_path(warc_filepath))
+    return entries
+
+
+def has_fresh_index(warc_filepath: str) -> bool:
+    """True if an index exists and is newer than the archive."""
+    path = index_path(warc_filepath)
+    return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(warc_filepath)
+
+
+def iter_index(warc_filepath: str) -> Iterator[Dict[str, Any]]:
+    """Yield the index entries of a WARC file in file order."""
+    with open(index_path(warc_filepath), "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line.split(" ", 2)[2])
+
+
+def load_index(warc_filepath: str, build: bool = True) -> List[Dict[str, Any]]:
+    """
+    Load the index of a WARC file, building it first if it is missing or stale.
+
+    Args:
+        warc_filepath: Path to the .warc or .warc.gz file
+        build: Build the index when missing; otherwise raise FileNotFoundError
+    """
+    if has_fresh_index(warc_filepath):
+        return list(iter_index(warc_filepath))
+    if not build:
+        raise FileNotFoundError(f"No up to date index for {warc_filepath}")
+    return build_index(warc_filepath)
+
+
+def is_html(entry: Dict[str, Any]) -> bool:
+    mime = entry.get("mime")
+    return bool(mime) and "text/html" in mime
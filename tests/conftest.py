@@ -0,0 +1,244 @@
+"""Shared fixtures: small WARC files written with warcio, and scripts/main.py run against fakes."""
+
+import io
+import json
+import os
+import re
+import shutil
+import sys
+from types import SimpleNamespace
+
+import pytest
+import requests
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import WARCWriter
+
+# Add src and scripts to path for imports
+REPO_DIR = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, os.path.join(REPO_DIR, 'src'))
+sys.path.insert(0, os.path.join(REPO_DIR, 'scripts'))
+
+# (url, content type, body) of the response records in the test WARCs
+PAGES = [
+    ("https://example.com/", "text/html; charset=utf-8", "<html><body><p>Home page</p></body></html>"),
+    ("https://example.com/logo.png", "image/png", "\x89PNG not really"),
+    ("https://example.com/about", "text/html", "<html><body><h1>About</h1><p>About us</p></body></html>"),
+    ("https://example.org/news?page=2", "text/html", "<html><body><p>News</p></body></html>"),
+    ("https://example.org/feed.xml", "application/rss+xml", "<rss></rss>"),
+    ("https://example.org/contact", "text/html", "<html><body><p>Contact</p></body></html>"),
+]
+
+
+def write_warc(path, pages=PAGES, gzip=True):
+    """Write a WARC holding a warcinfo record, then a request and a response record per page."""
+    with open(path, 'wb') as f:
+        writer = WARCWriter(f, gzip=gzip)
+        writer.write_record(writer.create_warcinfo_record(os.path.basename(path), {"software": "tests"}))
+        for url, content_type, body in pages:
+            request_headers = StatusAndHeaders("GET / HTTP/1.1", [("Host", "example.com")], is_http_request=True)
+            writer.write_record(writer.create_warc_record(url, 'request', http_headers=request_headers))
+            payload = body.encode('utf-8')
+            http_headers = StatusAndHeaders("200 OK", [("Content-Type", content_type),
+                                                       ("Content-Length", str(len(payload)))],
+                                            protocol="HTTP/1.1")
+            writer.write_record(writer.create_warc_record(url, 'response', payload=io.BytesIO(payload),
+                                                          http_headers=http_headers))
+    return str(path)
+
+
+@pytest.fixture(params=[True, False], ids=["warc.gz", "warc"])
+def warc_file(request, tmp_path):
+    """A test WARC, gzipped and uncompressed (memory-mapped when read)."""
+    name = "test.warc.gz" if request.param else "test.warc"
+    return write_warc(tmp_path / name, gzip=request.param)
+
+
+class _WordEncoding:
+    """Stands in for a tiktoken encoding, which is downloaded on first use: one token per word."""
+
+    def encode(self, text, **kwargs):
+        return text.split()
+
+    def encode_batch(self, texts, **kwargs):
+        return [text.split() for text in texts]
+
+
+@pytest.fixture
+def word_tokens(monkeypatch):
+    """Count tokens as words, so token counts need no tokenizer download."""
+    from CrawlToW3C.llms import token_count
+    monkeypatch.setattr(token_count, "get_encoding", lambda model="gpt-5": _WordEncoding())
+
+
+# (url, content type, body) of the pages the pipeline tests crawl
+ARTICLES = [
+    ("https://example.com/painters", "text/html",
+     "<html><head><title>Painters</title></head><body><p>Pablo Picasso painted Guernica in 1937 "
+     "after the bombing of the Basque town.</p></body></html>"),
+    ("https://example.com/rivers", "text/html",
+     "<html><head><title>Rivers</title></head><body><p>The Danube flows through ten countries "
+     "before it reaches the Black Sea in Romania.</p></body></html>"),
+    ("https://example.org/bridges", "text/html",
+     "<html><head><title>Bridges</title></head><body><p>Construction of the Golden Gate Bridge "
+     "began in January 1933 and took four years.</p></body></html>"),
+]
+
+
+class FakeMiiifyResponse:
+    def __init__(self, status_code, body=None, text=""):
+        self.status_code = status_code
+        self.body = body if body is not None else {}
+        self.text = text or json.dumps(self.body)
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code}: {self.text}")
+
+
+class FakeMiiifySession:
+    """The container and annotation endpoints of a Miiify server, held in memory."""
+
+    def __init__(self, server, headers):
+        self.server = server
+        self.headers = headers
+
+    def _path(self, url):
+        return url.split("/annotations/", 1)[1].strip("/")
+
+    def post(self, url, json=None, headers=None):
+        container = self._path(url)
+        slug = headers["Slug"]
+        if not container:
+            if slug in self.server.containers:
+                return FakeMiiifyResponse(400, text="Container exists")
+            self.server.containers[slug] = {}
+            return FakeMiiifyResponse(201, {"id": slug})
+        if container not in self.server.containers:
+            return FakeMiiifyResponse(404, text="Not found")
+        if slug in self.server.containers[container]:
+            return FakeMiiifyResponse(400, text="Annotation exists")
+        self.server.containers[container][slug] = json
+        return FakeMiiifyResponse(201, dict(json, id=slug))
+
+    def get(self, url):
+        container = self.server.containers.get(self._path(url))
+        if container is None:
+            return FakeMiiifyResponse(404, text="Not found")
+        return FakeMiiifyResponse(200, {"type": "AnnotationCollection", "total": len(container)})
+
+    def delete(self, url):
+        if self.server.containers.pop(self._path(url), None) is None:
+            return FakeMiiifyResponse(404)
+        self.server.deleted += 1
+        return FakeMiiifyResponse(204)
+
+
+class FakeLLM:
+    """
+    OpenAI client answering every page with compact spans: each line of text
+    it was sent, and two entities. A packed prompt gets an entry per page,
+    except for the pages whose prompt contains one of `leave_out`. Streamed
+    responses to prompts containing one of `cut_off` fail after the first
+    entity, and those containing one of `truncate` end there.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.packed_calls = 0
+        self.leave_out = []
+        self.cut_off = []
+        self.truncate = []
+
+    def with_options(self, **options):
+        return self
+
+    @property
+    def chat(self):
+        return SimpleNamespace(completions=SimpleNamespace(
+            create=self.completion, with_raw_response=SimpleNamespace(create=self.create)
+        ))
+
+    def create(self, messages, stream=False, **params):
+        parsed = self.completion(messages, **params)
+        if stream:
+            return SimpleNamespace(headers={}, parse=lambda: self._chunks(messages[1]["content"], parsed))
+        return SimpleNamespace(headers={}, parse=lambda: parsed)
+
+    def _chunks(self, prompt, parsed):
+        content = parsed.choices[0].message.content
+        first_entity_end = content.index("}", content.index('"entities"')) + 1
+        if any(text in prompt for text in self.cut_off + self.truncate):
+            content_end = first_entity_end
+        else:
+            content_end = len(content)
+        for start in range(0, content_end, 16):
+            piece = content[start:min(start + 16, content_end)]
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))], usage=None)
+        if any(text in prompt for text in self.cut_off):
+            raise ConnectionError("stream cut off")
+        yield SimpleNamespace(choices=[], usage=parsed.usage)
+
+    @staticmethod
+    def _page_response(prompt):
+        lines = prompt.split("\n")
+        spans = [line for line in lines[2:] if line.strip()]
+        return {
+            "spans": spans,
+            "entities": [{"name": lines[0], "type": "webpage", "context": "test"},
+                         {"name": spans[0], "type": "title", "context": "test"}],
+        }
+
+    def completion(self, messages, **params):
+        self.calls += 1
+        prompt = messages[1]["content"]
+        packed = re.findall(r"<<<PAGE (\S+)>>>\n(.*?)\n<<<END PAGE \1>>>", prompt, re.S)
+        if packed:
+            self.packed_calls += 1
+            content = json.dumps({"pages": [
+                dict(self._page_response(page_prompt), id=page_id) for page_id, page_prompt in packed
+                if not any(text in page_prompt for text in self.leave_out)
+            ]})
+        else:
+            content = json.dumps(self._page_response(prompt))
+        usage = SimpleNamespace(prompt_tokens=100, completion_tokens=20,
+                                completion_tokens_details=SimpleNamespace(reasoning_tokens=0),
+                                prompt_tokens_details=SimpleNamespace(cached_tokens=0))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch, word_tokens):
+    """scripts/main.py set up to run in tmp_path against a fake LLM and a fake Miiify server."""
+    import main
+    from CrawlToW3C import entity_writer, miiify_client
+
+    prompts_dir = tmp_path / "src" / "CrawlToW3C" / "llms"
+    prompts_dir.mkdir(parents=True)
+    shutil.copy(os.path.join(REPO_DIR, "src", "CrawlToW3C", "llms", "system_prompts.yml"), prompts_dir)
+    archive_dir = tmp_path / "archive"
+    archive_dir.mkdir()
+    warc = write_warc(archive_dir / "crawl.warc.gz", ARTICLES)
+    monkeypatch.chdir(tmp_path)
+
+    server = SimpleNamespace(containers={}, deleted=0, llm=FakeLLM())
+    real_client = miiify_client.MiiifyClient
+
+    def make_client(**kwargs):
+        client = real_client(**kwargs)
+        client.session = FakeMiiifySession(server, client.session.headers)
+        return client
+
+    monkeypatch.setattr(miiify_client, "MiiifyClient", make_client)
+    monkeypatch.setattr(main, "get_client", lambda: server.llm)
+    monkeypatch.setattr(main, "get_warc_file_paths", lambda: [warc])
+    monkeypatch.setattr(main, "ARCHIVE_DIR", str(archive_dir))
+    monkeypatch.setattr(entity_writer, "DEFAULT_OUTPUT_DIR", str(tmp_path / "src" / "CrawlToW3C" / "results"))
+    monkeypatch.setattr(main, "PACK_TARGET_TOKENS", 0)
+    monkeypatch.setattr(main.time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(main.signal, "signal", lambda signum, handler: None)
+    monkeypatch.setattr(sys, "argv", ["main.py"])
+    server.run = main.main
+    return server
@@ -0,0 +1,229 @@
+"""Batch input splitting, batch state and the --batch flow of scripts/main.py, run with LocalBatchClient."""
+
+import json
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from CrawlToW3C.llms.batch import (
+    BatchDirectory, BatchPreparer, LocalBatchClient, batch_request_line, find_batch, list_batches,
+    parse_output_line, wait_for_batch, FAILED, INGESTED, PREPARED
+)
+
+from conftest import ARTICLES
+
+
+def _request_lines(item, count):
+    return [batch_request_line(f"{item}:{index}", "system", f"page {item} chunk {index}") for index in range(count)]
+
+
+def _custom_ids(batch):
+    with open(batch.input_path, "r", encoding="utf-8") as f:
+        return [json.loads(line)["custom_id"] for line in f]
+
+
+def test_preparer_starts_a_new_batch_at_the_request_limit(tmp_path):
+    preparer = BatchPreparer(str(tmp_path), max_requests=3)
+    for item in range(3):
+        preparer.add({"number": item}, _request_lines(item, 2))
+    batches = preparer.close()
+
+    # Two requests fit a batch of three; a page's requests never straddle batches
+    assert [_custom_ids(batch) for batch in batches] == [["0:0", "0:1"], ["1:0", "1:1"], ["2:0", "2:1"]]
+    assert [[entry["number"] for entry in batch.iter_manifest()] for batch in batches] == [[0], [1], [2]]
+    assert all(batch.status == PREPARED and batch.state["requests"] == 2 for batch in batches)
+
+
+def test_preparer_starts_a_new_batch_at_the_size_limit(tmp_path):
+    size = len(_request_lines(0, 1)[0].encode("utf-8"))
+    preparer = BatchPreparer(str(tmp_path), max_bytes=2 * size + 1)
+    for item in range(5):
+        preparer.add({"number": item}, _request_lines(item, 1))
+    batches = preparer.close()
+
+    assert [_custom_ids(batch) for batch in batches] == [["0:0", "1:0"], ["2:0", "3:0"], ["4:0"]]
+
+
+def test_preparer_gives_an_oversized_item_a_batch_of_its_own(tmp_path):
+    preparer = BatchPreparer(str(tmp_path), max_requests=2)
+    preparer.add({"number": 0}, _request_lines(0, 1))
+    preparer.add({"number": 1}, _request_lines(1, 3))
+    preparer.add({"number": 2}, _request_lines(2, 1))
+    batches = preparer.close()
+
+    assert [_custom_ids(batch) for batch in batches] == [["0:0"], ["1:0", "1:1", "1:2"], ["2:0"]]
+
+
+def test_list_batches_discards_unfinished_directories(tmp_path):
+    preparer = BatchPreparer(str(tmp_path))
+    preparer.add({"number": 0}, _request_lines(0, 1))
+    prepared = preparer.close()
+    interrupted = tmp_path / "interrupted"
+    interrupted.mkdir()
+    (interrupted / "input.jsonl").write_text(_request_lines(1, 1)[0])
+
+    assert [batch.path for batch in list_batches(str(tmp_path))] == [prepared[0].path]
+    assert not interrupted.exists()
+    assert list_batches(str(tmp_path / "missing")) == []
+
+
+def test_batch_state_survives_a_restart(tmp_path):
+    preparer = BatchPreparer(str(tmp_path))
+    preparer.add({"number": 0}, _request_lines(0, 1))
+    batch = preparer.close()[0]
+    batch.save_state(batch_id="batch_123", status="submitted")
+
+    reloaded = BatchDirectory(batch.path)
+    assert reloaded.batch_id == "batch_123"
+    assert reloaded.state["requests"] == 1
+    assert find_batch(str(tmp_path), "batch_123").path == batch.path
+    assert find_batch(str(tmp_path), "batch_456") is None
+
+
+def test_parse_output_line():
+    ok = {"custom_id": "1:0", "error": None, "response": {"status_code": 200, "body": {
+        "choices": [{"message": {"content": " {\"spans\": []} "}}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5},
+    }}}
+    custom_id, content, usage, error = parse_output_line(json.dumps(ok))
+    assert (custom_id, content, error) == ("1:0", '{"spans": []}', None)
+    assert usage.prompt_tokens == 10
+
+    failed = {"custom_id": "2:0", "response": None, "error": {"code": "batch_expired", "message": "expired"}}
+    assert parse_output_line(json.dumps(failed)) == ("2:0", None, None, "batch_expired: expired")
+
+    http_error = {"custom_id": "3:0", "error": None, "response": {
+        "status_code": 429, "body": {"error": {"message": "Too many tokens"}}
+    }}
+    assert parse_output_line(json.dumps(http_error)) == ("3:0", None, None, "HTTP 429: Too many tokens")
+
+    empty = {"custom_id": "4:0", "error": None, "response": {"status_code": 200, "body": {"choices": []}}}
+    assert parse_output_line(json.dumps(empty)) == ("4:0", None, None, "response has no message content")
+
+
+def test_local_client_runs_requests_through_the_completion_function(tmp_path):
+    preparer = BatchPreparer(str(tmp_path / "batches"))
+    preparer.add({"number": 0}, _request_lines(0, 1))
+    preparer.add({"number": 1}, _request_lines(1, 1))
+    batch = preparer.close()[0]
+    bodies = []
+
+    def complete(body):
+        bodies.append(body)
+        if "page 1" in body["messages"][1]["content"]:
+            raise RuntimeError("model unavailable")
+        usage = SimpleNamespace(prompt_tokens=7, completion_tokens=3, total_tokens=10)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="done"))], usage=usage)
+
+    client = LocalBatchClient(None, str(tmp_path / "local"), complete=complete)
+    batch.save_state(batch_id=client.submit(batch.input_path), status="submitted")
+    info = wait_for_batch(client, batch, poll_seconds=0)
+
+    assert [body["messages"][1]["content"] for body in bodies] == ["page 0 chunk 0", "page 1 chunk 0"]
+    assert (info["status"], info["completed"], info["failed"], info["total"]) == ("completed", 1, 1, 2)
+    results = batch.read_results()
+    assert results["0:0"][0] == "done"
+    assert results["0:0"][1].prompt_tokens == 7
+    assert results["1:0"] == (None, None, "RuntimeError: model unavailable")
+
+
+def test_wait_for_batch_polls_until_the_batch_ends():
+    statuses = iter(["validating", "in_progress", "in_progress", "completed"])
+    client = SimpleNamespace(
+        retrieve=lambda batch_id: {"status": next(statuses), "completed": 0, "failed": 0, "total": 1,
+                                   "output_file_id": None, "error_file_id": None},
+        download=lambda file_id, path: pytest.fail("nothing to download"),
+    )
+    batch = SimpleNamespace(batch_id="batch_123", output_path=None, errors_path=None)
+
+    assert wait_for_batch(client, batch, poll_seconds=0, stop=threading.Event())["status"] == "completed"
+    assert next(statuses, None) is None
+
+
+def test_wait_for_batch_returns_none_once_stopped():
+    client = SimpleNamespace(retrieve=lambda batch_id: {"status": "in_progress", "completed": 0, "failed": 0,
+                                                        "total": 1})
+    stop = threading.Event()
+    stop.set()
+
+    assert wait_for_batch(client, SimpleNamespace(batch_id="batch_123"), poll_seconds=0, stop=stop) is None
+
+
+def _batches():
+    """The pipeline's batches, oldest first."""
+    batches = list_batches(os.path.join("src", "CrawlToW3C", "results", "batches"))
+    return sorted(batches, key=lambda batch: batch.state["created"])
+
+
+def test_local_batch_run_annotates_every_page(pipeline, monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["main.py", "--local-batch"])
+    pipeline.run()
+
+    assert len(pipeline.containers["crawl2w3c-crawl"]) == 2 * len(ARTICLES)
+    assert [batch.status for batch in _batches()] == [INGESTED]
+    calls = pipeline.llm.calls
+
+    pipeline.run()
+    assert pipeline.llm.calls == calls
+    assert len(_batches()) == 1
+
+
+def test_batch_is_resumed_by_id_after_a_crash(pipeline, monkeypatch):
+    def lost_connection(self, batch_id):
+        raise ConnectionError("connection lost")
+
+    monkeypatch.setattr(sys, "argv", ["main.py", "--local-batch"])
+    with monkeypatch.context() as patch:
+        patch.setattr(LocalBatchClient, "retrieve", lost_connection)
+        with pytest.raises(ConnectionError):
+            pipeline.run()
+    batch = _batches()[0]
+    assert batch.status == "submitted"
+    assert pipeline.containers["crawl2w3c-crawl"] == {}
+    calls = pipeline.llm.calls
+
+    monkeypatch.setattr(sys, "argv", ["main.py", "--local-batch", "--batch-id", batch.batch_id])
+    pipeline.run()
+    assert len(pipeline.containers["crawl2w3c-crawl"]) == 2 * len(ARTICLES)
+    assert [batch.status for batch in _batches()] == [INGESTED]
+    assert pipeline.llm.calls == calls  # the submitted batch already ran
+
+    monkeypatch.setattr(sys, "argv", ["main.py", "--local-batch"])
+    pipeline.run()
+    assert pipeline.llm.calls == calls
+    assert len(_batches()) == 1
+
+
+def test_pages_missing_from_an_expired_batch_are_batched_again(pipeline, monkeypatch):
+    import main
+
+    class ExpiringClient(LocalBatchClient):
+        """Loses the requests for one page, as a batch does that expires before finishing them."""
+
+        def __init__(self, llm, directory):
+            def complete(body):
+                if "Danube" in body["messages"][1]["content"]:
+                    raise TimeoutError("batch expired")
+                return llm.chat.completions.create(**body)
+            super().__init__(llm, directory, complete=complete)
+
+        def retrieve(self, batch_id):
+            return dict(super().retrieve(batch_id), status="expired")
+
+    monkeypatch.setattr(sys, "argv", ["main.py", "--local-batch"])
+    with monkeypatch.context() as patch:
+        patch.setattr(main, "LocalBatchClient", ExpiringClient)
+        pipeline.run()
+    assert [(batch.status, batch.state["batch_status"]) for batch in _batches()] == [(FAILED, "expired")]
+    uploaded = pipeline.containers["crawl2w3c-crawl"]
+    assert len(uploaded) == 2 * (len(ARTICLES) - 1)
+    calls = pipeline.llm.calls
+
+    pipeline.run()
+    assert len(uploaded) == 2 * len(ARTICLES)
+    assert pipeline.llm.calls == calls + 1  # only the page the expired batch lost
+    assert [batch.status for batch in _batches()] == [FAILED, INGESTED]
+    assert [entry["url"] for entry in _batches()[1].iter_manifest()] == ["https://example.com/rivers"]
@@ -0,0 +1,106 @@
+"""Chunking oversized pages and merging the chunk responses."""
+
+import pytest
+
+from CrawlToW3C.chunking import merge_llm_responses, split_into_chunks
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def count_chars(text):
+    return len(text) // 4 + 1
+
+
+@pytest.mark.parametrize("count_tokens", [count_words, count_chars], ids=["words", "chars"])
+@pytest.mark.parametrize("max_tokens", [5, 12, 40])
+def test_chunks_respect_the_token_cap(count_tokens, max_tokens):
+    page = "\n".join([
+        "<title>A page</title>",
+        "<p>" + " ".join(f"Sentence {i} has a few words in it." for i in range(30)) + "</p>",
+        "<p>" + " ".join(f"word{i}" for i in range(200)) + "</p>",
+        "<p>" + "x" * 500 + "</p>",
+        "<h2>Short</h2>",
+    ])
+    chunks = split_into_chunks(page, max_tokens, count_tokens)
+    assert all(count_tokens(chunk) <= max_tokens for chunk in chunks)
+    # Nothing is lost or reordered: only the separators between pieces change
+    assert "".join("".join(chunks).split()) == "".join(page.split())
+
+
+def test_chunks_are_cut_between_blocks():
+    # Every block or piece also counts a token for its separator: 5 per block here
+    page = "\n".join(f"<p>block {i} one two</p>" for i in range(6))
+    chunks = split_into_chunks(page, 10, count_words)
+    assert chunks == ["\n".join(f"<p>block {i} one two</p>" for i in range(j, j + 2)) for j in (0, 2, 4)]
+
+
+def test_small_page_is_one_chunk():
+    page = "<title>T</title>\n<p>Some text.</p>"
+    assert split_into_chunks(page, 100, count_words) == [page]
+
+
+def test_long_block_is_cut_at_sentences():
+    block = "One two three. Four five six! Seven eight nine? Ten eleven twelve."
+    chunks = split_into_chunks(block, 8, count_words)
+    assert chunks == ["One two three. Four five six!", "Seven eight nine? Ten eleven twelve."]
+
+
+def test_long_sentence_is_cut_at_words():
+    block = " ".join(f"w{i}" for i in range(10))
+    chunks = split_into_chunks(block, 6, count_words)
+    # The pieces of a block are packed into chunks like blocks are
+    assert chunks == ["w0 w1 w2", "w3 w4 w5", "w6 w7 w8\nw9"]
+
+
+def test_enormous_word_is_cut_by_characters():
+    chunks = split_into_chunks("x" * 1000, 50, count_chars)
+    assert len(chunks) > 1
+    assert "".join(chunks) == "x" * 1000
+    assert all(count_chars(chunk) <= 50 for chunk in chunks)
+
+
+def _response(items, entities=()):
+    return {"annotationPage": {"type": "AnnotationPage", "items": list(items)}, "entities": list(entities)}
+
+
+def test_merge_dedupes_annotations_by_id_then_body():
+    first = {"id": "urn:sha256:1", "body": {"value": "a"}}
+    merged = merge_llm_responses([
+        _response([first, {"body": {"value": "b"}}]),
+        _response([{"id": "urn:sha256:1", "body": {"value": "changed"}}, {"body": {"value": "b"}},
+                   {"body": "plain string body"}, "not an annotation"]),
+    ])
+    assert merged["annotationPage"]["items"] == [first, {"body": {"value": "b"}}, {"body": "plain string body"}]
+    assert merged["annotationPage"]["type"] == "AnnotationPage"
+
+
+def test_merge_accepts_list_and_object_body_values():
+    list_body = {"body": {"value": ["a", "b"]}}
+    object_body = {"body": {"value": {"text": "a", "lang": "en"}}}
+    merged = merge_llm_responses([
+        _response([list_body, object_body]),
+        _response([{"body": {"value": ["a", "b"]}}, {"body": {"value": {"lang": "en", "text": "a"}}},
+                   {"body": [{"value": "x"}]}, {"body": [{"value": "x"}]}]),
+    ])
+    assert merged["annotationPage"]["items"] == [list_body, object_body, {"body": [{"value": "x"}]}]
+
+
+def test_merge_dedupes_entities_by_name_and_type():
+    merged = merge_llm_responses([
+        _response([], [{"name": "Picasso", "type": "artist"}, {"name": "", "type": "artist"}]),
+        _response([], [{"name": " picasso ", "type": "artist"}, {"name": "Picasso", "type": "place"},
+                       {"name": "Guernica", "type": ["artwork", "painting"]},
+                       {"name": "guernica", "type": ["artwork", "painting"]}, "not an entity"]),
+    ])
+    assert merged["entities"] == [
+        {"name": "Picasso", "type": "artist"},
+        {"name": "Picasso", "type": "place"},
+        {"name": "Guernica", "type": ["artwork", "painting"]},
+    ]
+
+
+def test_merge_accepts_a_bare_list_of_annotations():
+    merged = merge_llm_responses([{"annotationPage": [{"id": "a"}, {"id": "a"}]}, {"annotationPage": None}])
+    assert merged["annotationPage"]["items"] == [{"id": "a"}]
@@ -0,0 +1,244 @@
+"""LLM dispatcher: token buckets, rate limit headers, retries and ordered imap."""
+
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from CrawlToW3C.llms import dispatcher
+from CrawlToW3C.llms.dispatcher import LLMDispatcher, RateLimiter, TokenBucket, parse_duration, retry_after_seconds
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def _usage(prompt_tokens=100, completion_tokens=20, cached_tokens=0):
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+        completion_tokens_details=SimpleNamespace(reasoning_tokens=0),
+        prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens),
+    )
+
+
+class _RawResponse:
+    def __init__(self, content, stream):
+        self.content = content
+        self.stream = stream
+        self.headers = {"x-ratelimit-remaining-tokens": "50000", "x-ratelimit-remaining-requests": "400"}
+
+    def parse(self):
+        if not self.stream:
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.content))],
+                                   usage=_usage())
+        return self._chunks()
+
+    def _chunks(self):
+        for piece in self.content:
+            if isinstance(piece, Exception):
+                raise piece
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))], usage=None)
+        yield SimpleNamespace(choices=[], usage=_usage())
+
+
+class FakeClient:
+    """OpenAI client whose chat completions fail with `errors` first, then answer `content`."""
+
+    def __init__(self, errors=(), content="ok"):
+        self.errors = list(errors)
+        self.content = content
+        self.calls = 0
+        self.options = None
+
+    def with_options(self, **options):
+        self.options = options
+        return self
+
+    @property
+    def chat(self):
+        return SimpleNamespace(completions=SimpleNamespace(with_raw_response=SimpleNamespace(create=self.create)))
+
+    def create(self, stream=False, **params):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return _RawResponse(self.content, stream)
+
+
+def _rate_limit_error(headers):
+    response = httpx.Response(429, headers=headers, request=REQUEST)
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(dispatcher.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def test_parse_duration():
+    assert parse_duration("20") == 20
+    assert parse_duration("0.5") == 0.5
+    assert parse_duration("1m30s") == 90
+    assert parse_duration("250ms") == 0.25
+    assert parse_duration("1h2m") == 3720
+    assert parse_duration("") is None
+    assert parse_duration("soon") is None
+
+
+def test_retry_after_seconds_prefers_milliseconds():
+    assert retry_after_seconds({"retry-after-ms": "1500", "retry-after": "9"}) == 1.5
+    assert retry_after_seconds({"retry-after": "9"}) == 9
+    assert retry_after_seconds({"x-ratelimit-reset-tokens": "6m0s"}) == 360
+    assert retry_after_seconds({}) is None
+    assert retry_after_seconds(None) is None
+
+
+def test_token_bucket_refills_continuously():
+    bucket = TokenBucket(per_minute=600)  # 10 per second
+    now = bucket.updated
+    assert bucket.wait_time(600, now) == 0
+    bucket.consume(600, now)
+    assert bucket.wait_time(10, now) == pytest.approx(1.0)
+    assert bucket.wait_time(10, now + 1.0) == 0
+    # The level may go negative and is repaid by refilling
+    bucket.consume(110, now + 1.0)
+    assert bucket.wait_time(10, now + 1.0) == pytest.approx(11.0)
+    # Requests larger than the bucket wait for a full bucket only
+    assert bucket.wait_time(10_000, now + 1.0) == pytest.approx(70.0)
+
+
+def test_token_bucket_never_refills_past_capacity():
+    bucket = TokenBucket(per_minute=60)
+    bucket.consume(30, bucket.updated)
+    assert bucket.wait_time(60, bucket.updated + 3600) == 0
+    assert bucket.level == 60
+
+
+def test_limiter_clamps_to_headers_and_pauses():
+    limiter = RateLimiter(tokens_per_minute=60_000, requests_per_minute=60)
+    limiter.update_from_headers({"x-ratelimit-remaining-tokens": "100", "x-ratelimit-remaining-requests": "bad"})
+    assert limiter.tokens.level == 100
+    assert limiter.requests.level == 60
+    limiter.pause(30)
+    assert limiter.paused_until >= time.monotonic() + 29
+    assert limiter.requests.wait_time(1, time.monotonic()) > 0
+
+
+def test_limiter_settles_estimate_with_actual_usage():
+    limiter = RateLimiter(tokens_per_minute=60_000, requests_per_minute=60)
+    limiter.acquire(1000)
+    level = limiter.tokens.level
+    limiter.settle(estimated_tokens=1000, actual_tokens=400)
+    assert limiter.tokens.level == pytest.approx(level + 600, abs=5)
+
+
+def test_complete_retries_429_after_retry_after(word_tokens):
+    client = FakeClient(errors=[_rate_limit_error({"retry-after-ms": "10"})])
+    llm = LLMDispatcher(client, max_in_flight=1, max_retries=2)
+    assert llm.complete("system prompt", "user prompt", prompt_tokens=10) == "ok"
+    assert client.calls == 2
+    assert client.options == {"max_retries": 0}
+    assert llm.usage.summary()["requests"] == 1
+    llm.close()
+
+
+def test_complete_gives_up_after_max_retries(word_tokens):
+    client = FakeClient(errors=[_rate_limit_error({"retry-after-ms": "1"}) for _ in range(3)])
+    llm = LLMDispatcher(client, max_in_flight=1, max_retries=1)
+    with pytest.raises(openai.RateLimitError):
+        llm.complete("system prompt", "user prompt", prompt_tokens=10)
+    assert client.calls == 2
+    llm.close()
+
+
+@pytest.mark.parametrize("error", [
+    openai.APIConnectionError(request=REQUEST),
+    openai.APITimeoutError(request=REQUEST),
+    openai.InternalServerError("unavailable", response=httpx.Response(503, request=REQUEST), body=None),
+], ids=["connection", "timeout", "5xx"])
+def test_complete_retries_transient_errors_with_backoff(word_tokens, no_sleep, error):
+    client = FakeClient(errors=[error, error, error])
+    llm = LLMDispatcher(client, max_in_flight=1, max_retries=3)
+    assert llm.complete("system prompt", "user prompt", prompt_tokens=10) == "ok"
+    assert client.calls == 4
+    assert no_sleep == [1, 2, 4]
+    llm.close()
+
+
+def test_complete_does_not_retry_other_errors(word_tokens, no_sleep):
+    error = openai.BadRequestError("bad", response=httpx.Response(400, request=REQUEST), body=None)
+    client = FakeClient(errors=[error])
+    llm = LLMDispatcher(client, max_in_flight=1, max_retries=3)
+    with pytest.raises(openai.BadRequestError):
+        llm.complete("system prompt", "user prompt", prompt_tokens=10)
+    assert client.calls == 1
+    llm.close()
+
+
+def test_stream_cut_off_after_content_is_not_retried(word_tokens, no_sleep):
+    client = FakeClient(content=["{\"a\": ", openai.APIConnectionError(request=REQUEST)])
+    llm = LLMDispatcher(client, max_in_flight=1, max_retries=3)
+    pieces = []
+    with pytest.raises(openai.APIConnectionError):
+        llm.complete("system prompt", "user prompt", prompt_tokens=10, on_text=pieces.append)
+    assert client.calls == 1
+    assert pieces == ["{\"a\": "]
+    llm.close()
+
+
+def test_stream_passes_content_on(word_tokens):
+    client = FakeClient(content=["{\"a\": ", "1}"])
+    llm = LLMDispatcher(client, max_in_flight=1)
+    pieces = []
+    assert llm.complete("system prompt", "user prompt", prompt_tokens=10, on_text=pieces.append) == "{\"a\": 1}"
+    assert pieces == ["{\"a\": ", "1}"]
+    llm.close()
+
+
+def test_cached_prefix_is_credited_on_the_next_request(word_tokens):
+    llm = LLMDispatcher(FakeClient(), max_in_flight=1, cached_token_weight=0.0)
+    assert llm.cached_prefix_tokens == {}
+    llm.complete("a b c", "user prompt", prompt_tokens=10)
+    # The fake usage reports no cached tokens
+    assert llm.cached_prefix_tokens == {"a b c": 0}
+    assert llm.count_system_prompt("a b c") == 3
+    llm.close()
+
+
+def test_imap_yields_in_input_order():
+    llm = LLMDispatcher(FakeClient(), max_in_flight=4)
+    release = threading.Event()
+
+    def work(item):
+        if item == 0:
+            release.wait(5)  # the first item finishes last
+        if item == 3:
+            release.set()
+        if item == 5:
+            raise ValueError("bad item")
+        return item * 10
+
+    results = list(llm.imap(work, range(8)))
+    assert [item for item, _, _ in results] == list(range(8))
+    assert [result for item, result, _ in results if item != 5] == [i * 10 for i in range(8) if i != 5]
+    assert isinstance(results[5][2], ValueError) and results[5][1] is None
+    llm.close()
+
+
+def test_imap_pulls_items_lazily():
+    llm = LLMDispatcher(FakeClient(), max_in_flight=2)
+    pulled = []
+
+    def items():
+        for i in range(100):
+            pulled.append(i)
+            yield i
+
+    results = llm.imap(lambda item: item, items())
+    next(results)
+    assert len(pulled) <= 2 * llm.max_in_flight
+    assert [item for item, _, _ in results] == list(range(1, 100))
+    llm.close()
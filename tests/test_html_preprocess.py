@@ -0,0 +1,24 @@
+"""Every process_html engine reproduces the golden output for examples/example.html."""
+
+import os
+import sys
+
+import pytest
+
+# Add src to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from CrawlToW3C.html_preprocess import ENGINES, process_html
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(__file__), '..', 'examples')
+
+
+def _read_example(name):
+    with open(os.path.join(EXAMPLES_DIR, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('engine', sorted(ENGINES))
+def test_process_html_matches_golden_output(engine):
+    expected = _read_example('example.processed.txt').rstrip('\n')
+    assert process_html(_read_example('example.html'), engine=engine) == expected
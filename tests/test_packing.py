@@ -0,0 +1,161 @@
+"""Packing small pages into shared requests: the packed prompt, routing the response, and main.py's packer."""
+
+import json
+from types import SimpleNamespace
+
+from CrawlToW3C.llms.token_count import MESSAGE_OVERHEAD_TOKENS
+from CrawlToW3C.packing import build_packed_prompt, split_packed_response
+
+from conftest import ARTICLES
+
+
+def test_build_packed_prompt_delimits_each_page():
+    prompt = build_packed_prompt([("p1", "https://a/\n\nFirst"), ("p2", "https://b/\n\nSecond")])
+
+    assert prompt == ("<<<PAGE p1>>>\nhttps://a/\n\nFirst\n<<<END PAGE p1>>>\n\n"
+                      "<<<PAGE p2>>>\nhttps://b/\n\nSecond\n<<<END PAGE p2>>>")
+
+
+def test_split_packed_response_routes_each_page():
+    content = json.dumps({"pages": [
+        {"id": "p2", "spans": ["Second"], "entities": []},
+        {"id": "p1", "spans": ["First"], "entities": [{"name": "A"}]},
+    ]})
+
+    routed = split_packed_response(content, ["p1", "p2"])
+    assert {page_id: json.loads(response) for page_id, response in routed.items()} == {
+        "p1": {"spans": ["First"], "entities": [{"name": "A"}]},
+        "p2": {"spans": ["Second"], "entities": []},
+    }
+
+
+def test_split_packed_response_leaves_out_what_it_cannot_route():
+    content = json.dumps({"pages": [
+        {"id": "p1", "spans": ["First"]},
+        {"id": "p1", "spans": ["Again"]},  # a repeated page keeps its first entry
+        {"id": "p9", "spans": ["Unknown"]},
+        "not a page",
+    ]})
+
+    routed = split_packed_response(content, ["p1", "p2"])
+    assert list(routed) == ["p1"]
+    assert json.loads(routed["p1"]) == {"spans": ["First"]}
+    assert split_packed_response("not json", ["p1"]) == {}
+    assert split_packed_response(json.dumps(["p1"]), ["p1"]) == {}
+    assert split_packed_response(json.dumps({"pages": {"id": "p1"}}), ["p1"]) == {}
+
+
+def _job(number, content_tokens=None, chunks=1):
+    """A page job with `content_tokens` per chunk, or one that needs no request (rejected or cached)."""
+    if content_tokens is None:
+        return {"number": number, "accepted": False, "cached_response": None, "user_prompts": []}
+    return {
+        "number": number, "accepted": True, "cached_response": None,
+        "user_prompts": [f"https://example.com/{number}\n\npage {number}"] * chunks,
+        "prompt_tokens": [content_tokens + MESSAGE_OVERHEAD_TOKENS] * chunks,
+    }
+
+
+def _pack(jobs, target_tokens=100, max_pages=8):
+    """The packer's output for `jobs`: a list of job numbers per pack, a job number per plain request."""
+    import main
+
+    shapes = []
+    for job, index in main.pack_llm_requests(main.iter_llm_requests(jobs), 0, target_tokens, max_pages):
+        shapes.append([packed_job["number"] for packed_job, _ in job] if index is main.PACKED else job["number"])
+    return shapes
+
+
+def test_small_pages_share_a_request():
+    assert _pack([_job(0, 10), _job(1, 10), _job(2, 10)]) == [[0, 1, 2]]
+
+
+def test_pack_is_flushed_at_the_token_target():
+    assert _pack([_job(0, 40), _job(1, 40), _job(2, 40), _job(3, 10)]) == [[0, 1], [2, 3]]
+
+
+def test_pack_is_flushed_at_the_page_limit():
+    assert _pack([_job(number, 10) for number in range(5)], max_pages=2) == [[0, 1], [2, 3], 4]
+
+
+def test_large_and_chunked_pages_are_sent_on_their_own():
+    jobs = [_job(0, 10), _job(1, 10), _job(2, 60), _job(3, 10), _job(4, 10, chunks=2), _job(5, 10)]
+
+    # The page over half the target and the two-chunk page each flush the pack before them
+    assert _pack(jobs) == [[0, 1], 2, 3, 4, 4, 5]
+
+
+def test_jobs_without_a_request_keep_their_place():
+    jobs = [_job(0), _job(1, 10), _job(2), _job(3, 10), _job(4), _job(5, 60), _job(6)]
+
+    # Jobs arriving while a pack fills join it; before any pack they pass straight through
+    assert _pack(jobs) == [0, [1, 2, 3, 4], 5, 6]
+
+
+def test_a_pack_of_one_page_is_sent_as_plain_requests():
+    assert _pack([_job(0, 10), _job(1), _job(2, 60)]) == [0, 1, 2]
+
+
+def test_packed_responses_are_split_back_per_page_in_order():
+    import main
+
+    jobs = [_job(0, 10), _job(1), _job(2, 10), _job(3, 60), _job(4, 10), _job(5, 10)]
+    jobs[1]["cached_response"] = "cached 1"
+
+    def annotate(request):
+        job, index = request
+        if index is main.PACKED:
+            return {packed_job["number"]: f"packed {packed_job['number']}" for packed_job, packed_index in job
+                    if packed_index is not None}
+        return job["cached_response"] if index is None else f"single {job['number']}"
+
+    dispatcher = SimpleNamespace(imap=lambda fn, items: ((item, fn(item), None) for item in items))
+    requests = main.pack_llm_requests(main.iter_llm_requests(jobs), 0, 100, 8)
+    results = [(job["number"], responses, error) for job, responses, error
+               in main.iter_page_results(dispatcher, annotate, requests)]
+
+    assert results == [
+        (0, ["packed 0"], None), (1, ["cached 1"], None), (2, ["packed 2"], None),
+        (3, ["single 3"], None), (4, ["packed 4"], None), (5, ["packed 5"], None),
+    ]
+
+
+def test_a_failed_pack_fails_only_its_requested_pages():
+    import main
+
+    jobs = [_job(0, 10), _job(1), _job(2, 10)]
+    error = RuntimeError("pack failed")
+    dispatcher = SimpleNamespace(imap=lambda fn, items: ((item, None, error) for item in items))
+    requests = main.pack_llm_requests(main.iter_llm_requests(jobs), 0, 100, 8)
+    results = [(job["number"], responses, page_error) for job, responses, page_error
+               in main.iter_page_results(dispatcher, None, requests)]
+
+    assert results == [(0, [], error), (1, [None], None), (2, [], error)]
+
+
+def test_packed_run_uploads_the_same_annotations(pipeline, monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "PACK_TARGET_TOKENS", 4000)
+    pipeline.run()
+    assert (pipeline.llm.calls, pipeline.llm.packed_calls) == (1, 1)
+    packed = dict(pipeline.containers["crawl2w3c-crawl"])
+    assert len(packed) == 2 * len(ARTICLES)
+
+    monkeypatch.setattr(main, "PACK_TARGET_TOKENS", 0)
+    monkeypatch.setattr(main, "RESUME", False)
+    pipeline.run()
+    assert pipeline.containers["crawl2w3c-crawl"] == packed
+
+
+def test_page_left_out_of_a_packed_response_is_annotated_on_its_own(pipeline, monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "PACK_TARGET_TOKENS", 4000)
+    pipeline.llm.leave_out = ["Danube"]
+    pipeline.run()
+
+    assert (pipeline.llm.calls, pipeline.llm.packed_calls) == (2, 1)
+    targets = {annotation["target"]["source"] for annotation in pipeline.containers["crawl2w3c-crawl"].values()}
+    assert targets == {url for url, content_type, body in ARTICLES}
+    assert len(pipeline.containers["crawl2w3c-crawl"]) == 2 * len(ARTICLES)
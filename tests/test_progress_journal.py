@@ -0,0 +1,111 @@
+"""Progress journal: stages, torn lines, resume and the CDXJ resume point."""
+
+import json
+import os
+
+from CrawlToW3C.progress_journal import (
+    ACCEPTED, ENTITIES_WRITTEN, LLM_DONE, SKIPPED, UPLOADED, ProgressJournal,
+)
+from CrawlToW3C.warc_index import build_index, is_html
+
+
+def test_latest_stage_wins_across_runs(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = ProgressJournal(path)
+    journal.mark("a", ACCEPTED, url="https://example.com/a", accepted=True)
+    journal.mark("a", ENTITIES_WRITTEN)
+    journal.mark("a", LLM_DONE)  # a late event for an earlier stage does not move the record back
+    journal.mark("b", SKIPPED)
+    journal.mark(None, UPLOADED)  # records without an id cannot be resumed
+    journal.close()
+
+    journal = ProgressJournal(path)
+    assert journal.stage("a") == ENTITIES_WRITTEN
+    assert journal.get("a")["url"] == "https://example.com/a"
+    assert journal.reached("a", LLM_DONE) and not journal.reached("a", UPLOADED)
+    assert journal.is_complete("b")
+    assert not journal.is_complete("a")
+    assert journal.is_complete("a", uploads=False)
+    assert journal.stage("missing") is None
+    assert None not in journal.records
+    journal.close()
+
+
+def test_torn_last_line_is_ignored(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = ProgressJournal(path)
+    journal.mark("a", UPLOADED)
+    journal.mark("b", LLM_DONE)
+    journal.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"id": "b", "stage": "uplo')  # crash in the middle of a write
+
+    journal = ProgressJournal(path)
+    assert journal.stage("a") == UPLOADED
+    assert journal.stage("b") == LLM_DONE
+    journal.mark("c", ACCEPTED)
+    journal.close()
+    # Events appended after the torn line still load
+    assert ProgressJournal(path).stage("c") == ACCEPTED
+
+
+def test_resume_off_starts_a_fresh_journal(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = ProgressJournal(path)
+    journal.mark("a", UPLOADED)
+    journal.close()
+
+    journal = ProgressJournal(path, resume=False)
+    assert journal.stage("a") is None
+    journal.close()
+    assert os.path.getsize(path) == 0
+
+
+def test_fsync_every_flushes_events(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = ProgressJournal(path, fsync_every=2)
+    journal.mark("a", ACCEPTED)
+    journal.mark("b", ACCEPTED)
+    assert journal.unsynced == 0
+    with open(path, encoding="utf-8") as f:
+        assert [json.loads(line)["id"] for line in f] == ["a", "b"]
+    journal.close()
+
+
+def test_mark_after_waits_for_every_part(tmp_path):
+    journal = ProgressJournal(str(tmp_path / "journal.jsonl"))
+    part_done = journal.mark_after("a", UPLOADED, parts=2)
+    part_done()
+    assert journal.stage("a") is None
+    part_done()
+    assert journal.stage("a") == UPLOADED
+
+    part_done = journal.mark_after("b", UPLOADED, parts=2)
+    part_done(ok=False)
+    part_done()
+    assert journal.stage("b") is None
+
+    journal.mark_after("c", UPLOADED, parts=0)
+    assert journal.stage("c") == UPLOADED
+    journal.close()
+
+
+def test_resume_point_skips_leading_complete_records(tmp_path, warc_file):
+    journal = ProgressJournal(str(tmp_path / "journal.jsonl"))
+    assert journal.resume_point(warc_file) == (0, [])  # no index yet: read the whole file
+
+    html = [entry for entry in build_index(warc_file) if is_html(entry)]
+    journal.mark(html[0]["record_id"], UPLOADED)
+    journal.mark(html[1]["record_id"], SKIPPED)
+    journal.mark(html[3]["record_id"], UPLOADED)  # past an incomplete record: still read
+    offset, skipped = journal.resume_point(warc_file)
+    assert offset == html[2]["offset"]
+    assert skipped == html[:2]
+
+    journal.mark(html[2]["record_id"], ENTITIES_WRITTEN)
+    assert journal.resume_point(warc_file)[0] == html[2]["offset"]
+    # Without uploads, written entities complete a record
+    offset, skipped = journal.resume_point(warc_file, uploads=False)
+    assert offset == os.path.getsize(warc_file)
+    assert skipped == html
+    journal.close()
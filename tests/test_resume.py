@@ -0,0 +1,61 @@
+"""A resumed scripts/main.py run keeps what an earlier run uploaded to Miiify."""
+
+import glob
+
+import pytest
+
+from conftest import ARTICLES
+
+
+def test_resumed_run_keeps_earlier_uploads(pipeline):
+    pipeline.run()
+    assert list(pipeline.containers) == ["crawl2w3c-crawl"]
+    uploaded = dict(pipeline.containers["crawl2w3c-crawl"])
+    assert len(uploaded) == 2 * len(ARTICLES)  # the title and the paragraph of each page
+    calls = pipeline.llm.calls
+
+    pipeline.run()
+    assert pipeline.deleted == 0
+    assert pipeline.containers["crawl2w3c-crawl"] == uploaded
+    assert pipeline.llm.calls == calls  # every record was skipped as complete
+
+
+def test_resume_off_starts_a_fresh_container(pipeline, monkeypatch):
+    import main
+
+    pipeline.run()
+    pipeline.containers["crawl2w3c-crawl"]["stale"] = {}
+
+    monkeypatch.setattr(main, "RESUME", False)
+    pipeline.run()
+    assert pipeline.deleted == 1
+    assert "stale" not in pipeline.containers["crawl2w3c-crawl"]
+    assert len(pipeline.containers["crawl2w3c-crawl"]) == 2 * len(ARTICLES)
+
+
+def _written_entities():
+    from CrawlToW3C.entity_writer import read_entities_from_jsonl
+
+    paths = glob.glob("src/CrawlToW3C/results/**/*_entities.jsonl", recursive=True)
+    return [(line["source"]["url"], line["entity"]["name"]) for path in paths for line in read_entities_from_jsonl(path)]
+
+
+@pytest.mark.parametrize("failure", ["cut_off", "truncate"])
+@pytest.mark.parametrize("stream_retry", [True, False], ids=["streamed retry", "plain retry"])
+def test_retried_page_does_not_write_streamed_entities_twice(pipeline, monkeypatch, failure, stream_retry):
+    import main
+
+    monkeypatch.setattr(main, "STREAM_RESPONSES", True)
+    setattr(pipeline.llm, failure, ["Danube"])
+    pipeline.run()
+    rivers = "https://example.com/rivers"
+    assert [name for url, name in _written_entities() if url == rivers] == [rivers]
+
+    setattr(pipeline.llm, failure, [])
+    monkeypatch.setattr(main, "STREAM_RESPONSES", stream_retry)
+    calls = pipeline.llm.calls
+    pipeline.run()
+    assert pipeline.llm.calls == calls + 1  # only the failed page is annotated again
+    written = _written_entities()
+    assert len(written) == len(set(written)) == 2 * len(ARTICLES)
+    assert len(pipeline.containers["crawl2w3c-crawl"]) == 2 * len(ARTICLES)
@@ -0,0 +1,74 @@
+"""Seen-URL stores: shared behaviour, Bloom false positives and SQLite persistence."""
+
+import pytest
+
+from CrawlToW3C.seen_store import BloomSeenStore, MemorySeenStore, SQLiteSeenStore, make_seen_store
+
+
+@pytest.fixture(params=["memory", "bloom", "sqlite"])
+def store(request, tmp_path):
+    store = make_seen_store(request.param, path=str(tmp_path / "seen.sqlite"), capacity=1000)
+    yield store
+    store.close()
+
+
+def test_check_and_add(store):
+    assert store.check_and_add("https://example.com/a") is False
+    assert store.check_and_add("https://example.com/a") is True
+    assert store.check_and_add("https://example.com/b") is False
+    assert "https://example.com/a" in store
+    assert "https://example.com/c" not in store
+    assert len(store) == 2
+    stats = store.stats()
+    assert (stats["lookups"], stats["hits"]) == (3, 1)
+    assert stats["store"] == type(store).__name__
+
+
+def test_add_and_clear(store):
+    store.add("https://example.com/a")
+    store.add("https://example.com/a")
+    assert len(store) == 1
+    store.clear()
+    assert "https://example.com/a" not in store
+    assert store.check_and_add("https://example.com/a") is False
+
+
+def test_make_seen_store_rejects_bad_arguments():
+    assert isinstance(make_seen_store(), MemorySeenStore)
+    with pytest.raises(ValueError):
+        make_seen_store("sqlite")
+    with pytest.raises(ValueError):
+        make_seen_store("redis")
+
+
+def test_bloom_false_positive_rate_at_capacity():
+    store = BloomSeenStore(capacity=10_000, error_rate=0.01)
+    for i in range(10_000):
+        store.add(f"https://example.com/page/{i}")
+    assert all(f"https://example.com/page/{i}" in store for i in range(10_000))
+    false_positives = sum(f"https://example.org/other/{i}" in store for i in range(20_000))
+    assert false_positives / 20_000 < 0.02
+
+
+def test_bloom_memory_is_fixed_by_capacity():
+    store = BloomSeenStore(capacity=100_000, error_rate=0.001)
+    # About 14.4 bits, or 1.8 bytes, per URL at 0.1%
+    assert 1.7 < store.memory_bytes() / 100_000 < 1.9
+    for i in range(1000):
+        store.add(f"https://example.com/{i}")
+    assert store.memory_bytes() == len(store.bits)
+
+
+def test_sqlite_store_persists_and_is_shared(tmp_path):
+    path = str(tmp_path / "seen.sqlite")
+    first = SQLiteSeenStore(path)
+    second = SQLiteSeenStore(path)
+    assert first.check_and_add("https://example.com/a") is False
+    assert second.check_and_add("https://example.com/a") is True
+    first.close()
+    second.close()
+
+    reopened = SQLiteSeenStore(path)
+    assert "https://example.com/a" in reopened
+    assert len(reopened) == 1
+    reopened.close()
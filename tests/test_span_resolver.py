@@ -0,0 +1,81 @@
+"""SpanResolver finds the spans of a compact response in examples/example.html with either engine."""
+
+import json
+import os
+
+import pytest
+
+from CrawlToW3C.span_resolver import SpanResolver, expand_response
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(__file__), '..', 'examples')
+URL = "https://example.com/"
+ENGINES = ['lxml', 'bs4']
+
+# Where each text line of examples/example.processed.txt is, in examples/example.html
+# (spans occurring more than once resolve to their first element)
+EXPECTED_XPATHS = [
+    '/html/head/title',
+    '/html/body/main/h1', '/html/body/main/h1', '/html/body/main/h1',
+    '/html/body/main/h1', '/html/body/main/h1', '/html/body/main/h1',
+    '/html/body/main/p',
+    '/html/body/p[1]', '/html/body/p[2]', '/html/body/p[3]',
+    '/html/body/details/p[1]', '/html/body/details/p[2]', '/html/body/details/p[3]', '/html/body/details/p[4]',
+    '/html/body/details/p[1]',
+    '/html/body/section/p', '/html/body/p[4]', '/html/body/div/div/p', '/html/body/p[5]',
+    '/html/body/article/p', '/html/body/aside/p',
+]
+
+
+def _read_example(name):
+    with open(os.path.join(EXAMPLES_DIR, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def _text_spans():
+    """The lines of the golden process_html output holding text (not images), as the model would copy them."""
+    lines = _read_example('example.processed.txt').splitlines()
+    return [line for line in lines if line.strip() and not line.startswith('<img')]
+
+
+@pytest.fixture(params=ENGINES)
+def resolver(request):
+    return SpanResolver(URL, _read_example('example.html'), engine=request.param)
+
+
+def test_every_processed_block_resolves(resolver):
+    xpaths = [resolver.annotation(span)["target"]["selector"].get("value") for span in _text_spans()]
+
+    assert xpaths == EXPECTED_XPATHS
+
+
+def test_span_around_ruby_annotation_resolves(resolver):
+    # process_html drops the <rt> text between "ruby base" and "CTRL", so the DOM must too
+    lorem = next(span for span in _text_spans() if 'ruby base CTRL' in span)
+    annotation = resolver.annotation(lorem)
+
+    assert annotation["target"]["selector"] == {"type": "XPathSelector", "value": "/html/body/main/p"}
+    assert resolver.locate("ruby base CTRL+ALT+CANC") == "/html/body/main/p"
+
+
+@pytest.mark.parametrize('text', ['annotation', 'Hidden content (after page loaded).'])
+def test_non_text_elements_are_not_searched(resolver, text):
+    assert resolver.locate(text) is None
+
+
+def test_unlocated_span_keeps_a_text_quote(resolver):
+    annotation = resolver.annotation("A sentence the page does not contain.")
+
+    assert annotation["target"]["selector"]["type"] == "TextQuoteSelector"
+
+
+def test_engines_build_the_same_annotations():
+    content = json.dumps({"spans": _text_spans() + ["Not on the page."], "entities": []})
+    expanded = {}
+    for engine in ENGINES:
+        stats = {}
+        resolver = SpanResolver(URL, _read_example('example.html'), engine=engine)
+        expanded[engine] = json.loads(expand_response(content, resolver, stats=stats))
+        # A span repeated on the page makes one annotation
+        assert stats == {"spans": 18, "located": 17}
+
+    assert expanded['lxml'] == expanded['bs4']
@@ -0,0 +1,88 @@
+"""CDXJ index: entries, offset reads and byte ranges of a WARC."""
+
+import os
+import time
+
+import pytest
+
+from CrawlToW3C.process_warc import (
+    get_urls_by_scanning, get_urls_from_index, iter_html_responses, iter_html_responses_range,
+    read_html_response_at, split_offset_ranges,
+)
+from CrawlToW3C.warc_index import build_index, has_fresh_index, index_path, is_html, iter_index, load_index, surt
+
+from conftest import PAGES
+
+HTML_URLS = [url for url, content_type, _ in PAGES if "text/html" in content_type]
+
+
+def test_surt():
+    assert surt("https://www.Example.com/A?b=1") == "com,example)/a?b=1"
+    assert surt("http://example.org") == "org,example)/"
+
+
+def test_build_index_lists_response_records(warc_file):
+    entries = build_index(warc_file)
+    assert [entry["url"] for entry in entries] == [url for url, _, _ in PAGES]
+    assert [entry["url"] for entry in entries if is_html(entry)] == HTML_URLS
+    assert all(entry["record_id"].startswith("<urn:uuid:") for entry in entries)
+    offsets = [entry["offset"] for entry in entries]
+    assert offsets == sorted(offsets) and offsets[0] > 0  # the warcinfo record comes first
+    assert list(iter_index(warc_file)) == entries
+
+
+def test_read_html_response_at_index_offsets(warc_file):
+    for entry in build_index(warc_file):
+        response = read_html_response_at(warc_file, entry["offset"])
+        if not is_html(entry):
+            assert response is None
+            continue
+        url, html, metadata = response
+        assert url == entry["url"]
+        assert metadata["warc_offset"] == entry["offset"]
+        assert metadata["warc_length"] == entry["length"]
+        assert metadata["warc_record_id"] == entry["record_id"]
+        assert html == dict((u, body) for u, _, body in PAGES)[url]
+
+
+def test_offsets_match_a_sequential_read(warc_file):
+    entries = {entry["url"]: entry for entry in build_index(warc_file)}
+    responses = list(iter_html_responses([warc_file]))
+    assert [url for url, _, _ in responses] == HTML_URLS
+    for url, _, metadata in responses:
+        assert metadata["warc_offset"] == entries[url]["offset"]
+
+
+def test_resume_from_an_index_offset(warc_file):
+    third = [entry for entry in build_index(warc_file) if is_html(entry)][2]
+    responses = iter_html_responses([warc_file], start_offsets={warc_file: third["offset"]})
+    assert [url for url, _, _ in responses] == HTML_URLS[2:]
+
+
+@pytest.mark.parametrize("segment_bytes", [1, 500, 10 ** 9])
+def test_offset_ranges_cover_every_record_once(warc_file, segment_bytes):
+    build_index(warc_file)
+    ranges = split_offset_ranges(warc_file, segment_bytes=segment_bytes)
+    assert ranges[-1][1] == os.path.getsize(warc_file)
+    assert all(end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+    urls = [url for start, end in ranges for url, _, _ in iter_html_responses_range(warc_file, start, end)]
+    assert urls == HTML_URLS
+
+
+def test_index_urls_match_a_scan(warc_file):
+    assert get_urls_from_index([warc_file]) == get_urls_by_scanning([warc_file]) == HTML_URLS
+
+
+def test_stale_index_is_rebuilt(warc_file):
+    assert not has_fresh_index(warc_file)
+    with pytest.raises(FileNotFoundError):
+        load_index(warc_file, build=False)
+    entries = load_index(warc_file)
+    assert has_fresh_index(warc_file)
+
+    # Rewriting the archive makes the index stale
+    stale = time.time() - 60
+    os.utime(index_path(warc_file), (stale, stale))
+    assert not has_fresh_index(warc_file)
+    assert load_index(warc_file) == entries
+    assert has_fresh_index(warc_file)